@@ -0,0 +1,152 @@
+import argparse
+import copy
+import glob
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+import yaml
+import dotenv
+
+dotenv.load_dotenv()
+from src.Project import Project
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="複数のデッキ (config.yml / .pptx / png_txt のディレクトリ) をまとめて動画にする"
+    )
+    parser.add_argument("inputs", type=str, nargs="+", help="パスまたは glob")
+    parser.add_argument(
+        "--config_path",
+        type=Path,
+        default="samples/from_pptx/config.yml",
+        help=".pptx やディレクトリを渡したときに使う設定",
+    )
+    parser.add_argument("--output_dir", type=Path, default=None)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--max_decks", type=int, default=4)
+    parser.add_argument("--report_path", type=Path, default="batch_report.json")
+    args = parser.parse_args()
+    return args
+
+
+def load_config(path: Path):
+    with open(path, "r", encoding="utf8") as f:
+        return yaml.safe_load(f)
+
+
+def make_configs(args):
+    """入力ごとの config を作る"""
+    paths = []
+    for pattern in args.inputs:
+        # Windows のシェルは glob を展開しないのでここで展開する
+        matched = sorted(glob.glob(pattern, recursive=True))
+        paths += [Path(p) for p in matched] if len(matched) > 0 else [Path(pattern)]
+
+    base_config = None
+    configs = []
+    for path in paths:
+        if path.suffix in (".yml", ".yaml"):
+            config = load_config(path)
+        else:
+            if base_config is None:
+                base_config = load_config(args.config_path)
+            config = copy.deepcopy(base_config)
+            input_type = "pptx" if path.suffix.lower() == ".pptx" else "png_txt"
+            config["input"] = dict(config["input"], type=input_type, path=str(path))
+            config["output"]["path"] = str(path.with_suffix(".mp4"))
+        if args.output_dir is not None:
+            name = Path(config["output"]["path"]).name
+            config["output"]["path"] = str(args.output_dir / name)
+        configs.append((str(path), config))
+    return configs
+
+
+def export_deck(name, config, tts, executor):
+    result = {
+        "input": name,
+        "output": config["output"]["path"],
+        "ok": False,
+        "seconds": None,
+        "slides": None,
+        "rendered_slides": None,
+        "errors": "",
+    }
+    start = time.time()
+    try:
+        with Project(config, tts=tts) as project:
+            if project.errors == "":
+                Path(config["output"]["path"]).parent.mkdir(parents=True, exist_ok=True)
+                result["slides"] = len(project.list_slides())
+                result["ok"] = project.export_video(executor=executor)
+                result["rendered_slides"] = project.rendered_slides
+            result["errors"] = project.errors
+    except Exception as e:
+        result["errors"] += f"{e}\n"
+    if not result["ok"] and result["errors"] == "":
+        result["errors"] = "Failed to export video (no slides?)\n"
+    result["ok"] = result["ok"] and result["errors"] == ""
+    result["seconds"] = time.time() - start
+    print(f"[{'ok' if result['ok'] else 'failed'}] {name} ({result['seconds']:.1f}s)")
+    return result
+
+
+def main(args):
+    configs = make_configs(args)
+    if len(configs) <= 0:
+        print("No inputs")
+        return
+
+    start = time.time()
+    # 音声合成のクライアントとキャッシュは、設定が同じデッキ同士で共有する
+    tts_clients = {}
+    for _, config in configs:
+        key = Project.tts_settings(config["output"])
+        if key not in tts_clients:
+            tts_clients[key] = Project.create_tts(config["output"])
+
+    # エンコードのワーカープロセスは全デッキで共有し、空いたワーカーにどのデッキのスライドでも割り当てる
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        with ThreadPoolExecutor(max_workers=args.max_decks) as deck_executor:
+            futures = [
+                deck_executor.submit(
+                    export_deck,
+                    name,
+                    config,
+                    tts_clients[Project.tts_settings(config["output"])],
+                    executor,
+                )
+                for name, config in configs
+            ]
+            results = [f.result() for f in futures]
+
+    report = {
+        "seconds": time.time() - start,
+        "workers": args.workers,
+        "succeeded": sum(r["ok"] for r in results),
+        "failed": sum(not r["ok"] for r in results),
+        "decks": results,
+        "tts_cache": [
+            tts.cache.stats() for tts in tts_clients.values() if tts.cache is not None
+        ],
+    }
+    for tts in tts_clients.values():
+        tts.close()
+
+    args.report_path.parent.mkdir(parents=True, exist_ok=True)
+    args.report_path.write_text(
+        json.dumps(report, ensure_ascii=False, indent=2), encoding="utf8"
+    )
+    print(
+        f"{report['succeeded']}/{len(results)} decks exported in "
+        f"{report['seconds']:.1f}s (report: {args.report_path})"
+    )
+    for r in results:
+        if not r["ok"]:
+            print(f"Failed: {r['input']}\n{r['errors']}")
+
+
+if __name__ == "__main__":
+    main(parse_args())
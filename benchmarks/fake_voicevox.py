@@ -0,0 +1,184 @@
+import argparse
+import hashlib
+import io
+import json
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+# 句読点でアクセント句を区切り、後ろに無音 (pause_mora) を入れる
+PAUSE_CHARS = "、。，．,.!?！？"
+
+
+def make_audio_query(text: str, speaker: int) -> dict:
+    """1 文字を 1 モーラとみなした audio_query の結果"""
+    phrases = []
+    moras = []
+    for c in text:
+        if c in PAUSE_CHARS:
+            if len(moras) > 0:
+                pause = {"text": "、", "vowel": "pau", "vowel_length": 0.2}
+                phrases.append({"moras": moras, "pause_mora": pause})
+                moras = []
+            continue
+        # 文字から決まる長さにして、同じテキストなら同じ結果になるようにする
+        seed = hashlib.sha256(f"{c}{speaker}".encode("utf8")).digest()[0]
+        moras.append(
+            {
+                "text": c,
+                "consonant": "k",
+                "consonant_length": 0.03 + seed % 4 * 0.01,
+                "vowel": "aiueo"[seed % 5],
+                "vowel_length": 0.07 + seed % 5 * 0.01,
+                "pitch": 5.0,
+            }
+        )
+    if len(moras) > 0:
+        phrases.append({"moras": moras, "pause_mora": None})
+    return {
+        "accent_phrases": [dict(p, accent=1, is_interrogative=False) for p in phrases],
+        "speedScale": 1.0,
+        "pitchScale": 0.0,
+        "intonationScale": 1.0,
+        "volumeScale": 1.0,
+        "prePhonemeLength": 0.1,
+        "postPhonemeLength": 0.1,
+        "outputSamplingRate": 24000,
+        "outputStereo": False,
+        "kana": text,
+    }
+
+
+def synthesize(query: dict, speaker: int) -> bytes:
+    """母音の区間だけ鳴る正弦波の wav (16bit mono)。同じ入力なら同じバイト列になる"""
+    rate = int(query.get("outputSamplingRate", 24000))
+    speed = float(query.get("speedScale", 1.0))
+
+    # (長さ, 音を鳴らすか) の列
+    spans = [(query["prePhonemeLength"], False)]
+    for phrase in query["accent_phrases"]:
+        for mora in phrase["moras"]:
+            spans.append((mora.get("consonant_length") or 0.0, False))
+            spans.append((mora["vowel_length"], True))
+        if phrase.get("pause_mora") is not None:
+            spans.append((phrase["pause_mora"]["vowel_length"], False))
+    spans.append((query["postPhonemeLength"], False))
+
+    text = "".join(m["text"] for p in query["accent_phrases"] for m in p["moras"])
+    seed = hashlib.sha256(f"{text}{speaker}".encode("utf8")).digest()
+    freq = 150 + seed[0] % 250
+
+    chunks = []
+    for length, voiced in spans:
+        n = int(round(length / speed * rate))
+        if voiced:
+            t = np.arange(n) / rate
+            chunks.append(0.3 * np.sin(2 * np.pi * freq * t))
+        else:
+            chunks.append(np.zeros(n))
+    samples = (np.concatenate(chunks) * 32767).astype("<i2")
+
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(samples.tobytes())
+    return buf.getvalue()
+
+
+class FakeVoicevox:
+    """/version, /audio_query, /synthesis だけを実装したローカルの VOICEVOX の代わり
+
+    latency 秒だけ待ってから応答する。port=0 なら空いているポートを使う。
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0):
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _send(self, status: int, body: bytes, content_type: str):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if urlparse(self.path).path == "/version":
+                    self._send(
+                        200, json.dumps("0.0.0-fake").encode(), "application/json"
+                    )
+                else:
+                    self._send(404, b"{}", "application/json")
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with fake._lock:
+                    fake.requests += 1
+                time.sleep(fake.latency)
+
+                speaker = int(query.get("speaker", ["0"])[0])
+                if url.path == "/audio_query":
+                    data = make_audio_query(query["text"][0], speaker)
+                    self._send(200, json.dumps(data).encode(), "application/json")
+                elif url.path == "/synthesis":
+                    wav = synthesize(json.loads(body), speaker)
+                    self._send(200, wav, "audio/wav")
+                else:
+                    self._send(404, b"{}", "application/json")
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="VOICEVOX の代わりのローカルサーバー")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=50021)
+    parser.add_argument("--latency", type=float, default=0.05)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    fake = FakeVoicevox(args.host, args.port, args.latency)
+    print(f"[fake voicevox] listening on {fake.url}")
+    fake.server.serve_forever()
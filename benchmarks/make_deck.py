@@ -0,0 +1,61 @@
+import argparse
+import random
+from pathlib import Path
+
+from PIL import Image, ImageDraw, ImageFont
+
+KANA = "あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわをん"
+
+
+def make_line(rng: random.Random, length: int) -> str:
+    chars = [rng.choice(KANA) for _ in range(length)]
+    # ときどき読点を入れて、ポーズのある文にする
+    for i in range(8, length - 1, 12):
+        chars[i] = "、"
+    return "".join(chars) + "。"
+
+
+def make_deck(
+    out_dir: Path,
+    slides: int = 10,
+    lines: int = 3,
+    line_length: int = 30,
+    size=(1280, 720),
+    seed: int = 0,
+):
+    """スライドN.png とスライドN.txt の png_txt 形式のデッキを作る。seed が同じなら同じデッキになる"""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+    font = ImageFont.load_default()
+    for i in range(1, slides + 1):
+        color = tuple(rng.randrange(64, 256) for _ in range(3))
+        image = Image.new("RGB", size, color)
+        draw = ImageDraw.Draw(image)
+        draw.rectangle(
+            [size[0] // 10, size[1] // 5, size[0] * 9 // 10, size[1] * 3 // 5],
+            fill=(255, 255, 255),
+        )
+        draw.text((size[0] // 8, size[1] // 4), f"Slide {i}", fill=(0, 0, 0), font=font)
+        image.save(out_dir / f"スライド{i}.png")
+
+        text = "\n".join(make_line(rng, line_length) for _ in range(lines))
+        (out_dir / f"スライド{i}.txt").write_text(text, encoding="utf8")
+    return out_dir
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="ベンチマーク用の png_txt デッキを作る"
+    )
+    parser.add_argument("out_dir", type=Path)
+    parser.add_argument("--slides", type=int, default=10)
+    parser.add_argument("--lines", type=int, default=3)
+    parser.add_argument("--line_length", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    make_deck(args.out_dir, args.slides, args.lines, args.line_length, seed=args.seed)
@@ -0,0 +1,231 @@
+import argparse
+import concurrent.futures
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+from benchmarks.fake_voicevox import FakeVoicevox
+from benchmarks.make_deck import make_deck
+from src.Project import Project
+from src.Segments import concat_segments
+
+# 結果に影響するパラメータ。ベースラインと比べるときに揃っているか確認する
+PARAM_KEYS = [
+    "slides",
+    "lines",
+    "line_length",
+    "latency",
+    "fps",
+    "render_mode",
+    "tts_workers",
+    "workers",
+]
+STAGES = ["tts", "clip_construction", "subtitle_rasterization", "encode", "concat"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="偽の VOICEVOX と合成したデッキで書き出しの各段階の時間を測る"
+    )
+    parser.add_argument("--slides", type=int, default=10)
+    parser.add_argument("--lines", type=int, default=3)
+    parser.add_argument("--line_length", type=int, default=30)
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="TTS の応答の遅延 [秒]"
+    )
+    parser.add_argument("--fps", type=int, default=10)
+    parser.add_argument("--render_mode", type=str, default=None)
+    parser.add_argument("--tts_workers", type=int, default=4)
+    parser.add_argument(
+        "--workers", type=int, default=2, help="セグメント書き出しのワーカー数"
+    )
+    parser.add_argument("--output_path", type=Path, default="benchmarks/result.json")
+    parser.add_argument(
+        "--baseline_path", type=Path, default="benchmarks/baseline.json"
+    )
+    parser.add_argument(
+        "--save_baseline", action="store_true", help="結果をベースラインとして保存する"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="これ以上遅くなったら退行とみなす割合",
+    )
+    parser.add_argument("--keep_workdir", action="store_true")
+    return parser.parse_args()
+
+
+def make_config(args, workdir: Path, voicevox_url: str, name: str):
+    output = {
+        "path": str(workdir / f"{name}.mp4"),
+        "fps": args.fps,
+        "voicevox_url": voicevox_url,
+        "tts_workers": args.tts_workers,
+        # 毎回コールドキャッシュで測る
+        "tts_cache_dir": str(workdir / f"tts_cache_{name}"),
+        "insert_cache_dir": str(workdir / "insert_cache"),
+        "incremental": False,
+    }
+    if args.render_mode is not None:
+        output["render_mode"] = args.render_mode
+    return {
+        "input": {"type": "png_txt", "path": str(workdir / "deck")},
+        "output": output,
+    }
+
+
+def measure_stages(args, workdir: Path, voicevox_url: str):
+    """書き出しの各段階を 1 つずつ順に実行して時間を測る"""
+    config = make_config(args, workdir, voicevox_url, "stages")
+    timings = dict.fromkeys(STAGES, 0.0)
+    with Project(config) as project:
+        all_pairs = project.list_slides()
+        scripts = project.compile_manuscripts(all_pairs)
+
+        start = time.perf_counter()
+        for futures in project.prefetch_tts(scripts):
+            concurrent.futures.wait(futures)
+        timings["tts"] = time.perf_counter() - start
+
+        # 字幕のラスタライズの時間はクリップの組み立てから分けて数える
+        render = project.subtitle_renderer.render
+
+        def timed_render(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return render(*args, **kwargs)
+            finally:
+                timings["subtitle_rasterization"] += time.perf_counter() - start
+
+        project.subtitle_renderer.render = timed_render
+
+        segment_dir = workdir / "stage_segments"
+        segment_dir.mkdir(exist_ok=True)
+        segment_paths = []
+        video_seconds = 0.0
+        for i, ((img_path, _), script) in enumerate(zip(all_pairs, scripts)):
+            start = time.perf_counter()
+            clip = project.make_slide_clip(img_path, script)
+            timings["clip_construction"] += time.perf_counter() - start
+            video_seconds += clip.duration
+
+            # moviepy はフレームを書き出しながら合成するので、encode には合成も含まれる
+            segment_path = segment_dir / f"{i}.mp4"
+            start = time.perf_counter()
+            project.encode_segment(clip, segment_path, script.video is None)
+            timings["encode"] += time.perf_counter() - start
+            segment_paths.append(segment_path)
+
+        start = time.perf_counter()
+        concat_segments(segment_paths, workdir / "stages.mp4")
+        timings["concat"] = time.perf_counter() - start
+
+    timings["clip_construction"] -= timings["subtitle_rasterization"]
+    return timings, video_seconds
+
+
+def measure_export(args, workdir: Path, voicevox_url: str, workers: int):
+    """Project.export_video 全体の時間"""
+    name = f"export_workers{workers}"
+    config = make_config(args, workdir, voicevox_url, name)
+    config["output"]["workers"] = workers
+    if workers <= 0:
+        # スライドごとに書き出さずに 1 回でエンコードする
+        config["output"]["checkpoint"] = False
+    start = time.perf_counter()
+    with Project(config) as project:
+        ok = project.export_video()
+        if not ok:
+            raise RuntimeError(project.errors)
+    return time.perf_counter() - start
+
+
+def compare(result, baseline, tolerance: float):
+    """ベースラインより tolerance 以上遅くなった項目を返す"""
+    regressions = []
+    pairs = [
+        (f"stages.{k}", result["stages"][k], baseline["stages"].get(k)) for k in STAGES
+    ]
+    pairs += [
+        (f"export_video.{k}", v, baseline["export_video"].get(k))
+        for k, v in result["export_video"].items()
+    ]
+    for name, value, base in pairs:
+        if base is None or base <= 0:
+            continue
+        ratio = value / base
+        print(f"{name:36s} {value:8.3f}s  baseline {base:8.3f}s  x{ratio:.2f}")
+        if ratio > 1 + tolerance and value - base > 0.05:
+            regressions.append(name)
+    return regressions
+
+
+def main(args):
+    if os.environ.get("MANUSCRIPTS_FONT") is None:
+        print("MANUSCRIPTS_FONT is not set; subtitles are not burned in or measured")
+
+    workdir = Path(tempfile.mkdtemp(prefix="pptx_to_video_bench_"))
+    try:
+        make_deck(workdir / "deck", args.slides, args.lines, args.line_length)
+        with FakeVoicevox(latency=args.latency) as fake:
+            stages, video_seconds = measure_stages(args, workdir, fake.url)
+            export_video = {
+                "single_pass": measure_export(args, workdir, fake.url, 0),
+            }
+            if args.workers > 0:
+                export_video["segments"] = measure_export(
+                    args, workdir, fake.url, args.workers
+                )
+            tts_requests = fake.requests
+    finally:
+        if args.keep_workdir:
+            print("workdir:", workdir)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {
+        "params": {key: getattr(args, key) for key in PARAM_KEYS},
+        "env": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "video_seconds": video_seconds,
+        "tts_requests": tts_requests,
+        "stages": stages,
+        "export_video": export_video,
+    }
+    args.output_path.parent.mkdir(parents=True, exist_ok=True)
+    args.output_path.write_text(json.dumps(result, indent=2), encoding="utf8")
+
+    for name in STAGES:
+        print(f"{name:24s} {stages[name]:8.3f}s")
+    for name, seconds in export_video.items():
+        label = f"export_video ({name})"
+        print(f"{label:24s} {seconds:8.3f}s ({video_seconds / seconds:.1f}x realtime)")
+
+    if args.save_baseline:
+        shutil.copyfile(args.output_path, args.baseline_path)
+        print("Saved baseline to", args.baseline_path)
+        return 0
+
+    if args.baseline_path.exists():
+        baseline = json.loads(args.baseline_path.read_text(encoding="utf8"))
+        if baseline["params"] != result["params"]:
+            print("Warning: baseline was measured with different parameters")
+        regressions = compare(result, baseline, args.tolerance)
+        if len(regressions) > 0:
+            print("Regressions:", ", ".join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_args()))
@@ -0,0 +1,154 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+
+# Streamlit のサーバーを立てずに app.py を 1 回実行し、最初の画面ができるまでを測る
+STREAMLIT_FIRST_PAINT = """
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file("streamlit/app.py", default_timeout={timeout})
+app.run()
+if len(app.exception) > 0:
+    raise SystemExit(str(app.exception[0].message))
+"""
+
+COMMANDS = {
+    # 設定を読む前に終わるので、ほぼ import の時間
+    "cli_help": [sys.executable, "pptx_to_video.py", "--help"],
+    "import_project": [sys.executable, "-c", "import src.Project"],
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="CLI の起動と Streamlit の最初の表示までの時間を新しいプロセスで測る"
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument(
+        "--output_path", type=Path, default="benchmarks/startup_result.json"
+    )
+    parser.add_argument(
+        "--baseline_path", type=Path, default="benchmarks/startup_baseline.json"
+    )
+    parser.add_argument(
+        "--save_baseline", action="store_true", help="結果をベースラインとして保存する"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="これ以上遅くなったら退行とみなす割合",
+    )
+    parser.add_argument(
+        "--importtime",
+        action="store_true",
+        help="src.Project の import で時間のかかったモジュールを表示する",
+    )
+    return parser.parse_args()
+
+
+def measure(command, repeat: int, timeout: float):
+    """コマンドを repeat 回起動し、終了までの時間の中央値を返す"""
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(
+            command, cwd=ROOT, capture_output=True, check=True, timeout=timeout
+        )
+        seconds.append(time.perf_counter() - start)
+    return statistics.median(seconds)
+
+
+def has_streamlit() -> bool:
+    result = subprocess.run(
+        [sys.executable, "-c", "import streamlit.testing.v1"],
+        cwd=ROOT,
+        capture_output=True,
+    )
+    return result.returncode == 0
+
+
+def print_importtime(top: int = 15):
+    """python -X importtime の出力から、累積時間の長いモジュールを表示する"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import src.Project"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        fields = line.removeprefix("import time:").split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        rows.append((int(fields[1]), fields[2].rstrip()))
+    for cumulative, name in sorted(rows, reverse=True)[:top]:
+        print(f"{cumulative / 1000:8.1f}ms {name}")
+
+
+def main(args):
+    startup = {
+        name: measure(command, args.repeat, args.timeout)
+        for name, command in COMMANDS.items()
+    }
+    if has_streamlit():
+        code = STREAMLIT_FIRST_PAINT.format(timeout=args.timeout)
+        startup["streamlit_first_paint"] = measure(
+            [sys.executable, "-c", code], args.repeat, args.timeout
+        )
+    else:
+        print("streamlit is not installed; skipping streamlit_first_paint")
+    # インタプリタ自体の起動時間。上の値から引けば import と処理の時間になる
+    startup["python"] = measure([sys.executable, "-c", "pass"], args.repeat, 10.0)
+
+    result = {
+        "params": {"repeat": args.repeat},
+        "env": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "startup": startup,
+    }
+    args.output_path.parent.mkdir(parents=True, exist_ok=True)
+    args.output_path.write_text(json.dumps(result, indent=2), encoding="utf8")
+
+    for name, seconds in startup.items():
+        print(f"{name:24s} {seconds:8.3f}s")
+    if args.importtime:
+        print_importtime()
+
+    if args.save_baseline:
+        shutil.copyfile(args.output_path, args.baseline_path)
+        print("Saved baseline to", args.baseline_path)
+        return 0
+
+    if args.baseline_path.exists():
+        baseline = json.loads(args.baseline_path.read_text(encoding="utf8"))
+        regressions = []
+        for name, value in startup.items():
+            base = baseline["startup"].get(name)
+            if base is None or base <= 0:
+                continue
+            ratio = value / base
+            print(f"{name:24s} {value:8.3f}s  baseline {base:8.3f}s  x{ratio:.2f}")
+            if ratio > 1 + args.tolerance and value - base > 0.05:
+                regressions.append(name)
+        if len(regressions) > 0:
+            print("Regressions:", ", ".join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_args()))
@@ -1,38 +1,126 @@
 import argparse
+import json
+import math
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
-import yaml
-import time
+from urllib.parse import parse_qs, urlparse
 import dotenv
 
 dotenv.load_dotenv()
-from src.Project import Project
+from src.PptxImporter import import_pptx
+from src.JobQueue import JobQueue
+from src.Profiler import Profiler
+
+
+# GET /jobs/<id>?wait=<sec> で待つ最長の秒数。クライアントはこれより短い間隔で聞き直す
+MAX_WAIT = 60.0
 
 
 def parse_args():
     parser = argparse.ArgumentParser(description="")
-    parser.add_argument(
-        "--watch_dir", type=Path, default="__pptx_import_server__watch_dir__"
-    )
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=50080)
+    parser.add_argument("--workers", type=int, default=1)
     args = parser.parse_args()
     return args
 
 
-def main(args):
-    while True:
-        all_config_paths = Path(args.watch_dir).glob("*.yml")
-        for config_path in all_config_paths:
+def run_import(config, profiler: Profiler, on_progress):
+    # Project は作らない。TTS やキャッシュの準備はインポートには要らない
+    pptx_path = Path(config["input"]["path"])
+    workdir = pptx_path.with_suffix("")
+    workdir.mkdir(parents=True, exist_ok=True)
+    on_progress(0.0, f"Importing {pptx_path}")
+    profiler.count("import_jobs")
+    try:
+        with profiler.span("import_job", "import", path=str(pptx_path)):
+            import_pptx(pptx_path, workdir, config["input"], on_progress)
+    except Exception:
+        profiler.count("import_failures")
+        raise
+    return str(workdir)
+
+
+def make_handler(job_queue: JobQueue, profiler: Profiler):
+    class Handler(BaseHTTPRequestHandler):
+        def _send_json(self, status: int, data):
+            body = json.dumps(data, ensure_ascii=False).encode("utf8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        # POST /jobs : config (json) を受け取ってインポートを開始し、job id を返す
+        def do_POST(self):
+            if urlparse(self.path).path != "/jobs":
+                self._send_json(404, {"error": "not found"})
+                return
             try:
-                with open(config_path, "r", encoding="utf8") as f:
-                    config = yaml.safe_load(f)
-                Project(config)
+                n = int(self.headers.get("Content-Length", 0))
+                config = json.loads(self.rfile.read(n))
             except Exception as e:
-                import traceback
+                self._send_json(400, {"error": f"invalid config: {e}"})
+                return
+            job_id = job_queue.submit(run_import, config, profiler)
+            print(f"[import server] queued {job_id}: {config['input']['path']}")
+            self._send_json(202, {"job_id": job_id})
+
+        # GET /jobs/<id>?wait=<sec> : ジョブの状態。wait を指定すると終わるまで待つ
+        # GET /stats : キューの深さや待ち時間
+        # GET /trace?format=chrome : インポートの時間とカウンタ
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/stats":
+                self._send_json(200, job_queue.stats())
+                return
 
-                print(e, traceback.format_exc())
-            finally:
-                config_path.unlink()
+            if url.path == "/trace":
+                fmt = parse_qs(url.query).get("format", ["json"])[0]
+                if fmt == "chrome":
+                    self._send_json(200, profiler.to_chrome_trace())
+                else:
+                    self._send_json(200, profiler.to_json())
+                return
 
-        time.sleep(1)
+            if url.path.startswith("/jobs/"):
+                job_id = url.path[len("/jobs/") :]
+                try:
+                    wait = float(parse_qs(url.query).get("wait", ["0"])[0])
+                except ValueError:
+                    wait = math.nan
+                if not math.isfinite(wait):
+                    self._send_json(400, {"error": "wait must be a number of seconds"})
+                    return
+                # 待っている間はハンドラのスレッドを占有するので、長く待たせない
+                wait = min(wait, MAX_WAIT)
+                job = job_queue.wait(job_id, timeout=wait) if wait > 0 else None
+                job = job or job_queue.get(job_id)
+                if job is None:
+                    self._send_json(404, {"error": f"unknown job {job_id}"})
+                else:
+                    self._send_json(200, job)
+                return
+
+            self._send_json(404, {"error": "not found"})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main(args):
+    job_queue = JobQueue(max_workers=args.workers)
+    profiler = Profiler()
+    server = ThreadingHTTPServer(
+        (args.host, args.port), make_handler(job_queue, profiler)
+    )
+    print(f"[import server] listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    finally:
+        job_queue.shutdown(wait=False)
 
 
 if __name__ == "__main__":
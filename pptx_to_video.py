@@ -15,6 +15,23 @@ def parse_args():
     parser.add_argument("--pptx_path", type=Path, default=None)
     parser.add_argument("--png_txt_dir", type=Path, default=None)
     parser.add_argument("--output_path", type=Path, default=None)
+    parser.add_argument(
+        "--preview",
+        action="store_true",
+        help="下書き用に低解像度・低 fps で速く書き出す (--profile preview と同じ)",
+    )
+    parser.add_argument("--profile", type=str, default=None)
+    parser.add_argument(
+        "--slides",
+        type=str,
+        default=None,
+        help="書き出すスライドの範囲 (例: 3-10, 5-, 7)",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="前回途中で止まった書き出しを、書き出し済みのスライドを飛ばして続ける",
+    )
     args = parser.parse_args()
     return args
 
@@ -34,6 +51,22 @@ def main(args):
     if args.output_path is not None:
         config["output"]["filename"] = args.output_path
 
+    if args.preview:
+        config["profile"] = "preview"
+    if args.profile is not None:
+        config["profile"] = args.profile
+
+    if args.slides is not None:
+        first, _, last = args.slides.partition("-")
+        last = last if "-" in args.slides else first
+        config["output"]["slide_range"] = [
+            int(first) if first != "" else None,
+            int(last) if last != "" else None,
+        ]
+
+    if args.resume:
+        config["output"]["resume"] = True
+
     print("config:", config)
 
     # Create project
@@ -43,8 +76,9 @@ def main(args):
         ok = project.export_video()
         if not ok:
             print("Failed to export video")
+            print(project.errors)
             return
-        print("Successefully exported video to", config["output"]["path"])
+        print("Successefully exported video to", project.config["output"]["path"])
 
 
 if __name__ == "__main__":
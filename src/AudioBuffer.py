@@ -0,0 +1,26 @@
+import io
+import wave
+
+import numpy as np
+
+
+def decode_wav(data: bytes, channels: int = 2):
+    """16bit PCM の wav をデコードして ((サンプル数, channels) の float32 配列, サンプリングレート) を返す"""
+    with wave.open(io.BytesIO(data), "rb") as f:
+        if f.getsampwidth() != 2:
+            raise ValueError(f"Unsupported sample width: {f.getsampwidth()}")
+        rate = f.getframerate()
+        n_channels = f.getnchannels()
+        frames = f.readframes(f.getnframes())
+
+    samples = np.frombuffer(frames, dtype="<i2").astype(np.float32) / 32768
+    samples = samples.reshape(-1, n_channels)
+    if n_channels == 1 and channels > 1:
+        samples = np.repeat(samples, channels, axis=1)
+    elif n_channels != channels:
+        samples = samples.mean(axis=1, keepdims=True).repeat(channels, axis=1)
+    return samples, rate
+
+
+def silence(duration: float, rate: int, channels: int = 2) -> np.ndarray:
+    return np.zeros((max(int(round(duration * rate)), 0), channels), dtype=np.float32)
@@ -0,0 +1,23 @@
+import proglog
+
+from .Profiler import StageProgress
+
+
+class EncodeProgressLogger(proglog.TqdmProgressBarLogger):
+    """moviepy の書き出しのフレーム数を encode 段階の進捗として伝える"""
+
+    def __init__(self, progress: StageProgress):
+        super().__init__()
+        self.progress = progress
+        self._percent = -1
+
+    def bars_callback(self, bar, attr, value, old_value=None):
+        super().bars_callback(bar, attr, value, old_value)
+        # "t" は映像のフレームのバー ("chunk" は音声)
+        if bar != "t" or attr != "index" or not self.bars[bar]["total"]:
+            return
+        fraction = (value + 1) / self.bars[bar]["total"]
+        # フレームごとに伝えると多すぎるので 1% ごとにする
+        if int(fraction * 100) > self._percent:
+            self._percent = int(fraction * 100)
+            self.progress.update("encode", fraction, "Writing a video file")
@@ -0,0 +1,136 @@
+import threading
+import time
+from typing import List
+
+import requests
+
+
+class Engine:
+    """VOICEVOX エンジン 1 つぶんの状態"""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.healthy = True
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.last_error = None
+        # 落ちているエンジンをもう一度確認する時刻
+        self.retry_at = 0.0
+
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "mean_latency": (
+                self.total_latency / self.requests if self.requests > 0 else None
+            ),
+            "max_latency": self.max_latency,
+            "last_error": self.last_error,
+        }
+
+
+class NoEngineAvailable(requests.ConnectionError):
+    pass
+
+
+class EnginePool:
+    """複数の VOICEVOX エンジンに、処理中のリクエストが最も少ないものから割り当てる
+
+    失敗したエンジンはいったん外し、health_interval 秒ごとに /version で確認して戻す。
+    """
+
+    def __init__(
+        self,
+        urls: List[str],
+        session: requests.Session,
+        timeout: float = 5.0,
+        health_interval: float = 10.0,
+    ):
+        if len(urls) <= 0:
+            raise ValueError("No VOICEVOX engine URL")
+        self.engines = [Engine(url) for url in urls]
+        self.session = session
+        self.timeout = timeout
+        self.health_interval = health_interval
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.engines)
+
+    def acquire(self) -> Engine:
+        """リクエストを送るエンジンを選ぶ。終わったら release() を呼ぶ"""
+        self._recheck()
+        if not any(e.healthy for e in self.engines):
+            # 全部外れていたら、待たずにもう一度確認する
+            self._recheck(force=True)
+        with self._lock:
+            healthy = [e for e in self.engines if e.healthy]
+            if len(healthy) <= 0:
+                errors = ", ".join(f"{e.url}: {e.last_error}" for e in self.engines)
+                raise NoEngineAvailable(f"No healthy VOICEVOX engine ({errors})")
+            # 同じ数なら平均の応答が速いほう
+            engine = min(
+                healthy,
+                key=lambda e: (
+                    e.outstanding,
+                    e.total_latency / e.requests if e.requests > 0 else 0.0,
+                ),
+            )
+            engine.outstanding += 1
+            return engine
+
+    def release(self, engine: Engine, latency: float = None, error: Exception = None):
+        with self._lock:
+            engine.outstanding -= 1
+            if error is None:
+                engine.requests += 1
+                engine.total_latency += latency or 0.0
+                engine.max_latency = max(engine.max_latency, latency or 0.0)
+                return
+            engine.failures += 1
+            engine.last_error = str(error)
+            # 1 つしかなければ外さずにリトライさせる
+            if len(self.engines) > 1:
+                engine.healthy = False
+                engine.retry_at = time.time() + self.health_interval
+                print(f"[EnginePool] {engine.url} is out of rotation: {error}")
+
+    def check(self, engine: Engine) -> bool:
+        """/version に応答すれば戻す"""
+        try:
+            res = self.session.get(engine.url + "/version", timeout=self.timeout)
+            res.raise_for_status()
+        except requests.RequestException as e:
+            with self._lock:
+                engine.last_error = str(e)
+                engine.retry_at = time.time() + self.health_interval
+            return False
+        with self._lock:
+            if not engine.healthy:
+                print(f"[EnginePool] {engine.url} is back in rotation")
+            engine.healthy = True
+        return True
+
+    def _recheck(self, force: bool = False):
+        now = time.time()
+        with self._lock:
+            due = [
+                e
+                for e in self.engines
+                if not e.healthy and (force or e.retry_at <= now)
+            ]
+            # 同時に何度も確認しないように、次の確認時刻を先に進めておく
+            for engine in due:
+                engine.retry_at = now + self.health_interval
+        for engine in due:
+            self.check(engine)
+
+    def stats(self) -> List[dict]:
+        with self._lock:
+            return [engine.stats() for engine in self.engines]
@@ -0,0 +1,75 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+
+class ExportJournal:
+    """スライドごとに終わった段階 (音声の合成・セグメントの書き出し) を記録するジャーナル
+
+    1 行 1 レコードの JSON で、記録するたびにディスクに書き出す。
+    書き出しが途中で落ちても、resume=True で開き直せば終わったスライドを飛ばせる。
+    """
+
+    def __init__(self, path: Path, resume: bool = False):
+        self.path = Path(path)
+        self.entries = []
+        self._lock = threading.Lock()
+        if resume:
+            self.entries = self._load()
+        else:
+            self.path.unlink(missing_ok=True)
+
+    def _load(self):
+        entries = []
+        try:
+            lines = self.path.read_text(encoding="utf8").splitlines()
+        except FileNotFoundError:
+            return entries
+        for line in lines:
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                # 書きかけの最後の行は捨てる
+                continue
+        return entries
+
+    def record(self, slide: str, stage: str, **data):
+        """stage は "tts" | "segment" | "failed" """
+        entry = dict(data, slide=slide, stage=stage, time=time.time())
+        line = json.dumps(entry, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            self.entries.append(entry)
+            with open(self.path, "a", encoding="utf8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def remove(self):
+        """書き出しが終わって続きから書き出す必要がなくなったら消す"""
+        with self._lock:
+            self.entries = []
+            self.path.unlink(missing_ok=True)
+
+    def segments(self):
+        """書き出し済みでファイルが残っているセグメント。fingerprint -> レコード"""
+        with self._lock:
+            entries = list(self.entries)
+        return {
+            entry["fingerprint"]: entry
+            for entry in entries
+            if entry["stage"] == "segment" and Path(entry["segment"]).exists()
+        }
+
+    def failures(self):
+        """最後の記録が失敗になっているスライド。slide -> エラー"""
+        last = {}
+        with self._lock:
+            for entry in self.entries:
+                last[entry["slide"]] = entry
+        return {
+            slide: entry.get("error", "")
+            for slide, entry in last.items()
+            if entry["stage"] == "failed"
+        }
@@ -0,0 +1,109 @@
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Tuple
+
+import numpy as np
+from PIL import Image
+
+from .Profiler import Profiler
+from .Segments import file_digest
+
+
+class ImageStore:
+    """書き出し 1 回ぶんのスライド画像のストア
+
+    画像は内容のハッシュをキーにして 1 回だけデコードし、同じ内容のスライドは
+    同じ配列 (書き込み不可) を共有する。デコード済みの配列の合計が max_bytes を
+    超えたら、最後に使われたのが古いものから手放す (LRU)。
+    scale には元の (幅, 高さ) から書き出す (幅, 高さ) を返す関数を渡す。
+    """
+
+    def __init__(
+        self,
+        scale: Callable[[Tuple[int, int]], Tuple[int, int]],
+        max_bytes: int = 256 * 1024 * 1024,
+        profiler: Profiler = None,
+    ):
+        self.scale = scale
+        self.max_bytes = max_bytes
+        self.profiler = profiler if profiler is not None else Profiler()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # (パス, mtime, サイズ) -> ハッシュ。同じファイルを何度もハッシュしない
+        self._digests = {}
+        # ハッシュ -> 書き出す (幅, 高さ)
+        self._sizes = {}
+        # ハッシュ -> デコードした配列。先頭ほど古い
+        self._images: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._total_bytes = 0
+
+    def digest(self, path: Path) -> str:
+        """画像の内容のハッシュ。ファイルが変わっていなければ計算し直さない"""
+        stat = os.stat(path)
+        key = (str(path), stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            digest = self._digests.get(key)
+        if digest is None:
+            digest = file_digest(path)
+            with self._lock:
+                self._digests[key] = digest
+        return digest
+
+    def size(self, path: Path) -> Tuple[int, int]:
+        """書き出す (幅, 高さ)。デコードせずにヘッダだけ読む"""
+        digest = self.digest(path)
+        with self._lock:
+            size = self._sizes.get(digest)
+        if size is None:
+            with Image.open(path) as image:
+                size = self.scale(image.size)
+            with self._lock:
+                self._sizes[digest] = size
+        return size
+
+    def get(self, path: Path) -> np.ndarray:
+        """画像を RGB の配列で返す。同じ内容の画像はデコード済みのものを共有する"""
+        digest = self.digest(path)
+        with self._lock:
+            array = self._images.get(digest)
+            if array is not None:
+                self._images.move_to_end(digest)
+                self.hits += 1
+        if array is not None:
+            self.profiler.count("image_cache_hits")
+            return array
+
+        # デコードしたらすぐにファイルを閉じる
+        with Image.open(path) as image:
+            image = image.convert("RGB")
+        size = self.scale(image.size)
+        if size != image.size:
+            image = image.resize(size, Image.BILINEAR)
+        array = np.asarray(image)
+        # 共有するので、使う側で書き換えられないようにする
+        array.setflags(write=False)
+        self.profiler.count("image_decodes")
+
+        with self._lock:
+            self.misses += 1
+            self._sizes[digest] = size
+            if digest not in self._images:
+                self._images[digest] = array
+                self._total_bytes += array.nbytes
+            # 今デコードしたものは残す
+            while self._total_bytes > self.max_bytes and len(self._images) > 1:
+                _, old = self._images.popitem(last=False)
+                self._total_bytes -= old.nbytes
+        return array
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "images": len(self._images),
+                "bytes": self._total_bytes,
+            }
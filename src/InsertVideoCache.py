@@ -0,0 +1,186 @@
+import hashlib
+import json
+import os
+import subprocess
+import threading
+from pathlib import Path
+
+from .Segments import ffmpeg_binary, file_digest, probe_h264_level, probe_video
+
+# stream copy してもスライドのセグメントと連結できる H.264 のプロファイル (8bit 4:2:0)
+COPY_PROFILES = ("Constrained Baseline", "Baseline", "Main", "High")
+# 1080p30 まで。これより上のレベルはハードウェアデコーダで再生できないことがある
+MAX_COPY_LEVEL = 41
+
+
+def mp4_timescale(fps: int) -> int:
+    """ffmpeg が fps の動画を mp4 に書くときのタイムスケール (1 秒を何分割するか)"""
+    timescale = fps
+    while timescale < 10000:
+        timescale *= 2
+    return timescale
+
+
+class InsertVideoCache:
+    """<video:> で挿入する動画を、スライドと同じ解像度・音声形式の mp4 にしてキャッシュする
+
+    コーデック・プロファイル・解像度・フレームレートがすでに合っていれば
+    再エンコードせずに (stream copy で) コピーし、
+    合っていなければ ffmpeg のスケーラで 1 回だけエンコードする。
+    キーは元の動画のハッシュと変換の設定なので、別のデッキで同じ動画を使っても 1 回で済む。
+    """
+
+    def __init__(self, cache_dir: Path, codec: str = "libx264", preset: str = "medium"):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.codec = codec
+        self.preset = preset
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # (パス, mtime, サイズ) -> 元の動画のハッシュ
+        self._digests = {}
+
+    def digest(self, video_path: Path) -> str:
+        """元の動画のハッシュ。ファイルが変わっていなければ計算し直さない
+
+        長い画面録画を何度も読まないように、ワーカープロセスと共有できる cache_dir にも
+        記録しておく
+        """
+        stat = os.stat(video_path)
+        memo = json.dumps(
+            [str(Path(video_path).resolve()), stat.st_mtime_ns, stat.st_size]
+        )
+        with self._lock:
+            digest = self._digests.get(memo)
+        if digest is not None:
+            return digest
+
+        memo_path = (
+            self.cache_dir / "digests" / hashlib.sha256(memo.encode()).hexdigest()
+        )
+        try:
+            digest = memo_path.read_text(encoding="utf8")
+        except FileNotFoundError:
+            digest = file_digest(video_path)
+            memo_path.parent.mkdir(exist_ok=True)
+            tmp_path = memo_path.with_name(
+                f"{memo_path.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+            )
+            tmp_path.write_text(digest, encoding="utf8")
+            os.replace(tmp_path, memo_path)
+        with self._lock:
+            self._digests[memo] = digest
+        return digest
+
+    def make_key(
+        self, video_path: Path, width: int, height: int, fps: float, audio_fps: int
+    ) -> str:
+        src = [self.digest(video_path), width, height, fps, audio_fps]
+        src += [self.codec, self.preset]
+        src = json.dumps(src)
+        return hashlib.sha256(src.encode("utf8")).hexdigest()
+
+    def get(
+        self, video_path: Path, width: int, height: int, fps: float, audio_fps: int
+    ) -> Path:
+        """変換済みの動画のパスを返す。なければ変換する"""
+        key = self.make_key(video_path, width, height, fps, audio_fps)
+        out_path = self.cache_dir / f"{key}.mp4"
+        with self._lock:
+            if out_path.exists():
+                self.hits += 1
+                return out_path
+            self.misses += 1
+
+        # 書きかけのファイルが使われないように rename で置き換える
+        tmp_path = out_path.with_name(f"{key}.{threading.get_ident()}.tmp.mp4")
+        cmd = self.command(video_path, tmp_path, width, height, fps, audio_fps)
+        try:
+            subprocess.run(cmd, check=True, capture_output=True)
+        except subprocess.CalledProcessError as e:
+            tmp_path.unlink(missing_ok=True)
+            raise RuntimeError(
+                f"Failed to convert {video_path}: {e.stderr.decode(errors='replace')}"
+            ) from e
+        os.replace(tmp_path, out_path)
+        return out_path
+
+    def command(
+        self,
+        video_path: Path,
+        out_path: Path,
+        width: int,
+        height: int,
+        fps: float,
+        audio_fps: int,
+    ):
+        info = probe_video(video_path)
+        copy_video = (
+            info["video_codec"] == "h264"
+            and self.codec == "libx264"
+            and info["pix_fmt"] == "yuv420p"
+            and info["profile"] in COPY_PROFILES
+            and (info["width"], info["height"]) == (width, height)
+            # 可変フレームレートや fps の違う動画をそのまま連結すると、音ずれやカクつきが出る
+            and float(fps).is_integer()
+            and info["fps"] == info["tbr"] == fps
+        )
+        if copy_video:
+            level = probe_h264_level(video_path)
+            copy_video = level is not None and level <= MAX_COPY_LEVEL
+        copy_audio = (
+            info["audio_codec"] == "aac"
+            and info["audio_rate"] == audio_fps
+            and info["audio_channels"] == "stereo"
+        )
+
+        cmd = [ffmpeg_binary(), "-y", "-loglevel", "error", "-i", str(video_path)]
+        if info["audio_codec"] is None:
+            # セグメントとして連結できるように、無音の音声トラックを付ける
+            cmd += [
+                "-f",
+                "lavfi",
+                "-i",
+                f"anullsrc=r={audio_fps}:cl=stereo",
+                "-shortest",
+            ]
+        cmd += [
+            "-map",
+            "0:v:0",
+            "-map",
+            "1:a:0" if info["audio_codec"] is None else "0:a:0",
+        ]
+
+        if copy_video:
+            # タイムベースをスライドのセグメントにそろえる
+            cmd += [
+                "-c:v",
+                "copy",
+                "-video_track_timescale",
+                str(mp4_timescale(int(fps))),
+            ]
+        else:
+            cmd += [
+                "-vf",
+                f"scale={width}:{height},setsar=1",
+                "-r",
+                str(fps),
+                "-c:v",
+                self.codec,
+                "-preset",
+                self.preset,
+                "-pix_fmt",
+                "yuv420p",
+            ]
+
+        if copy_audio:
+            cmd += ["-c:a", "copy"]
+        else:
+            cmd += ["-c:a", "aac", "-ar", str(audio_fps), "-ac", "2"]
+        cmd += ["-movflags", "+faststart", str(out_path)]
+        return cmd
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
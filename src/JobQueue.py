@@ -0,0 +1,161 @@
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+
+class JobQueue:
+    """ジョブを同時実行数を制限して実行し、進捗と結果を問い合わせられるようにする
+
+    ジョブの関数は on_progress(進捗 0-1, メッセージ) をキーワード引数で受け取る。
+    例外を投げずに終了したら succeeded、例外を投げたら failed になる。
+    state_dir を指定するとジョブの状態を json で保存し、プロセスを再起動しても
+    job id で問い合わせられる (結果は json にできる値にすること)。
+    """
+
+    def __init__(
+        self, max_workers: int = 1, max_history: int = 1000, state_dir: Path = None
+    ):
+        self.max_workers = max_workers
+        self.max_history = max_history
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="job"
+        )
+        self.jobs = {}
+        self._cond = threading.Condition()
+        self.state_dir = None if state_dir is None else Path(state_dir)
+        if self.state_dir is not None:
+            self.state_dir.mkdir(parents=True, exist_ok=True)
+            self._load()
+
+    def _load(self):
+        for path in self.state_dir.glob("*.json"):
+            try:
+                job = json.loads(path.read_text(encoding="utf8"))
+            except (OSError, ValueError):
+                continue
+            if job["state"] in ("queued", "running"):
+                # 前のプロセスで実行中だったジョブは再開できない
+                job.update(
+                    state="failed",
+                    error="Interrupted by a restart",
+                    finished_at=time.time(),
+                )
+                self._save(job)
+            self.jobs[job["id"]] = job
+        self._prune()
+
+    def _save(self, job):
+        if self.state_dir is None:
+            return
+        path = self.state_dir / f"{job['id']}.json"
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(job, ensure_ascii=False), encoding="utf8")
+        os.replace(tmp_path, path)
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+
+    def submit(self, fn, *args, **kwargs) -> str:
+        job_id = str(uuid.uuid4())
+        with self._cond:
+            self.jobs[job_id] = {
+                "id": job_id,
+                "state": "queued",
+                "progress": 0.0,
+                "message": "",
+                "error": None,
+                "result": None,
+                "submitted_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+            }
+            self._save(self.jobs[job_id])
+        self.executor.submit(self._run, job_id, fn, args, kwargs)
+        return job_id
+
+    def _update(self, job_id: str, **values):
+        with self._cond:
+            self.jobs[job_id].update(values)
+            self._save(self.jobs[job_id])
+            self._prune()
+            self._cond.notify_all()
+
+    def _prune(self):
+        # 終わったジョブは古いものから忘れる
+        finished = [j for j in self.jobs.values() if j["finished_at"] is not None]
+        if len(finished) <= self.max_history:
+            return
+        finished.sort(key=lambda j: j["finished_at"])
+        for job in finished[: len(finished) - self.max_history]:
+            del self.jobs[job["id"]]
+            if self.state_dir is not None:
+                (self.state_dir / f"{job['id']}.json").unlink(missing_ok=True)
+
+    def _run(self, job_id, fn, args, kwargs):
+        self._update(job_id, state="running", started_at=time.time())
+
+        def on_progress(progress: float, message: str):
+            self._update(job_id, progress=progress, message=message)
+
+        try:
+            result = fn(*args, on_progress=on_progress, **kwargs)
+            self._update(
+                job_id,
+                state="succeeded",
+                progress=1.0,
+                result=result,
+                finished_at=time.time(),
+            )
+        except Exception as e:
+            self._update(
+                job_id,
+                state="failed",
+                error=f"{e}\n{traceback.format_exc()}",
+                finished_at=time.time(),
+            )
+
+    def get(self, job_id: str):
+        with self._cond:
+            job = self.jobs.get(job_id)
+            return None if job is None else dict(job)
+
+    def wait(self, job_id: str, timeout: float = None):
+        """ジョブが終わるか timeout 秒経つまで待ち、その時点の状態を返す"""
+        with self._cond:
+            self._cond.wait_for(
+                lambda: (
+                    job_id not in self.jobs
+                    or self.jobs[job_id]["state"] in ("succeeded", "failed")
+                ),
+                timeout=timeout,
+            )
+        return self.get(job_id)
+
+    def stats(self):
+        with self._cond:
+            jobs = list(self.jobs.values())
+
+        def _mean(values):
+            return sum(values) / len(values) if len(values) > 0 else None
+
+        started = [j for j in jobs if j["started_at"] is not None]
+        finished = [j for j in jobs if j["finished_at"] is not None]
+        return {
+            "workers": self.max_workers,
+            "queued": sum(j["state"] == "queued" for j in jobs),
+            "running": sum(j["state"] == "running" for j in jobs),
+            "succeeded": sum(j["state"] == "succeeded" for j in jobs),
+            "failed": sum(j["state"] == "failed" for j in jobs),
+            # キューで待たされた時間と実行時間の平均 (秒)
+            "mean_wait_sec": _mean(
+                [j["started_at"] - j["submitted_at"] for j in started]
+            ),
+            "mean_run_sec": _mean(
+                [j["finished_at"] - j["started_at"] for j in finished]
+            ),
+        }
@@ -1,12 +1,149 @@
 from pathlib import Path
 from typing import List, Tuple
 
+import numpy as np
+from PIL import Image
+
 
 class LipSyncVideo:
+    """口パクするキャラクターの動画を作る
+
+    口を閉じた/開いた 2 枚の画像を最初に 1 回だけ用意し、各フレームは
+    フレームごとの口の開閉 (bool の配列) で 2 枚のどちらかを引くだけにする。
+    フレームごとの合成はしないので、30fps で長い動画にしても軽い。
+    """
+
     def __init__(self, image_dir: Path = Path("data/zundamon")):
-        self.image_dir = image_dir
+        self.image_dir = Path(image_dir)
+        closed = self._load_rgba(self.image_dir / "mouse_close.png")
+        opened = self._load_rgba(self.image_dir / "mouse_open.png")
+
+        # 2 枚に共通する不透明部分で切り抜く
+        alpha = np.maximum(closed[..., 3], opened[..., 3])
+        ys, xs = np.nonzero(alpha)
+        crop = (slice(ys.min(), ys.max() + 1), slice(xs.min(), xs.max() + 1))
+        self.images = (closed[crop], opened[crop])
+        self._scaled = {}
+
+    @staticmethod
+    def _load_rgba(path: Path, threshold: int = 8) -> np.ndarray:
+        with Image.open(path) as image:
+            if image.mode == "RGBA":
+                return np.asarray(image)
+            # アルファのない素材は黒背景なので、黒を透明にする
+            rgb = np.asarray(image.convert("RGB"))
+        alpha = np.where(rgb.max(axis=2) > threshold, 255, 0).astype(np.uint8)
+        return np.dstack([rgb, alpha])
+
+    def character_frames(self, height: int) -> Tuple[np.ndarray, np.ndarray]:
+        """高さ height に縮小した (口を閉じた, 口を開いた) RGBA 画像"""
+        if height not in self._scaled:
+            h, w = self.images[0].shape[:2]
+            size = (max(int(w * height / h), 1), height)
+            self._scaled[height] = tuple(
+                np.asarray(Image.fromarray(img).resize(size, Image.LANCZOS))
+                for img in self.images
+            )
+        return self._scaled[height]
+
+    def composite_frames(
+        self, background: np.ndarray, height: int, position: str = "right"
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """背景 (RGB) の下端にキャラクターを合成した (口を閉じた, 口を開いた) 画像"""
+        frames = []
+        for character in self.character_frames(height):
+            h, w = character.shape[:2]
+            y = background.shape[0] - h
+            x = 0 if position == "left" else background.shape[1] - w
+            frame = background.copy()
+            region = frame[y : y + h, x : x + w].astype(np.float32)
+            alpha = character[..., 3:4].astype(np.float32) / 255
+            region = region * (1 - alpha) + character[..., :3] * alpha
+            frame[y : y + h, x : x + w] = region.astype(np.uint8)
+            frames.append(frame)
+        return tuple(frames)
+
+    @staticmethod
+    def mouth_mask(
+        duration: float,
+        fps: float,
+        speak_times: List[Tuple[float, float]],
+        flap_rate: float = 6.0,
+    ) -> np.ndarray:
+        """フレームごとの口の開閉。喋っている区間は flap_rate [Hz] で口をパクパクさせる"""
+        t = np.arange(int(np.ceil(duration * fps))) / fps
+        speaking = np.zeros(len(t), dtype=bool)
+        for start, end in speak_times:
+            speaking |= (start <= t) & (t < end)
+        if flap_rate is None:
+            return speaking
+        return speaking & (np.floor(t * flap_rate * 2) % 2 == 0)
+
+    @staticmethod
+    def mouth_mask_from_audio(
+        samples: np.ndarray, rate: int, fps: float, threshold: float = 0.3
+    ) -> np.ndarray:
+        """音声の RMS がピークの threshold 倍を超えているフレームで口を開ける"""
+        if samples.ndim > 1:
+            samples = samples.mean(axis=1)
+        hop = rate / fps
+        n_frames = int(np.ceil(len(samples) / hop))
+        # フレームごとの区間の二乗和を累積和から求める
+        cumsum = np.concatenate([[0.0], np.cumsum(samples.astype(np.float64) ** 2)])
+        bounds = np.minimum((np.arange(n_frames + 1) * hop).astype(int), len(samples))
+        counts = np.maximum(np.diff(bounds), 1)
+        rms = np.sqrt((cumsum[bounds[1:]] - cumsum[bounds[:-1]]) / counts)
+        if rms.max() <= 0:
+            return np.zeros(n_frames, dtype=bool)
+        return rms > rms.max() * threshold
 
     def create_video(
-        self, duration: float, fps: float, speak_times: List[Tuple[float, float]]
+        self,
+        duration: float,
+        fps: float,
+        speak_times: List[Tuple[float, float]],
+        mask: np.ndarray = None,
+        height: int = 540,
+        backgrounds: List[Tuple[float, np.ndarray]] = None,
+        position: str = "right",
     ):
-        pass
+        """口パク動画を作る
+
+        backgrounds を省略するとキャラクターだけの (透過マスク付きの) クリップを返す。
+        backgrounds に [(開始秒, 背景画像), ...] を渡すと、区間ごとに背景と合成済みの
+        画像を 2 枚ずつ作り、それを引くだけの不透明なクリップを返す。
+        """
+        from moviepy.video.VideoClip import VideoClip
+
+        if mask is None:
+            mask = self.mouth_mask(duration, fps, speak_times)
+        mask = mask.astype(np.intp)
+        n_frames = len(mask)
+
+        def _frame_index(t):
+            return min(max(int(t * fps), 0), n_frames - 1)
+
+        if backgrounds is None:
+            frames = self.character_frames(height)
+            rgb = [f[..., :3] for f in frames]
+            alpha = [f[..., 3].astype(np.float64) / 255 for f in frames]
+            clip = VideoClip(lambda t: rgb[mask[_frame_index(t)]], duration=duration)
+            clip.mask = VideoClip(
+                lambda t: alpha[mask[_frame_index(t)]], ismask=True, duration=duration
+            )
+            return clip.set_fps(fps)
+
+        starts = np.array([start for start, _ in backgrounds])
+        table = [
+            self.composite_frames(background, height, position)
+            for _, background in backgrounds
+        ]
+        # フレーム番号 -> 背景の番号
+        segment = np.searchsorted(starts, np.arange(n_frames) / fps, side="right") - 1
+        segment = np.clip(segment, 0, len(table) - 1)
+
+        def make_frame(t):
+            i = _frame_index(t)
+            return table[segment[i]][mask[i]]
+
+        return VideoClip(make_frame, duration=duration).set_fps(fps)
@@ -0,0 +1,227 @@
+import re
+from pathlib import Path
+from typing import List, NamedTuple, Union
+
+# <name:args> 形式のタグ。行のどこにあっても読み上げテキストからは取り除く
+_TAG = re.compile(r"<\s*([A-Za-z_]+)\s*:([^<>]*)>")
+
+
+class Utterance(NamedTuple):
+    """1 行ぶんの読み上げ。speaker/speed は <speaker:> を反映済み"""
+
+    text: str
+    speaker: int
+    speed: float
+    line: int
+
+
+class Wait(NamedTuple):
+    """次の読み上げの前に入れる無音 (秒)"""
+
+    seconds: float
+    line: int
+
+
+class SpeakerChange(NamedTuple):
+    """その行だけ話者・速度を変える。None は変更なし"""
+
+    speaker: int
+    speed: float
+    line: int
+
+
+class VideoInsert(NamedTuple):
+    """スライドの代わりに動画を挿入する"""
+
+    path: str
+    line: int
+
+
+class Issue(NamedTuple):
+    line: int
+    level: str  # "error" | "warning"
+    message: str
+
+
+Event = Union[Utterance, Wait, SpeakerChange, VideoInsert]
+EVENT_TYPES = {
+    "utterance": Utterance,
+    "wait": Wait,
+    "speaker": SpeakerChange,
+    "video": VideoInsert,
+}
+
+
+class Manuscript:
+    """1 スライドぶんのノートをコンパイルしたもの
+
+    events は読み上げ・無音・話者の変更・動画の挿入を台本の順に並べたもの。
+    issues は台本の書き方の誤り (error) や無視したタグ (warning)。
+    """
+
+    def __init__(self, events: List[Event], issues: List[Issue] = None):
+        self.events = list(events)
+        self.issues = list(issues or [])
+
+    @property
+    def video(self) -> VideoInsert:
+        for event in self.events:
+            if isinstance(event, VideoInsert):
+                return event
+        return None
+
+    @property
+    def errors(self) -> List[Issue]:
+        return [issue for issue in self.issues if issue.level == "error"]
+
+    def timeline(self):
+        """読み上げごとに (Utterance, 直前に入れる無音の秒数) を返す"""
+        results = []
+        wait = 0.0
+        for event in self.events:
+            if isinstance(event, Wait):
+                wait += event.seconds
+            elif isinstance(event, Utterance):
+                results.append((event, wait))
+                wait = 0.0
+        return results
+
+    def report(self, name: str = "") -> str:
+        return "\n".join(
+            f"{name}:{issue.line}: {issue.level}: {issue.message}"
+            for issue in self.issues
+        )
+
+    def to_json(self):
+        return {
+            "events": [
+                dict(event._asdict(), type=_type_name(event)) for event in self.events
+            ],
+            "issues": [issue._asdict() for issue in self.issues],
+        }
+
+    @staticmethod
+    def from_json(data) -> "Manuscript":
+        events = []
+        for event in data["events"]:
+            event = dict(event)
+            events.append(EVENT_TYPES[event.pop("type")](**event))
+        return Manuscript(events, [Issue(**issue) for issue in data["issues"]])
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, Manuscript)
+            and self.events == other.events
+            and self.issues == other.issues
+        )
+
+
+def _type_name(event: Event) -> str:
+    for name, cls in EVENT_TYPES.items():
+        if isinstance(event, cls):
+            return name
+    raise TypeError(event)
+
+
+def compile_manuscript(
+    text: str, speaker: int, speed: float, base_dir: Path = Path(".")
+) -> Manuscript:
+    """ノートを 1 回だけ走査して Manuscript にする
+
+    speaker/speed は既定の話者と速度。<video:> のパスは base_dir からの相対パス。
+    """
+    events = []
+    issues = []
+    for line_no, line in enumerate(text.split("\n"), start=1):
+        if line.strip() == "":
+            continue
+
+        line_speaker, line_speed = speaker, speed
+        speaker_tag = None
+        for m in _TAG.finditer(line):
+            name, args = m.group(1).lower(), re.sub(r"\s", "", m.group(2))
+
+            if name == "video":
+                if len(events) > 0 or m.start() != len(line) - len(line.lstrip()):
+                    issues.append(
+                        Issue(
+                            line_no, "error", "<video:> must be at the top of the notes"
+                        )
+                    )
+                    continue
+                events.append(VideoInsert(str(Path(base_dir) / args), line_no))
+
+            elif name == "wait":
+                try:
+                    seconds = float(args)
+                except ValueError:
+                    issues.append(
+                        Issue(line_no, "error", f"Invalid wait time: {args!r}")
+                    )
+                    continue
+                if seconds < 0:
+                    issues.append(
+                        Issue(line_no, "error", f"Wait time must be >= 0: {seconds}")
+                    )
+                    continue
+                events.append(Wait(seconds, line_no))
+
+            elif name == "speaker":
+                new_speaker, new_speed = None, None
+                for cfg in args.split(","):
+                    key, eq, value = cfg.partition("=")
+                    try:
+                        if eq == "":
+                            raise ValueError
+                        if key == "id":
+                            new_speaker = int(value)
+                        elif key == "speed":
+                            new_speed = float(value)
+                        else:
+                            issues.append(
+                                Issue(
+                                    line_no,
+                                    "warning",
+                                    f"Unknown speaker option {cfg!r}",
+                                )
+                            )
+                    except ValueError:
+                        issues.append(
+                            Issue(line_no, "error", f"Invalid speaker option {cfg!r}")
+                        )
+                if new_speed is not None and new_speed <= 0:
+                    issues.append(
+                        Issue(line_no, "error", f"Invalid speed: {new_speed}")
+                    )
+                    new_speed = None
+                speaker_tag = SpeakerChange(new_speaker, new_speed, line_no)
+                if new_speaker is not None:
+                    line_speaker = new_speaker
+                if new_speed is not None:
+                    line_speed = new_speed
+
+            else:
+                # 知らないタグは読み上げない
+                issues.append(Issue(line_no, "warning", f"Unknown tag {m.group(0)!r}"))
+
+        speech = _TAG.sub("", line).strip()
+        if "<" in speech or ">" in speech:
+            issues.append(Issue(line_no, "warning", f"Unterminated tag in {speech!r}"))
+
+        if speaker_tag is not None:
+            if speech == "":
+                issues.append(
+                    Issue(line_no, "warning", "<speaker:> on a line without text")
+                )
+            else:
+                events.append(speaker_tag)
+        if speech != "":
+            events.append(Utterance(speech, line_speaker, line_speed, line_no))
+
+    video = [e for e in events if isinstance(e, VideoInsert)]
+    if len(video) > 0 and len(events) > 1:
+        issues.append(
+            Issue(video[0].line, "warning", "Notes after <video:> are ignored")
+        )
+        events = video[:1]
+    return Manuscript(events, issues)
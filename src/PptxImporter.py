@@ -0,0 +1,273 @@
+import posixpath
+import shutil
+import subprocess
+import tempfile
+import threading
+import uuid
+import zipfile
+from pathlib import Path
+from typing import List
+from xml.etree import ElementTree
+
+from .Profiler import StageProgress
+
+NS = {
+    "a": "http://schemas.openxmlformats.org/drawingml/2006/main",
+    "p": "http://schemas.openxmlformats.org/presentationml/2006/main",
+    "r": "http://schemas.openxmlformats.org/officeDocument/2006/relationships",
+    "rel": "http://schemas.openxmlformats.org/package/2006/relationships",
+}
+REL_NOTES_SLIDE = (
+    "http://schemas.openxmlformats.org/officeDocument/2006/relationships/notesSlide"
+)
+MEDIA_REL_TYPES = ("/image", "/video", "/audio", "/media")
+
+# インポートの段階ごとの進捗の重み (おおよその時間の割合)
+PYTHON_IMPORT_STAGES = {"notes": 0.1, "rasterize": 0.9}
+POWERPOINT_IMPORT_STAGES = {"open": 0.2, "export": 0.7, "notes": 0.1}
+
+# PowerPoint のアプリケーションは 1 つなので、COM 経由のインポートは直列に行う
+_powerpoint_lock = threading.Lock()
+
+
+class SlideRasterizer:
+    """スライドを画像にするバックエンドのインターフェース"""
+
+    def rasterize(self, pptx_path: Path, out_dir: Path) -> List[Path]:
+        """スライド順に out_dir/スライドN.png を書き出し、そのパスを返す"""
+        raise NotImplementedError
+
+
+class LibreOfficeRasterizer(SlideRasterizer):
+    """headless の LibreOffice で PDF にしてから、pdftoppm で PNG にする"""
+
+    def __init__(
+        self, soffice: str = "soffice", pdftoppm: str = "pdftoppm", width: int = 1280
+    ):
+        self.soffice = soffice
+        self.pdftoppm = pdftoppm
+        self.width = width
+
+    def rasterize(self, pptx_path: Path, out_dir: Path) -> List[Path]:
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            # 同時に複数起動できるように、ユーザープロファイルを分ける
+            profile = (tmp / f"profile_{uuid.uuid4()}").resolve().as_uri()
+            subprocess.run(
+                [
+                    self.soffice,
+                    f"-env:UserInstallation={profile}",
+                    "--headless",
+                    "--convert-to",
+                    "pdf",
+                    "--outdir",
+                    str(tmp),
+                    str(pptx_path),
+                ],
+                check=True,
+                capture_output=True,
+            )
+            pdf_path = tmp / (Path(pptx_path).stem + ".pdf")
+            subprocess.run(
+                [
+                    self.pdftoppm,
+                    "-png",
+                    "-scale-to-x",
+                    str(self.width),
+                    "-scale-to-y",
+                    "-1",
+                    str(pdf_path),
+                    str(tmp / "page"),
+                ],
+                check=True,
+                capture_output=True,
+            )
+
+            # pdftoppm はページ数に応じてゼロ埋めするので、数値で並べる
+            pages = sorted(tmp.glob("page-*.png"), key=lambda p: int(p.stem[5:]))
+            out_paths = []
+            for i, page in enumerate(pages):
+                out_path = Path(out_dir) / f"スライド{i + 1}.png"
+                shutil.move(str(page), out_path)
+                out_paths.append(out_path)
+            return out_paths
+
+
+RASTERIZERS = {
+    "libreoffice": LibreOfficeRasterizer,
+}
+
+
+class PptxImporter:
+    """PowerPoint を使わずに .pptx (zip) から直接ノートと埋め込みメディアを取り出す"""
+
+    def __init__(self, pptx_path: Path, rasterizer: SlideRasterizer = None):
+        self.pptx_path = Path(pptx_path)
+        self.rasterizer = rasterizer
+
+    @staticmethod
+    def _rels(zf: zipfile.ZipFile, part: str):
+        """part のリレーションを {rId: (type, 解決済みの part 名, external か)} で返す"""
+        rels_path = posixpath.join(
+            posixpath.dirname(part), "_rels", posixpath.basename(part) + ".rels"
+        )
+        if rels_path not in zf.namelist():
+            return {}
+        rels = {}
+        root = ElementTree.fromstring(zf.read(rels_path))
+        for rel in root.findall("rel:Relationship", NS):
+            external = rel.get("TargetMode") == "External"
+            target = rel.get("Target")
+            if not external:
+                target = posixpath.normpath(
+                    posixpath.join(posixpath.dirname(part), target)
+                )
+            rels[rel.get("Id")] = (rel.get("Type"), target, external)
+        return rels
+
+    def slide_parts(self, zf: zipfile.ZipFile) -> List[str]:
+        """表示順のスライドの part 名。非表示のスライドは含めない"""
+        presentation = "ppt/presentation.xml"
+        rels = self._rels(zf, presentation)
+        root = ElementTree.fromstring(zf.read(presentation))
+        parts = []
+        for sld_id in root.findall("p:sldIdLst/p:sldId", NS):
+            r_id = sld_id.get(f"{{{NS['r']}}}id")
+            part = rels[r_id][1]
+            # LibreOffice の PDF 書き出しは非表示のスライドを飛ばすので、
+            # ここでも飛ばさないと画像とノートの番号がずれる
+            if ElementTree.fromstring(zf.read(part)).get("show") in ("0", "false"):
+                continue
+            parts.append(part)
+        return parts
+
+    def notes(self, zf: zipfile.ZipFile, slide_part: str) -> str:
+        notes_parts = [
+            target
+            for type_, target, _ in self._rels(zf, slide_part).values()
+            if type_ == REL_NOTES_SLIDE
+        ]
+        if len(notes_parts) <= 0:
+            return ""
+
+        root = ElementTree.fromstring(zf.read(notes_parts[0]))
+        for sp in root.iter(f"{{{NS['p']}}}sp"):
+            ph = sp.find("p:nvSpPr/p:nvPr/p:ph", NS)
+            if ph is None or ph.get("type") != "body":
+                continue
+            paragraphs = []
+            for p in sp.findall("p:txBody/a:p", NS):
+                text = ""
+                for node in p.iter():
+                    if node.tag == f"{{{NS['a']}}}t":
+                        text += node.text or ""
+                    elif node.tag == f"{{{NS['a']}}}br":
+                        text += "\n"
+                paragraphs.append(text)
+            return "\n".join(paragraphs)
+        return ""
+
+    def media(self, zf: zipfile.ZipFile, slide_part: str) -> List[str]:
+        return [
+            target
+            for type_, target, external in self._rels(zf, slide_part).values()
+            if not external and type_.endswith(MEDIA_REL_TYPES)
+        ]
+
+    def import_to(self, workdir: Path, on_progress=None):
+        """workdir に スライドN.txt (ノート)、media/ (埋め込みメディア)、スライドN.png を書き出す"""
+        workdir = Path(workdir)
+        media_dir = workdir / "media"
+        progress = StageProgress(on_progress, PYTHON_IMPORT_STAGES)
+        with zipfile.ZipFile(self.pptx_path) as zf:
+            slide_parts = self.slide_parts(zf)
+            for i, slide_part in enumerate(slide_parts):
+                progress.update(
+                    "notes", i / len(slide_parts), f"Notes {i + 1}/{len(slide_parts)}"
+                )
+                (workdir / f"スライド{i + 1}.txt").write_text(
+                    self.notes(zf, slide_part), encoding="utf8"
+                )
+                for part in self.media(zf, slide_part):
+                    media_dir.mkdir(parents=True, exist_ok=True)
+                    out_path = media_dir / f"スライド{i + 1}_{posixpath.basename(part)}"
+                    out_path.write_bytes(zf.read(part))
+
+        progress.update("notes", 1.0, "Extracted notes and media")
+
+        if self.rasterizer is not None:
+            progress.update("rasterize", 0.0, "Rasterizing slides")
+            self.rasterizer.rasterize(self.pptx_path, workdir)
+        progress.update("rasterize", 1.0, "Imported")
+
+
+class PowerPointImporter:
+    """PowerPoint を COM で操作して、スライドの画像とノートを書き出す (Windows のみ)"""
+
+    def __init__(self, pptx_path: Path):
+        self.pptx_path = Path(pptx_path)
+
+    def import_to(self, workdir: Path, on_progress=None):
+        import comtypes
+        import comtypes.client
+
+        workdir = Path(workdir)
+        progress = StageProgress(on_progress, POWERPOINT_IMPORT_STAGES)
+        # ワーカースレッドから呼ばれることもあるので、スレッドごとに COM を初期化する
+        comtypes.CoInitialize()
+        try:
+            progress.update("open", 0.0, "Opening PowerPoint")
+            application = comtypes.client.CreateObject("Powerpoint.Application")
+            pptx_path = str(self.pptx_path.resolve())
+            print(f"{pptx_path=}")
+            presentation = application.Presentations.open(pptx_path)
+
+            progress.update("export", 0.0, "Exporting images")
+            presentation.Export(str(workdir.resolve()), FilterName="png")
+            print("Exported images to", workdir)
+            progress.update("export", 1.0, "Exported images")
+            n_slides = presentation.Slides.Count
+            for slide in presentation.Slides:
+                # Extract notes from slide
+                notes = slide.NotesPage.Shapes.Placeholders(2).TextFrame.TextRange.Text
+                notes = notes.replace("\r", "\n")
+                (workdir / f"スライド{slide.SlideIndex}.txt").write_text(
+                    notes, encoding="utf8"
+                )
+                print("Exported note to", workdir / f"スライド{slide.SlideIndex}.txt")
+                progress.update(
+                    "notes",
+                    slide.SlideIndex / n_slides,
+                    f"Notes {slide.SlideIndex}/{n_slides}",
+                )
+
+            presentation.close()
+            application.quit()
+        finally:
+            comtypes.CoUninitialize()
+
+
+def import_pptx(pptx_path: Path, workdir: Path, input_config: dict, on_progress=None):
+    """config["input"] の設定で pptx を workdir にインポートする
+
+    Project を作らずに呼べるので、インポートサーバからも使う。
+    on_progress(0-1, メッセージ) には段階ごとの重みで計算した進捗を渡す。
+    """
+    importer = input_config.get("importer", "powerpoint")
+    if importer == "python":
+        # PowerPoint なしで zip から直接読む。Linux でも動き、並列にインポートできる
+        rasterizer_name = input_config.get("rasterizer", "libreoffice")
+        if rasterizer_name not in RASTERIZERS:
+            raise ValueError(f"Unknown rasterizer: {rasterizer_name}")
+        rasterizer = RASTERIZERS[rasterizer_name](
+            width=input_config.get("slide_width", 1280)
+        )
+        PptxImporter(pptx_path, rasterizer).import_to(workdir, on_progress)
+        print("Exported images and notes to", workdir)
+    elif importer == "powerpoint":
+        with _powerpoint_lock:
+            PowerPointImporter(pptx_path).import_to(workdir, on_progress)
+    else:
+        raise ValueError(f"Unknown importer: {importer}")
+
+    (Path(workdir) / "__pptx_imported__").touch()
@@ -0,0 +1,198 @@
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict
+
+
+def peak_rss() -> Dict[str, int]:
+    """このプロセスと子プロセス (ffmpeg など) の最大 RSS (バイト)。測れなければ None"""
+    try:
+        import resource
+    except ImportError:
+        # Windows には resource がない。psutil があればそちらで測る
+        try:
+            import psutil
+
+            info = psutil.Process().memory_info()
+            return {"self": getattr(info, "peak_wset", info.rss), "children": None}
+        except ImportError:
+            return {"self": None, "children": None}
+
+    # Linux は KiB、macOS はバイト
+    unit = 1 if sys.platform == "darwin" else 1024
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit,
+    }
+
+
+# このコンテキスト (スレッド) で記録している Profiler。activate() で切り替える
+_active = contextvars.ContextVar("active_profiler", default=None)
+
+
+def _count_subprocess(event: str, args):
+    # moviepy の中で起動する ffmpeg も含め、子プロセスは起動したところで数える
+    if event == "subprocess.Popen":
+        profiler = _active.get()
+        if profiler is not None:
+            profiler.count("subprocesses")
+
+
+sys.addaudithook(_count_subprocess)
+
+
+class Profiler:
+    """処理ごとの時間 (span) と回数・量 (counter) を記録する
+
+    span は入れ子にでき、スレッドやプロセスごとに分けて記録する。
+    ワーカープロセスで記録したものは to_json() で受け渡して merge() で取り込む。
+    """
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.spans = []
+        self.counters = defaultdict(float)
+        # merge() で取り込んだワーカープロセスの最大 RSS
+        self.worker_peak_rss = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, category: str = "", **args):
+        start = time.time()
+        try:
+            yield
+        finally:
+            record = {
+                "name": name,
+                "cat": category,
+                "start": start,
+                "dur": time.time() - start,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": args,
+            }
+            with self._lock:
+                self.spans.append(record)
+
+    @contextmanager
+    def activate(self):
+        """この中で (このスレッドから) 起動した子プロセスの数を subprocesses に記録する"""
+        token = _active.set(self)
+        try:
+            yield self
+        finally:
+            _active.reset(token)
+
+    def count(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] += value
+
+    def reset(self):
+        """記録した span とカウンタを捨てる。使い回すワーカーでタスクごとに分けて渡す"""
+        with self._lock:
+            self.spans = []
+            self.counters = defaultdict(float)
+
+    def merge(self, data: Dict):
+        """別の Profiler の to_json() を取り込む"""
+        with self._lock:
+            self.spans += data["spans"]
+            for name, value in data["counters"].items():
+                self.counters[name] += value
+            rss = data.get("peak_rss", {}).get("self")
+            if rss is not None:
+                self.worker_peak_rss = max(self.worker_peak_rss or 0, rss)
+
+    def totals(self) -> Dict[str, float]:
+        """span の名前ごとの合計時間 (秒)"""
+        totals = defaultdict(float)
+        with self._lock:
+            for span in self.spans:
+                totals[span["name"]] += span["dur"]
+        return dict(totals)
+
+    def summary(self) -> str:
+        """段階ごとの合計時間とカウンタを人が読める形にする"""
+        lines = [
+            f"{name:24s} {sec:8.3f}s"
+            for name, sec in sorted(self.totals().items(), key=lambda kv: -kv[1])
+        ]
+        with self._lock:
+            lines += [f"{name:24s} {value:g}" for name, value in self.counters.items()]
+        return "\n".join(lines)
+
+    def to_json(self) -> Dict:
+        rss = peak_rss()
+        with self._lock:
+            rss["workers"] = self.worker_peak_rss
+            return {
+                "start_time": self.start_time,
+                "wall_sec": time.time() - self.start_time,
+                "peak_rss": rss,
+                "counters": dict(self.counters),
+                "spans": list(self.spans),
+            }
+
+    def to_chrome_trace(self) -> Dict:
+        """chrome://tracing や Perfetto で開ける形式"""
+        data = self.to_json()
+        events = []
+        for span in data["spans"]:
+            events.append(
+                {
+                    "name": span["name"],
+                    "cat": span["cat"],
+                    "ph": "X",
+                    "ts": (span["start"] - self.start_time) * 1e6,
+                    "dur": span["dur"] * 1e6,
+                    "pid": span["pid"],
+                    "tid": span["tid"],
+                    "args": span["args"],
+                }
+            )
+        end = data["wall_sec"] * 1e6
+        for name, value in data["counters"].items():
+            events.append(
+                {
+                    "name": name,
+                    "ph": "C",
+                    "ts": end,
+                    "pid": os.getpid(),
+                    "args": {name: value},
+                }
+            )
+        return {"traceEvents": events, "otherData": {"peak_rss": data["peak_rss"]}}
+
+    def write(self, path: Path, chrome: bool = False):
+        data = self.to_chrome_trace() if chrome else self.to_json()
+        Path(path).write_text(
+            json.dumps(data, ensure_ascii=False, default=str), encoding="utf8"
+        )
+
+
+class StageProgress:
+    """段階ごとの重みで全体の進捗を計算して on_progress(0-1, メッセージ) に渡す
+
+    weights は {段階: 重み}。段階の中の進み具合 (0-1) を update() で伝える。
+    """
+
+    def __init__(self, on_progress, weights: Dict[str, float]):
+        self.on_progress = on_progress
+        total = sum(weights.values())
+        self.weights = {k: v / total for k, v in weights.items()}
+        self.done = {k: 0.0 for k in weights}
+        self._last = 0.0
+
+    def update(self, stage: str, fraction: float, message: str):
+        self.done[stage] = min(max(fraction, 0.0), 1.0)
+        progress = sum(self.weights[k] * v for k, v in self.done.items())
+        # 戻らないようにする
+        self._last = max(self._last, min(progress, 1.0))
+        if self.on_progress is not None:
+            self.on_progress(self._last, message)
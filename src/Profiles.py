@@ -0,0 +1,47 @@
+import copy
+import os
+from pathlib import Path
+from typing import Dict
+
+# 書き出しのプロファイル。config の output に上書きする設定
+PROFILES = {
+    # 台本やタイミングを確認するための下書き。解像度・fps・画質を落として速く書き出す
+    "preview": {
+        "scale": 0.5,
+        "fps": 5,
+        "render_mode": "still",
+        "still_fps": 1,
+        "preset": "ultrafast",
+        "tts_cache": True,
+        "workers": max((os.cpu_count() or 1) - 1, 1),
+        # 本番の動画を上書きしないように、出力ファイル名に付ける
+        "path_suffix": ".preview",
+    },
+}
+
+
+def apply_profile(config: Dict, name: str = None) -> Dict:
+    """config["profile"] (または name) のプロファイルを output に適用した config を返す
+
+    config の profiles に同名のプロファイルがあれば、組み込みの設定に上書きする。
+    適用済みの config には profile を残さないので、何度適用しても同じになる。
+    """
+    config = copy.deepcopy(config)
+    config_profile = config.pop("profile", None)
+    name = config_profile if name is None else name
+    if name is None:
+        return config
+
+    profile = dict(PROFILES.get(name, {}))
+    profile.update(config.get("profiles", {}).get(name, {}))
+    if len(profile) <= 0:
+        raise ValueError(f"Unknown profile: {name}")
+
+    path_suffix = profile.pop("path_suffix", "")
+    config["output"].update(profile)
+    if path_suffix != "" and "path" in config["output"]:
+        path = Path(config["output"]["path"])
+        config["output"]["path"] = str(
+            path.with_name(path.stem + path_suffix + path.suffix)
+        )
+    return config
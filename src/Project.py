@@ -1,15 +1,36 @@
 from typing import Dict
 from pathlib import Path
-import moviepy.editor
-import moviepy.video.fx.resize
-import comtypes.client
-import uuid
-import yaml
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import concurrent.futures
+import hashlib
+import json
 import os
+import pickle
+import shutil
 import time
 import traceback
+import uuid
+import requests
 
 from .TextToSpeech import TextToSpeech
+from .TTSCache import TTSCache
+from .Segments import HLS_TARGET_DURATION, HlsPlaylist, concat_segments, probe_video
+from .InsertVideoCache import InsertVideoCache
+from .ImageStore import ImageStore
+from .SubtitleRenderer import SubtitleRenderer, overlay
+from .Subtitles import shift_cues, write_srt, write_vtt, mux_subtitles
+from .AudioBuffer import decode_wav, silence
+from .Profiles import apply_profile
+from .Manuscript import Manuscript, compile_manuscript
+from .Profiler import Profiler, StageProgress
+from .ExportJournal import ExportJournal
+
+# 書き出しの段階ごとの進捗の重み (おおよその時間の割合)
+SINGLE_PASS_STAGES = {"prepare": 0.05, "tts": 0.15, "clips": 0.2, "encode": 0.55}
+SEGMENT_STAGES = {"prepare": 0.05, "tts": 0.15, "render": 0.7, "concat": 0.1}
+STREAMING_STAGES = {"prepare": 0.05, "render": 0.9, "concat": 0.05}
 
 
 class Project:
@@ -20,279 +41,1406 @@ class Project:
     def __exit__(self, exc_type, exc_value, traceback):
         if self.config["input"]["type"] == "pptx":
             self.close()
+        if self._owns_tts:
+            self.tts.close()
 
         # 例外は伝搬させたいので False を返す
         return False
 
-    def __init__(self, config: Dict, user_import_server: bool = False) -> None:
+    def __init__(
+        self,
+        config: Dict,
+        user_import_server: bool = False,
+        tts: TextToSpeech = None,
+    ) -> None:
+        """tts を渡すと、複数の Project で TTS のクライアントとキャッシュを共有する
+
+        config["profile"] (preview など) があれば、その設定を output に上書きする
+        """
+        self.profile = config.get("profile")
+        config = apply_profile(config)
         self.config = config
+        self.errors = ""
+        # 段階ごとの時間とカウンタ。output.trace で書き出す
+        self.profiler = Profiler()
 
         if config["input"]["type"] == "pptx":
             self.pptx_path = Path(config["input"]["path"])
             self.workdir = self.pptx_path.with_suffix("")
             self.workdir.mkdir(parents=True, exist_ok=True)
-            if user_import_server:
-                self.request_to_pptx_import_server()
-            else:
-                self.import_pptx()
+            with self.profiler.span("import", "import", path=str(self.pptx_path)):
+                if user_import_server:
+                    self.request_to_pptx_import_server()
+                else:
+                    self.import_pptx()
         else:
             self.workdir = Path(config["input"]["path"])
             self.workdir.mkdir(parents=True, exist_ok=True)
 
         self.speaker_id = config["output"].get("speaker_id", 3)
         self.speaker_speed = config["output"].get("speaker_speed", 1.1)
-        self.voicevox_url = config["output"].get("voicevox_url", "http://127.0.0.1:50021")
-        self.tts = TextToSpeech(voicevox_url=self.voicevox_url)
-        self.errors = ""
+        self.voicevox_url = config["output"].get(
+            "voicevox_url", "http://127.0.0.1:50021"
+        )
+        # 音声は書き出し時のサンプリングレートで合成してもらい、リサンプルしない
+        self.audio_fps = config["output"].get("audio_fps", 44100)
+        self._owns_tts = tts is None
+        self.tts = (
+            tts
+            if tts is not None
+            else self.create_tts(config["output"], profiler=self.profiler)
+        )
+        self.tts_cache = self.tts.cache
+        # エンジンのバージョンがわからないとき、セグメントをこの Project の中だけで使い回す
+        self.run_id = uuid.uuid4().hex
+        self.subtitle_renderer = SubtitleRenderer(
+            max_bytes=config["output"].get("subtitle_cache_mb", 32) * 2**20
+        )
+        # 字幕を焼き込むフォント。既定のフォントには日本語がないので、なければ焼き込まない
+        self.subtitle_font = os.environ.get("MANUSCRIPTS_FONT")
+        if self.subtitle_font is None:
+            print("MANUSCRIPTS_FONT is not set; subtitles are not burned in")
+        # 同じ内容のスライド画像は 1 回だけデコードして共有する
+        self.image_store = ImageStore(
+            self._scaled_size,
+            max_bytes=config["output"].get("image_cache_mb", 256) * 2**20,
+            profiler=self.profiler,
+        )
+        self._lipsync = None
+        self._insert_cache = None
+        # 直近の export_segments で実際に書き出したスライド数 (残りは再利用)
+        self.rendered_slides = None
+
+    @staticmethod
+    def tts_settings(output: Dict):
+        """TextToSpeech を共有できるかどうかを決める設定"""
+        voicevox_url = output.get("voicevox_url", "http://127.0.0.1:50021")
+        if not isinstance(voicevox_url, str):
+            # 複数のエンジン。辞書のキーにできるようにタプルにする
+            voicevox_url = tuple(voicevox_url)
+        return (
+            voicevox_url,
+            output.get("audio_fps", 44100),
+            output.get("tts_cache", True),
+            str(output.get("tts_cache_dir", ".tts_cache")),
+        )
+
+    @staticmethod
+    def create_tts(output: Dict, profiler: Profiler = None) -> TextToSpeech:
+        voicevox_url, audio_fps, use_cache, cache_dir = Project.tts_settings(output)
+        cache = None
+        if use_cache:
+            cache = TTSCache(
+                Path(cache_dir),
+                max_bytes=int(output.get("tts_cache_max_mb", 1024) * 2**20),
+            )
+        return TextToSpeech(
+            voicevox_url=voicevox_url,
+            cache=cache,
+            max_workers=output.get("tts_workers", 4),
+            timeout=output.get("tts_timeout", 30.0),
+            retries=output.get("tts_retries", 2),
+            sampling_rate=audio_fps,
+            profiler=profiler,
+        )
 
     def close(self):
         #   shutil.rmtree(self.workdir)
         pass
 
     def request_to_pptx_import_server(self) -> bool:
-        config_path = Path(f"__pptx_import_server__watch_dir__/{str(uuid.uuid4())}.yml")
-        config_path.parent.mkdir(exist_ok=True, parents=True)
-        with open(config_path, "w", encoding="utf8") as f:
-            yaml.safe_dump(self.config, f)
-
-        while not Path(self.workdir / "__pptx_imported__").exists():
-            time.sleep(1)
+        """インポートサーバにジョブを投げ、終わるまで待つ。失敗・タイムアウトしたら False"""
+        url = self.config["input"].get("import_server_url", "http://127.0.0.1:50080")
+        timeout = self.config["input"].get("import_timeout", 600)
+        deadline = time.time() + timeout
+        try:
+            config = json.loads(json.dumps(self.config, default=str))
+            res = requests.post(url + "/jobs", json=config, timeout=10)
+            res.raise_for_status()
+            job_id = res.json()["job_id"]
 
-        print("[request_to_pptx_import_server] PPTX imported")
-        return True
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self.log_error(f"PPTX import timed out after {timeout} sec")
+                    return False
 
-    def import_pptx(self) -> bool:
-        try:
-            application = comtypes.client.CreateObject("Powerpoint.Application")
-            pptx_path = str(self.pptx_path.resolve())
-            print(f"{pptx_path=}")
-            presentation = application.Presentations.open(pptx_path)
-
-            presentation.Export(str(self.workdir.resolve()), FilterName="png")
-            print("Exported images to", self.workdir)
-            for slide in presentation.Slides:
-                # Extract notes from slide
-                notes = slide.NotesPage.Shapes.Placeholders(2).TextFrame.TextRange.Text
-                notes = notes.replace("\r", "\n")
-                (self.workdir / f"スライド{slide.SlideIndex}.txt").write_text(
-                    notes, encoding="utf8"
-                )
-                print(
-                    "Exported note to", self.workdir / f"スライド{slide.SlideIndex}.txt"
+                # サーバ側でジョブが終わるまで待ってから返ってくる (long polling)
+                wait = min(remaining, 30)
+                res = requests.get(
+                    f"{url}/jobs/{job_id}", params={"wait": wait}, timeout=wait + 10
                 )
+                res.raise_for_status()
+                job = res.json()
+                if job["state"] == "succeeded":
+                    print("[request_to_pptx_import_server] PPTX imported")
+                    return True
+                if job["state"] == "failed":
+                    self.log_error(f"PPTX import failed: {job['error']}")
+                    return False
+        except Exception as e:
+            self.log_error(
+                f"Failed to request PPTX import: {e}\n{traceback.format_exc()}"
+            )
+            return False
 
-            presentation.close()
-            application.quit()
+    def import_pptx(self) -> bool:
+        # PowerPoint の COM などは使うときまで読み込まない
+        from .PptxImporter import import_pptx
 
-            (self.workdir / "__pptx_imported__").touch()
+        try:
+            import_pptx(self.pptx_path, self.workdir, self.config["input"])
             return True
         except Exception as e:
-            import traceback
-
             print(e, "\n", traceback.format_exc())
+            self.log_error(
+                f"Failed to import {self.pptx_path}: {e}\n{traceback.format_exc()}"
+            )
             return False
 
     def log_error(self, msg):
         self.errors += msg + "\n"
 
-    def parse_command(self, line: str):
-        line = line.strip()
-        line = line.replace(" ", "")
+    def compile_manuscript(self, manuscript: str) -> Manuscript:
+        """ノートを読み上げ・無音・動画の挿入のタイムラインにコンパイルする"""
+        return compile_manuscript(
+            manuscript, self.speaker_id, self.speaker_speed, self.workdir.parent
+        )
 
-        # <video:xxx.mp4>
-        if line.startswith("<video:") and ">" in line:
-            p_end = line.find(">")
-            video_path = line[len("<video:") : p_end]
-            return "insert_video", self.workdir.parent / video_path
+    def compile_manuscripts(self, all_pairs):
+        """全スライドのノートをコンパイルし、台本の誤りがあれば合成を始める前に報告する"""
+        scripts = []
+        report = []
+        for _, manuscript_path in all_pairs:
+            script = self.compile_manuscript(manuscript_path.read_text(encoding="utf8"))
+            scripts.append(script)
+            if len(script.issues) > 0:
+                report.append(script.report(manuscript_path.name))
+        if len(report) > 0:
+            print("\n".join(report))
+        if any(len(script.errors) > 0 for script in scripts):
+            raise ValueError("Invalid manuscripts:\n" + "\n".join(report))
+        return scripts
 
-        # <wait:waittime>
-        if line.startswith("<wait:") and ">" in line:
-            p_end = line.find(">")
-            try:
-                wait_time = float(line[len("<wait:") : p_end])
-            except Exception:
-                self.log_error(f"Failed to parse wait command {line}")
-            return "wait", wait_time
-
-        # <speaker:id=yy,speed=zz>
-        if line.startswith("<speaker:") and ">" in line:
-            p_end = line.find(">")
-            speaker = line[len("<speaker:") : p_end]
-            id, speed = None, None
-            try:
-                for cfg in speaker.split(","):
-                    if "=" not in cfg:
-                        continue
-                    key, value = cfg.split("=")[:2]
-                    if key == "id":
-                        id = int(value)
-                    if key == "speed":
-                        speed = float(value)
-            except Exception:
-                self.log_error(f"Failed to parse speaker command {line}")
+    def prefetch_tts(self, scripts):
+        """全スライドの読み上げ音声の合成を先に投げておく
 
-            return "speaker", (id, speed)
-
-        return "", None
+        スライドごとの Future のリストを返す
+        """
+        all_futures = []
+        for script in scripts:
+            futures = []
+            all_futures.append(futures)
+            for utterance, _ in script.timeline():
+                futures.append(
+                    self.tts.prefetch(
+                        utterance.text, speed=utterance.speed, speaker=utterance.speaker
+                    )
+                )
+        return all_futures
 
     def make_clip(
         self,
         img_path: Path,
-        manuscript: str,
+        script: Manuscript,
         fps: float,
         manuscript_margin: float,
         line_interval: float,
         fontsize_ratio: float,
         fontcolor: str,
     ) -> None:
-        cmd, args = self.parse_command(manuscript)
-        if cmd == "insert_video":
-            video_path = args
-            video_clip = moviepy.editor.VideoFileClip(str(video_path))
-            ref_img_clip = moviepy.editor.ImageClip(str(img_path))
-            video_clip = video_clip.resize(ref_img_clip.size)
-            return video_clip
+        # 行ごとの字幕のタイミング (クリップ先頭からの秒)。soft/sidecar 字幕の書き出しに使う
+        self.clip_cues = []
+        # 口を開けている区間 (クリップ先頭からの秒)。VOICEVOX のモーラのタイミングから求める
+        self.clip_speak_times = []
+        # moviepy.editor は IPython なども読み込んで起動が遅くなるので、使うクラスだけ読む
+        from moviepy.video.VideoClip import ImageClip
+        from moviepy.video.compositing.CompositeVideoClip import CompositeVideoClip
+        from moviepy.video.compositing.concatenate import concatenate_videoclips
+        from moviepy.video.io.VideoFileClip import VideoFileClip
 
-        lines = manuscript.split("\n")
-        lines = [line.strip() for line in lines if len(line.strip()) > 0]
+        if script.video is not None:
+            # 解像度は変換済みなので、フレームごとの resize はしない
+            video_path = self.insert_video_path(img_path, script)
+            return VideoFileClip(str(video_path))
+
+        lines = script.timeline()
 
         all_clips = []
 
+        with self.profiler.span("load_slide", "render"):
+            slide = self.load_slide(img_path)
         if len(lines) <= 0:
             # 台本未設定の場合
-            return moviepy.editor.ImageClip(str(img_path), duration=5.0)
-
-        for i, line in enumerate(lines):
-            speaker_id = self.speaker_id
-            speaker_speed = self.speaker_speed
-
-            cmd, args = self.parse_command(line)
-            if cmd == "speaker":
-                new_speaker, new_speed = args
-                if new_speaker is not None:
-                    speaker_id = new_speaker
-                if new_speed is not None:
-                    speaker_speed = new_speed
-
-            wait_time = 0
-            if cmd == "wait":
-                wait_time = args
-
-            # remove <speaker:xx>
-            tag_start = line.find("<speaker:")
-            tag_end = line.rfind(">")
-            if tag_start >= 0 and tag_end >= 0:
-                line = line[:tag_start] + line[tag_end + 1 :]
-
-            tag_start = line.find("<wait:")
-            tag_end = line.rfind(">")
-            if tag_start >= 0 and tag_end >= 0:
-                line = line[:tag_start] + line[tag_end + 1 :]
-
-            if line.strip() == "":
-                continue
+            return ImageClip(slide, duration=5.0)
+
+        # 静止画モードでは、スライドと字幕を行ごとに 1 回だけ合成して 1 枚の画像にする
+        still = self.config["output"].get("render_mode") == "still"
+        burn_subtitles = self.config["output"].get("subtitles", "burn") == "burn"
+        clip_start = 0.0
+        # スライド全体の音声を 1 本の配列として組み立てる
+        audio_tracks = []
 
-            wav = self.tts.tts(line, speed=speaker_speed, speaker=speaker_id)
+        for i, (utterance, wait_time) in enumerate(lines):
+            with self.profiler.span("line", "render", line=utterance.line):
+                line = utterance.text
+                with self.profiler.span("tts_wait", "render"):
+                    result = self.tts.tts(
+                        line, speed=utterance.speed, speaker=utterance.speaker
+                    )
+
+                # Decode audio in memory
+                with self.profiler.span("decode", "render"):
+                    samples, rate = decode_wav(result.wav)
+                # 音の最後のノイズが乗ることがあるので除去
+                samples = samples[: max(len(samples) - int(0.01 * rate), 0)]
+                if rate != self.audio_fps:
+                    raise ValueError(
+                        f"Unexpected sampling rate {rate}Hz (expected {self.audio_fps}Hz)"
+                    )
 
-            # Save audio to temporary file
-            audio_path = self.workdir / f"{str(uuid.uuid4())}.wav"
-            audio_path.write_bytes(wav)
+                # Load image clip
+                start = line_interval / 2 if i > 0 else manuscript_margin
+                start += wait_time
+                end = line_interval / 2 if i < len(lines) - 1 else manuscript_margin
+                audio_tracks += [
+                    silence(start, rate),
+                    samples,
+                    silence(end, rate),
+                ]
+                # 長さは wav のヘッダから求めたものを使う (ffmpeg で調べ直さない)
+                audio_duration = max(result.duration - int(0.01 * rate) / rate, 0.0)
+                self.clip_speak_times += [
+                    (
+                        clip_start + start + s,
+                        clip_start + start + min(e, audio_duration),
+                    )
+                    for s, e in result.speak_times()
+                    if s < audio_duration
+                ]
+                video_clip = ImageClip(
+                    slide,
+                    duration=audio_duration + start + end,
+                )
+                video_clip.fps = fps
+
+                self.clip_cues.append(
+                    (clip_start, clip_start + video_clip.duration, line)
+                )
+                clip_start += video_clip.duration
+
+                if not burn_subtitles or self.subtitle_font is None:
+                    # 字幕は別ストリーム・別ファイルにする (かフォントがない) ので、スライドそのまま
+                    all_clips.append(video_clip)
+                    continue
+
+                # Create text clip
+                fontsize = int(video_clip.size[0] * fontsize_ratio)
+                print("========", line, "==========")
+                with self.profiler.span("subtitle", "render"):
+                    txt_img = self.subtitle_renderer.render(
+                        line,
+                        fontsize,
+                        fontcolor,
+                        font=self.subtitle_font,
+                        max_width=int(video_clip.size[0] * 0.95),
+                    )
+                # 折り返して複数行になってもはみ出さないようにする
+                txt_y = min(
+                    int(video_clip.size[1] * 0.9), video_clip.size[1] - txt_img.shape[0]
+                )
+
+                if still:
+                    txt_x = (slide.shape[1] - txt_img.shape[1]) // 2
+                    clip = ImageClip(
+                        overlay(slide, txt_img, txt_x, txt_y),
+                        duration=video_clip.duration,
+                    )
+                    clip.fps = fps
+                else:
+                    txt_clip = ImageClip(txt_img, transparent=True)
+                    txt_clip.duration = video_clip.duration
+                    txt_clip = txt_clip.set_position(("center", txt_y))
 
-            # Load audio clip
-            audio_clip = moviepy.editor.AudioFileClip(str(audio_path))
-            # 音の最後のノイズが乗ることがあるので除去
-            audio_clip.duration = audio_clip.duration - 0.01
-            audio_duration = audio_clip.duration
+                    # Composite clips
+                    clip = CompositeVideoClip([video_clip, txt_clip])
+                    clip.duration = video_clip.duration
 
-            # Load image clip
-            start = line_interval / 2 if i > 0 else manuscript_margin
-            start += wait_time
-            end = line_interval / 2 if i < len(lines) - 1 else manuscript_margin
-            video_clip = moviepy.editor.ImageClip(
-                str(img_path), duration=audio_duration + start + end
+                # Append clip
+                all_clips.append(clip)
+
+        from moviepy.audio.AudioClip import AudioArrayClip
+        import numpy as np
+
+        audio_track = np.concatenate(audio_tracks)
+        if self.config["output"].get("avatar") is not None:
+            video = self.make_avatar_clip(all_clips, audio_track, fps, still)
+        else:
+            video = concatenate_videoclips(all_clips)
+        audio = AudioArrayClip(audio_track, fps=self.audio_fps)
+        return video.set_audio(audio.set_duration(video.duration))
+
+    def _scaled_size(self, size):
+        scale = self.config["output"].get("scale", 1.0)
+        if scale == 1.0:
+            return tuple(size)
+        # H.264 (yuv420p) は縦横が偶数でないと書き出せない
+        return tuple(max(int(v * scale) // 2 * 2, 2) for v in size)
+
+    def slide_size(self, img_path: Path):
+        """書き出すスライドの (幅, 高さ)。画像のヘッダだけ読む"""
+        return self.image_store.size(img_path)
+
+    def load_slide(self, img_path: Path):
+        """スライド画像を RGB の配列で読む。output.scale があれば縮小する
+
+        同じ内容の画像はデコード済みの配列 (書き込み不可) を共有する
+        """
+        return self.image_store.get(img_path)
+
+    @property
+    def insert_cache(self) -> InsertVideoCache:
+        if self._insert_cache is None:
+            output = self.config["output"]
+            self._insert_cache = InsertVideoCache(
+                Path(output.get("insert_cache_dir", ".insert_cache")),
+                codec=output.get("segment_codec", "libx264"),
+                preset=output.get("preset", "medium"),
+            )
+        return self._insert_cache
+
+    def insert_video_path(self, img_path: Path, script: Manuscript) -> Path:
+        """挿入する動画をスライドと同じ解像度・音声形式に変換したもののパス"""
+        output = self.config["output"]
+        width, height = self.slide_size(img_path)
+        misses = self.insert_cache.stats()["misses"]
+        with self.profiler.span("insert_video", "prepare", path=script.video.path):
+            path = self.insert_cache.get(
+                Path(script.video.path),
+                width,
+                height,
+                output.get("fps", 30),
+                self.audio_fps,
+            )
+        if self.insert_cache.stats()["misses"] > misses:
+            self.profiler.count("bytes_written", path.stat().st_size)
+        return path
+
+    def prepare_insert_videos(self, all_pairs, scripts):
+        """挿入する動画を書き出しの前にまとめて変換しておく (前処理)"""
+        for (img_path, _), script in zip(all_pairs, scripts):
+            if script.video is not None:
+                self.insert_video_path(img_path, script)
+        if self._insert_cache is not None:
+            print("Insert video cache:", self._insert_cache.stats())
+
+    def make_avatar_clip(self, all_clips, audio_track, fps: float, still: bool):
+        """行ごとのクリップをつなげ、音声に合わせて口パクするキャラクターを重ねる"""
+        from moviepy.video.compositing.CompositeVideoClip import CompositeVideoClip
+        from moviepy.video.compositing.concatenate import concatenate_videoclips
+
+        from .LipSyncVideo import LipSyncVideo
+
+        avatar = self.config["output"]["avatar"]
+        if not isinstance(avatar, dict):
+            avatar = {"image_dir": avatar}
+        if self._lipsync is None:
+            self._lipsync = LipSyncVideo(Path(avatar.get("image_dir", "data/zundamon")))
+
+        width, height = all_clips[0].size
+        avatar_height = int(height * avatar.get("height_ratio", 0.5))
+        position = avatar.get("position", "right")
+        duration = sum(clip.duration for clip in all_clips)
+        if avatar.get("lipsync", "mora") == "mora":
+            # モーラの母音の区間だけ口を開ける
+            mask = LipSyncVideo.mouth_mask(
+                duration, fps, self.clip_speak_times, flap_rate=None
             )
-            video_clip.fps = fps
-            video_clip.audio = moviepy.editor.CompositeAudioClip(
-                [audio_clip.set_start(start)]
+        else:
+            mask = LipSyncVideo.mouth_mask_from_audio(audio_track, self.audio_fps, fps)
+
+        if still:
+            # 行ごとの画像にキャラクターを合成した 2 枚を作っておき、フレームごとに引くだけにする
+            backgrounds = [
+                (start, clip.img)
+                for (start, _, _), clip in zip(self.clip_cues, all_clips)
+            ]
+            return self._lipsync.create_video(
+                duration,
+                fps,
+                [],
+                mask=mask,
+                height=avatar_height,
+                backgrounds=backgrounds,
+                position=position,
             )
 
-            # Create text clip
-            fontsize = int(video_clip.size[0] * fontsize_ratio)
-            print("========", line, "==========")
-            txt_clip = moviepy.editor.TextClip(
-                line,
-                fontsize=fontsize,
-                color=fontcolor,
-                font=os.environ["MANUSCRIPTS_FONT"],
+        video = concatenate_videoclips(all_clips)
+        avatar_clip = self._lipsync.create_video(
+            duration, fps, [], mask=mask, height=avatar_height
+        )
+        x = 0 if position == "left" else width - avatar_clip.w
+        avatar_clip = avatar_clip.set_position((x, height - avatar_clip.h))
+        return CompositeVideoClip([video, avatar_clip])
+
+    def make_slide_clip(self, img_path: Path, script: Manuscript):
+        with self.profiler.span("slide", "render", slide=img_path.name):
+            return self.make_clip(
+                img_path,
+                script,
+                self.config["output"].get("fps", 30),
+                self.config["output"].get("manuscript_slide_margin", 1.0),
+                self.config["output"].get("manuscript_line_interval", 0.5),
+                self.config["output"].get("fontsize_ratio", 0.025),
+                self.config["output"].get("font_color", "green"),
             )
-            txt_clip.duration = video_clip.duration
-            txt_clip = txt_clip.set_position(("center", 0.9), relative=True)
 
-            # Composite clips
-            clip = moviepy.editor.CompositeVideoClip([video_clip, txt_clip])
-            clip.duration = video_clip.duration
+    def encode_params(self, still: bool):
+        """write_videofile に渡す fps と ffmpeg の追加パラメータを返す"""
+        output = self.config["output"]
+        fps = output.get("fps", 30)
+        if not still or output.get("render_mode") != "still":
+            return fps, None
+        if output.get("avatar") is not None:
+            # 口パクは通常の fps で動かす。フレームは合成済みの画像を引くだけなので軽い
+            return fps, None
 
-            # Append clip
-            all_clips.append(clip)
+        # 静止画は低い fps で書き出し、足りないフレームはエンコーダ側で複製させる。
+        # 複製したフレームはほぼコストなしでエンコードされる
+        still_fps = min(fps, output.get("still_fps", 4))
+        params = ["-r", str(fps)]
+        if output.get("segment_codec", "libx264") == "libx264":
+            params += ["-tune", "stillimage"]
+        return still_fps, params
+
+    def write_segment(self, img_path: Path, script: Manuscript, segment_path: Path):
+        """セグメントを書き出し、その長さと字幕のタイミングを返す"""
+        if script.video is not None:
+            # 変換済みの挿入動画はそのままセグメントとして連結できる
+            video_path = self.insert_video_path(img_path, script)
+            tmp_path = segment_path.with_name(
+                f"{segment_path.stem}.tmp{segment_path.suffix}"
+            )
+            tmp_path.unlink(missing_ok=True)
+            try:
+                os.link(video_path, tmp_path)
+            except OSError:
+                shutil.copyfile(video_path, tmp_path)
+            os.replace(tmp_path, segment_path)
+            return {"duration": probe_video(segment_path)["duration"], "cues": []}
+
+        clip = self.make_slide_clip(img_path, script)
+        cues = self.clip_cues
+        self.encode_segment(clip, segment_path)
+        # 映像はフレーム単位で切り上げられるので、クリップより長くなることがある。
+        # 連結するとこの長さでつながるので、字幕のずれないよう実際の長さを使う
+        return {"duration": probe_video(segment_path)["duration"], "cues": cues}
 
-        return moviepy.editor.concatenate_videoclips(all_clips)
+    def encode_segment(self, clip, segment_path: Path, still: bool = True):
+        """スライドのクリップを 1 つのセグメントとして書き出す"""
+        fps, ffmpeg_params = self.encode_params(still)
+        if ffmpeg_params is not None:
+            # 静止画は still_fps のフレーム単位で切り上げられ、still_fps が低いと
+            # スライドが最大 1/still_fps 秒長くなる。出力の fps の単位で切る
+            ffmpeg_params = ffmpeg_params + ["-t", f"{clip.duration:.6f}"]
+        output = self.config["output"]
+        if output.get("progressive") == "hls":
+            # 長いスライドも HLS_TARGET_DURATION 秒ごとに分けられるように、キーフレームを入れる
+            gop = int(output.get("fps", 30) * HLS_TARGET_DURATION)
+            ffmpeg_params = (ffmpeg_params or []) + ["-g", str(gop)]
+        if clip.audio is None:
+            # 連結時にストリーム構成を揃えるため、無音の音声トラックを付ける
+            from moviepy.audio.AudioClip import AudioArrayClip
+            import numpy as np
 
-    def export_video(self, on_progress=None) -> bool:
+            n_samples = int(clip.duration * self.audio_fps) + 1
+            clip = clip.set_audio(
+                AudioArrayClip(
+                    np.zeros((n_samples, 2)), fps=self.audio_fps
+                ).set_duration(clip.duration)
+            )
+        # 書きかけのセグメントが再利用されないように、書き終わってから rename する
+        tmp_path = segment_path.with_name(
+            f"{segment_path.stem}.tmp{segment_path.suffix}"
+        )
+        with self.profiler.span("encode", "encode", segment=segment_path.name):
+            clip.write_videofile(
+                str(tmp_path),
+                fps=fps,
+                codec=self.config["output"].get("segment_codec", "libx264"),
+                audio_codec="aac",
+                audio_fps=self.audio_fps,
+                ffmpeg_params=ffmpeg_params,
+                # moviepy は一時音声をカレントディレクトリに作るので、同名のセグメントを
+                # 別のデッキと同時に書き出しても衝突しないようにセグメントの隣に作る
+                temp_audiofile=str(tmp_path.with_suffix(".audio.m4a")),
+                preset=self.config["output"].get("preset", "medium"),
+                logger=None,
+            )
+        clip.close()
+        os.replace(tmp_path, segment_path)
+        self.profiler.count("bytes_written", segment_path.stat().st_size)
+
+    # セグメントの見た目に影響する output の設定
+    FINGERPRINT_OUTPUT_KEYS = [
+        "fps",
+        "manuscript_slide_margin",
+        "manuscript_line_interval",
+        "fontsize_ratio",
+        "font_color",
+        "segment_codec",
+        "render_mode",
+        "still_fps",
+        "subtitles",
+        "audio_fps",
+        "avatar",
+        "scale",
+        "preset",
+        "progressive",
+    ]
+
+    def fingerprint_slide(self, img_path: Path, script: Manuscript) -> str:
+        """スライドのセグメントを決める入力のハッシュ。同じなら同じセグメントになる"""
+        output = self.config["output"]
+        src = {
+            # セグメントの長さの記録のしかたを変えたら上げる
+            "segment_version": 3,
+            "image": self.image_store.digest(img_path),
+            "manuscript": script.to_json()["events"],
+            "output": {key: output.get(key) for key in self.FINGERPRINT_OUTPUT_KEYS},
+            "font": os.environ.get("MANUSCRIPTS_FONT"),
+        }
+
+        if script.video is not None:
+            path = Path(script.video.path)
+            src["video"] = (
+                self.insert_cache.digest(path) if path.exists() else str(path)
+            )
+        else:
+            src["engine"] = self.tts.engine_version()
+            if src["engine"] is None:
+                # エンジンのバージョンがわからないセグメントは、次の書き出しでは使わない
+                src["run"] = self.run_id
+
+        text = json.dumps(src, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(text.encode("utf8")).hexdigest()
+
+    @staticmethod
+    def reuse_segment(old_path: Path, segment_path: Path) -> bool:
+        """前回のセグメントを segment_path で使えるようにする。使えなければ False
+
+        output.segment_dir を変えたときは、前の場所のセグメントを今の場所にリンクする
+        """
+        if segment_path.exists():
+            return True
+        if not old_path.exists():
+            return False
         try:
-            # Get all image and manuscript paths
-            all_img_paths = list(self.workdir.glob("*.png"))
-            all_manuscrpt_paths = list(self.workdir.glob("*.txt"))
+            os.link(old_path, segment_path)
+        except OSError:
+            shutil.copyfile(old_path, segment_path)
+        return True
 
-            # Make clips for slides
-            all_clips = []
+    def load_segment_manifest(self, manifest_path: Path):
+        try:
+            return json.loads(manifest_path.read_text(encoding="utf8"))
+        except Exception:
+            return {"slides": []}
 
-            all_pairs = list(zip(all_img_paths, all_manuscrpt_paths))
+    def reusable_segments(self, segment_dir: Path, old_manifest, journal):
+        """前回の manifest とジャーナルにあって今回も使えるセグメント
 
-            def _is_int(s: str):
-                try:
-                    _ = int(s)
-                    return True
-                except Exception:
-                    return False
+        fingerprint -> {"duration", "cues", ...} を返す
+        """
+        reusable = []
+        if self.config["output"].get("incremental", True):
+            reusable = [slide for slide in old_manifest["slides"] if "cues" in slide]
+        # 途中で落ちたときは manifest が書かれないので、ジャーナルから拾う
+        reusable += journal.segments().values()
+        rendered = {}
+        for slide in reusable:
+            path = segment_dir / f"{slide['fingerprint']}.mp4"
+            if self.reuse_segment(Path(slide["segment"]), path):
+                rendered[slide["fingerprint"]] = dict(slide, segment=str(path))
+        return rendered
 
-            all_pairs = [(p, m) for p, m in all_pairs if _is_int(p.stem[4:])]
+    def write_segment_manifest(
+        self, manifest_path: Path, old_manifest, slides, rendered, slide_names
+    ):
+        """連結したセグメントを manifest に書き、前回使っていて今回使わなくなったものを消す
 
-            # スライドXXのXXの数で並び替える
-            all_pairs = sorted(all_pairs, key=lambda pm: int(pm[0].stem[4:]))
+        slides は連結した順の (スライド画像, fingerprint, セグメント)。
+        slide_names は今回書き出す範囲のスライド名。字幕を連結後の時刻にずらして返す
+        """
+        manifest = {"slides": []}
+        if self.config["output"].get("slide_range") is not None:
+            # 範囲外のスライドのセグメントは、次に全体を書き出すときに使うので残す
+            manifest["slides"] = [
+                slide
+                for slide in old_manifest["slides"]
+                if slide["slide"] not in slide_names
+            ]
+        all_cues = []
+        offset = 0.0
+        for img_path, fp, path in slides:
+            manifest["slides"].append(
+                {
+                    "slide": img_path.name,
+                    "fingerprint": fp,
+                    "segment": str(path),
+                    "duration": rendered[fp]["duration"],
+                    "cues": rendered[fp]["cues"],
+                }
+            )
+            all_cues += shift_cues(rendered[fp]["cues"], offset)
+            offset += rendered[fp]["duration"]
+        manifest_path.write_text(
+            json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf8"
+        )
 
-            from tqdm import tqdm
+        kept = {Path(slide["segment"]) for slide in manifest["slides"]}
+        for slide in old_manifest["slides"]:
+            if Path(slide["segment"]) not in kept:
+                Path(slide["segment"]).unlink(missing_ok=True)
+        return all_cues
 
-            for i, (img_path, manuscrpt_path) in tqdm(enumerate(all_pairs)):
-                if on_progress is not None:
-                    on_progress(
-                        (i + 1) / (len(all_pairs) + 2),
-                        f"Exporting a slide {img_path.name}",
-                    )
-                clip = self.make_clip(
-                    img_path,
-                    manuscrpt_path.read_text(encoding="utf8"),
-                    self.config["output"].get("fps", 30),
-                    self.config["output"].get("manuscript_slide_margin", 1.0),
-                    self.config["output"].get("manuscript_line_interval", 0.5),
-                    self.config["output"].get("fontsize_ratio", 0.025),
-                    self.config["output"].get("font_color", "green"),
-                )
-                all_clips.append(clip)
+    def list_slides(self):
+        """workdir 内の (スライド画像, 台本) のペアをスライド番号順に返す"""
 
-            if len(all_clips) <= 0:
-                print("No clips to concatenate")
+        def _is_int(s: str):
+            try:
+                _ = int(s)
+                return True
+            except Exception:
                 return False
 
-            # Concatenate clips
-            video = moviepy.editor.concatenate_videoclips(all_clips)
+        all_pairs = []
+        for img_path in self.workdir.glob("*"):
+            # PowerPoint は .PNG で書き出すので大文字小文字は区別しない
+            if img_path.suffix.lower() != ".png" or not _is_int(img_path.stem[4:]):
+                continue
+            manuscrpt_path = img_path.with_suffix(".txt")
+            if manuscrpt_path.exists():
+                all_pairs.append((img_path, manuscrpt_path))
+
+        # output.slide_range = [最初, 最後] (1 始まり、両端を含む) のスライドだけにする
+        slide_range = self.config["output"].get("slide_range")
+        if slide_range is not None:
+            first, last = slide_range
+            all_pairs = [
+                (img_path, manuscrpt_path)
+                for img_path, manuscrpt_path in all_pairs
+                if (first is None or int(img_path.stem[4:]) >= first)
+                and (last is None or int(img_path.stem[4:]) <= last)
+            ]
 
-            # Export video
-            if on_progress is not None:
-                on_progress(
-                    (len(all_pairs) + 1) / (len(all_pairs) + 2), "Writing a video file"
-                )
-            video.write_videofile(self.config["output"]["path"], audio_codec="aac")
+        # スライドXXのXXの数で並び替える
+        return sorted(all_pairs, key=lambda pm: int(pm[0].stem[4:]))
+
+    def export_video(self, on_progress=None, executor=None) -> bool:
+        """executor (ProcessPoolExecutor) を渡すと、そのワーカーでセグメントを書き出す
+
+        on_progress(0-1, メッセージ) には段階ごとの重みで計算した進捗を渡す
+        """
+        output = self.config["output"]
+        use_workers = executor is not None or output.get("workers", 0) > 0
+        if output.get("streaming", False):
+            mode, stages = "streaming", STREAMING_STAGES
+        elif use_workers:
+            mode, stages = "segments", SEGMENT_STAGES
+        elif (
+            output.get("checkpoint", True)
+            or output.get("progressive") is not None
+            or output.get("resume", False)
+            or output.get("skip_failed_slides", False)
+        ):
+            # 途中で落ちても続きから書き出したり (--resume)、途中から再生したり、
+            # スライドごとに失敗を扱ったりするには、スライドごとに書き出す必要がある。
+            # output.checkpoint: false なら全スライドを 1 回でエンコードする
+            mode, stages = "streaming", STREAMING_STAGES
+        else:
+            mode, stages = "single_pass", SINGLE_PASS_STAGES
+        progress = StageProgress(on_progress, stages)
+        try:
+            with self.profiler.activate(), self.profiler.span("export", "export"):
+                # Get all image and manuscript paths
+                all_pairs = self.list_slides()
+
+                if len(all_pairs) <= 0:
+                    print("No clips to concatenate")
+                    return False
+
+                # 台本の誤りは音声合成やエンコードを始める前に報告する
+                with self.profiler.span("compile", "prepare"):
+                    scripts = self.compile_manuscripts(all_pairs)
+
+                # 前のスライドを合成している間に後ろのスライドの音声を用意しておく。
+                # streaming ではメモリに収まるぶんだけ書き出しながら合成する。
+                # segments ではワーカーがキャッシュから読むので、キャッシュがなければ
+                # ここで合成してもワーカーがもう一度合成するだけになる
+                tts_futures = [[] for _ in scripts]
+                if mode == "single_pass" or (
+                    mode == "segments" and self.tts_cache is not None
+                ):
+                    tts_futures = self.prefetch_tts(scripts)
+                # 合成を待つ間に挿入動画を変換しておく
+                self.prepare_insert_videos(all_pairs, scripts)
+                progress.update("prepare", 1.0, "Prepared slides")
+
+                if mode == "streaming":
+                    all_cues = self.export_streaming(all_pairs, scripts, progress)
+                elif mode == "segments":
+                    all_cues = self.export_segments(
+                        all_pairs, scripts, tts_futures, progress, executor
+                    )
+                else:
+                    all_cues = self.export_single_pass(
+                        all_pairs, scripts, tts_futures, progress
+                    )
+
+                if self.config["output"].get("subtitles", "burn") != "burn":
+                    self.export_subtitles(all_cues)
+
+            if self.tts_cache is not None:
+                print("TTS cache:", self.tts_cache.stats())
+            print("Image store:", self.image_store.stats())
+            if len(self.tts.engines) > 1:
+                for stats in self.tts.engine_stats():
+                    print("TTS engine:", stats)
             return True
         except Exception as e:
             self.log_error(f"{e}\n{traceback.format_exc()}\n")
             return False
+        finally:
+            self.write_trace()
+
+    def write_trace(self):
+        """output.trace / output.chrome_trace が有効なら、出力の隣にトレースを書き出す"""
+        output = self.config["output"]
+        if not output.get("trace", False) and not output.get("chrome_trace", False):
+            return
+        print(self.profiler.summary())
+        output_path = Path(output["path"])
+        if output.get("trace", False):
+            self.profiler.write(output_path.with_suffix(".trace.json"))
+        if output.get("chrome_trace", False):
+            self.profiler.write(
+                output_path.with_suffix(".trace.chrome.json"), chrome=True
+            )
+
+    def slide_cost(self, script: Manuscript) -> float:
+        """進捗の計算に使うスライドの重さ。読み上げの文字数にほぼ比例する"""
+        if script.video is not None:
+            return 1.0
+        return 1.0 + sum(len(u.text) for u, _ in script.timeline()) / 20
+
+    def open_playlist(self):
+        """output.progressive = "hls" なら、書き出したスライドから順に追加するプレイリスト"""
+        output = self.config["output"]
+        progressive = output.get("progressive")
+        if progressive is None:
+            return None
+        if progressive != "hls":
+            raise ValueError(f"Unknown progressive output: {progressive}")
+        path = Path(
+            output.get("progressive_path", Path(output["path"]).with_suffix(".m3u8"))
+        )
+        print("Progressive output:", path)
+        return HlsPlaylist(path)
+
+    def open_journal(self, name: str) -> ExportJournal:
+        """スライドごとの進み具合を記録するジャーナル。output.resume なら前回の続きから"""
+        resume = self.config["output"].get("resume", False)
+        journal = ExportJournal(self.workdir / f"{name}.journal.jsonl", resume=resume)
+        if resume:
+            print(
+                f"Resuming: {len(journal.segments())} segments already exported,"
+                f" {len(journal.failures())} slides failed last time"
+            )
+        return journal
+
+    def write_segment_with_retries(
+        self,
+        img_path: Path,
+        script: Manuscript,
+        segment_path: Path,
+        fingerprint: str,
+        journal: ExportJournal,
+    ):
+        """このプロセスでセグメントを書き出す。失敗したら output.slide_retries 回まで試し直す
+
+        それでも失敗したら None を返す (デッキ全体は止めない)
+        """
+        retries = self.config["output"].get("slide_retries", 1)
+        for attempt in range(retries + 1):
+            try:
+                result = self.write_segment(img_path, script, segment_path)
+            except Exception as e:
+                print(f"Failed to export {img_path.name} (attempt {attempt + 1}): {e}")
+                journal.record(
+                    img_path.name,
+                    "failed",
+                    fingerprint=fingerprint,
+                    attempt=attempt,
+                    error=f"{e}\n{traceback.format_exc()}",
+                )
+                continue
+            if script.video is None:
+                journal.record(img_path.name, "tts", fingerprint=fingerprint)
+            self.record_segment(journal, img_path, fingerprint, segment_path, result)
+            return result
+        return None
+
+    @staticmethod
+    def record_segment(journal, img_path, fingerprint, segment_path, result):
+        journal.record(
+            img_path.name,
+            "segment",
+            fingerprint=fingerprint,
+            segment=str(segment_path),
+            duration=result["duration"],
+            cues=result["cues"],
+        )
+
+    def check_failed_slides(self, all_pairs, fingerprints, rendered, journal):
+        """書き出せなかったスライドを報告し、連結するスライドの index を返す
+
+        output.skip_failed_slides なら、失敗したスライドを除いて書き出しを続ける
+        """
+        failures = journal.failures()
+        failed = [
+            img_path.name
+            for (img_path, _), fp in zip(all_pairs, fingerprints)
+            if fp not in rendered
+        ]
+        if len(failed) > 0:
+            report = "\n".join(
+                f"{name}: {failures.get(name, '').strip()}" for name in failed
+            )
+            msg = f"Failed to export {len(failed)} slides: {', '.join(failed)}"
+            if not self.config["output"].get("skip_failed_slides", False):
+                raise RuntimeError(
+                    f"{msg}\nRun again with --resume to retry only these slides\n"
+                    + report
+                )
+            print(f"Warning: {msg} (skipped)")
+            self.log_error(report)
+        self.profiler.count("slides_failed", len(failed))
+        return [i for i, fp in enumerate(fingerprints) if fp in rendered]
+
+    def add_to_playlist(self, playlist, index: int, segment_path: Path):
+        if playlist is None:
+            return
+        with self.profiler.span("hls", "export", index=index):
+            n_added = playlist.add(index, segment_path)
+
+    def estimate_slide_bytes(self, img_path: Path, script: Manuscript):
+        """スライド 1 枚を組み立てるのに使うメモリと、そのうち合成済みの音声のぶん (バイト)
+
+        読み上げの長さは文字数から見積もる (おおよそ 1 秒に 6 文字)
+        """
+        if script.video is not None:
+            # 挿入動画は変換済みのファイルをそのまま使うのでメモリを使わない
+            return 0, 0
+        lines = script.timeline()
+        seconds = sum(len(u.text) / (6 * u.speed) + wait for u, wait in lines)
+        seconds += len(lines) * self.config["output"].get(
+            "manuscript_line_interval", 0.5
+        )
+        # wav (モノラル 16bit) と、デコードした float32 ステレオの配列 2 つぶん
+        wav_bytes = int(seconds * self.audio_fps * 2)
+        audio_bytes = int(seconds * self.audio_fps * 2 * 4 * 2)
+        # 静止画モードでは字幕を焼き込んだ画像を行ごとに持つ
+        try:
+            width, height = self.slide_size(img_path)
+        except Exception:
+            # 読めない画像はそのスライドを書き出すときに失敗として報告する
+            width, height = 0, 0
+        frames = 1
+        if self.config["output"].get("render_mode") == "still":
+            frames += len(lines)
+        return wav_bytes + audio_bytes + frames * width * height * 3, wav_bytes
+
+    def stream_slides(self, all_pairs, scripts):
+        """スライドを 1 枚ずつ返すジェネレータ
+
+        次のスライドを取り出す前に、output.memory_budget_mb に収まるぶんだけ
+        後ろのスライドの音声を先に合成しておく。合成済みの音声は取り出したスライドを
+        組み立てるときに手放すので、メモリに残るのはおおよそ 1-2 枚ぶんになる。
+        画像と字幕のキャッシュの上限も予算に含める。
+        """
+        budget = self.reserve_cache_memory(
+            self.config["output"].get("memory_budget_mb", 1024) * 2**20
+        )
+        estimates = [
+            self.estimate_slide_bytes(img_path, script)
+            for (img_path, _), script in zip(all_pairs, scripts)
+        ]
+        # 次に合成を投げるスライドと、投げたがまだ組み立てていない音声の見積もり
+        next_prefetch = 0
+        prefetched_bytes = 0
+        for i, ((img_path, _), script) in enumerate(zip(all_pairs, scripts)):
+            slide_bytes, wav_bytes = estimates[i]
+            if i < next_prefetch:
+                prefetched_bytes -= wav_bytes
+            if slide_bytes > budget:
+                print(
+                    f"Warning: {img_path.name} may need {slide_bytes / 2**20:.0f}MB"
+                    f" (memory_budget_mb={budget / 2**20:g})"
+                )
+            # 今のスライドと次のスライドの音声は予算に関係なく合成する
+            while next_prefetch < len(scripts) and (
+                next_prefetch <= i + 1
+                or slide_bytes + prefetched_bytes + estimates[next_prefetch][1]
+                <= budget
+            ):
+                self.prefetch_tts(scripts[next_prefetch : next_prefetch + 1])
+                if next_prefetch > i:
+                    prefetched_bytes += estimates[next_prefetch][1]
+                next_prefetch += 1
+            yield img_path, script
+
+    def reserve_cache_memory(self, budget: int) -> int:
+        """画像と字幕のキャッシュの上限を budget から取り、残りのバイト数を返す
+
+        キャッシュの上限の合計が budget の半分を超えるときは、半分に収まるように縮める
+        """
+        caches = [self.image_store, self.subtitle_renderer]
+        total = sum(cache.max_bytes for cache in caches)
+        if total > budget // 2:
+            for cache in caches:
+                cache.max_bytes = cache.max_bytes * (budget // 2) // total
+            total = sum(cache.max_bytes for cache in caches)
+        return budget - total
+
+    @staticmethod
+    def tts_done(tts_futures) -> float:
+        """先に投げた音声合成が終わった割合"""
+        futures = [f for slide in tts_futures for f in slide]
+        if len(futures) <= 0:
+            return 1.0
+        return sum(f.done() for f in futures) / len(futures)
+
+    def export_subtitles(self, all_cues):
+        """字幕を .srt/.vtt に書き出す。soft なら動画に字幕ストリームとして埋め込む"""
+        output_path = Path(self.config["output"]["path"])
+        srt_path = output_path.with_suffix(".srt")
+        write_srt(all_cues, srt_path)
+        write_vtt(all_cues, output_path.with_suffix(".vtt"))
+
+        if self.config["output"]["subtitles"] == "soft":
+            tmp_path = output_path.with_name(
+                f"{output_path.stem}.tmp{output_path.suffix}"
+            )
+            with self.profiler.span("mux_subtitles", "export"):
+                mux_subtitles(output_path, srt_path, tmp_path)
+            os.replace(tmp_path, output_path)
+
+    def export_single_pass(self, all_pairs, scripts, tts_futures, progress=None):
+        from moviepy.video.compositing.concatenate import concatenate_videoclips
+        from tqdm import tqdm
+
+        from .EncodeProgressLogger import EncodeProgressLogger
+
+        if progress is None:
+            progress = StageProgress(None, SINGLE_PASS_STAGES)
+        costs = [self.slide_cost(script) for script in scripts]
+
+        # 同じ画像と台本のスライド (アニメーションの途中で止めて書き出したものなど) は
+        # 同じクリップを使い回し、合成し直さない
+        fingerprints = [
+            self.fingerprint_slide(img_path, script)
+            for (img_path, _), script in zip(all_pairs, scripts)
+        ]
+        self.profiler.count(
+            "slides_deduplicated", len(fingerprints) - len(set(fingerprints))
+        )
+
+        # Make clips for slides
+        clips = {}
+        all_clips = []
+        all_cues = []
+        offset = 0.0
+        for i, ((img_path, _), script) in tqdm(enumerate(zip(all_pairs, scripts))):
+            message = f"Exporting a slide {img_path.name}"
+            progress.update("tts", self.tts_done(tts_futures), message)
+            if fingerprints[i] not in clips:
+                clip = self.make_slide_clip(img_path, script)
+                clips[fingerprints[i]] = (clip, self.clip_cues)
+            clip, cues = clips[fingerprints[i]]
+            all_clips.append(clip)
+            all_cues += shift_cues(cues, offset)
+            offset += clip.duration
+            progress.update("clips", sum(costs[: i + 1]) / sum(costs), message)
+        progress.update("tts", 1.0, "Writing a video file")
+
+        # Concatenate clips
+        video = concatenate_videoclips(all_clips)
+
+        # Export video
+        # 挿入動画があるときは、動画のフレームレートを落とさないように通常の fps で書き出す
+        fps, ffmpeg_params = self.encode_params(
+            all(script.video is None for script in scripts)
+        )
+        output_path = Path(self.config["output"]["path"])
+        with self.profiler.span("encode", "encode", slides=len(all_pairs)):
+            video.write_videofile(
+                str(output_path),
+                fps=fps,
+                audio_codec="aac",
+                audio_fps=self.audio_fps,
+                ffmpeg_params=ffmpeg_params,
+                preset=self.config["output"].get("preset", "medium"),
+                logger=EncodeProgressLogger(progress),
+            )
+        self.profiler.count("bytes_written", output_path.stat().st_size)
+        self.profiler.count("slides_rendered", len(all_pairs))
+        return all_cues
+
+    def export_streaming(self, all_pairs, scripts, progress=None):
+        """スライドを 1 枚ずつ組み立ててはセグメントに書き出して手放し、最後に連結する
+
+        全スライドのクリップを同時に持たないので、長いデッキでもメモリは
+        スライド 1-2 枚ぶんで済む。書き出しはこのプロセスで順に行う
+        """
+        output = self.config["output"]
+        if progress is None:
+            progress = StageProgress(None, STREAMING_STAGES)
+        name = "__stream__" if self.profile is None else f"__stream_{self.profile}__"
+        segment_dir = self.workdir / name
+        segment_dir.mkdir(parents=True, exist_ok=True)
+        manifest_path = self.workdir / f"{name}.json"
+        old_manifest = self.load_segment_manifest(manifest_path)
+        journal = self.open_journal(name)
+
+        fingerprints = [
+            self.fingerprint_slide(img_path, script)
+            for (img_path, _), script in zip(all_pairs, scripts)
+        ]
+        segment_paths = [segment_dir / f"{fp}.mp4" for fp in fingerprints]
+        # 前回から変わっていないスライドと、resume のときにジャーナルに
+        # 書き出し済みと記録されたスライドは、セグメントを再利用して飛ばす
+        rendered = self.reusable_segments(segment_dir, old_manifest, journal)
+        todo = [i for i, fp in enumerate(fingerprints) if fp not in rendered]
+        # 同じ画像と台本のスライドは最初の 1 枚だけ書き出し、セグメントを共有する
+        n_todo = len({fingerprints[i] for i in todo})
+        self.profiler.count(
+            "slides_deduplicated", len(fingerprints) - len(set(fingerprints))
+        )
+
+        costs = [self.slide_cost(script) for script in scripts]
+        done_cost = sum(costs) - sum(costs[i] for i in todo)
+        playlist = self.open_playlist()
+        for i, fp in enumerate(fingerprints):
+            if fp in rendered:
+                self.add_to_playlist(playlist, i, segment_paths[i])
+
+        slides = self.stream_slides(
+            [all_pairs[i] for i in todo], [scripts[i] for i in todo]
+        )
+        n_rendered = 0
+        for i, (img_path, script) in zip(todo, slides):
+            fp = fingerprints[i]
+            if fp not in rendered:
+                result = self.write_segment_with_retries(
+                    img_path, script, segment_paths[i], fp, journal
+                )
+                if result is None:
+                    if playlist is not None:
+                        playlist.skip(i)
+                    continue
+                rendered[fp] = result
+                n_rendered += 1
+                # 字幕がほかのスライドと同じになることはまれなので、スライドごとに手放す
+                self.subtitle_renderer.clear()
+            self.add_to_playlist(playlist, i, segment_paths[i])
+            done_cost += costs[i]
+            progress.update(
+                "render",
+                done_cost / sum(costs),
+                f"Exported {n_rendered}/{n_todo} slides",
+            )
+        self.rendered_slides = n_rendered
+        self.profiler.count("slides_rendered", n_rendered)
+        self.profiler.count("slides_reused", len(all_pairs) - len(todo))
+
+        indices = self.check_failed_slides(all_pairs, fingerprints, rendered, journal)
+        output_path = Path(output["path"])
+        with self.profiler.span("concat", "export", segments=len(indices)):
+            concat_segments([segment_paths[i] for i in indices], output_path)
+        self.profiler.count("bytes_written", output_path.stat().st_size)
+        if playlist is not None:
+            playlist.end()
+        progress.update("concat", 1.0, "Concatenated segments")
+
+        # セグメントは次の書き出しで再利用できるように manifest に残す
+        all_cues = self.write_segment_manifest(
+            manifest_path,
+            old_manifest,
+            [(all_pairs[i][0], fingerprints[i], segment_paths[i]) for i in indices],
+            rendered,
+            {img_path.name for img_path, _ in all_pairs},
+        )
+        if len(indices) == len(all_pairs):
+            # 飛ばしたスライドがあれば、--resume で書き出し直せるように残しておく
+            journal.remove()
+        return all_cues
+
+    def export_segments(
+        self, all_pairs, scripts, tts_futures, progress=None, executor=None
+    ):
+        """スライドごとにワーカープロセスでセグメントを書き出し、再エンコードせずに連結する
+
+        executor を渡さなければ output.workers 個のプロセスを立ち上げる
+        """
+        from tqdm import tqdm
+
+        output = self.config["output"]
+        # プロファイルごとにセグメントを分け、preview で本番のセグメントを消さないようにする
+        name = (
+            "__segments__" if self.profile is None else f"__segments_{self.profile}__"
+        )
+        segment_dir = Path(output.get("segment_dir", self.workdir / name))
+        segment_dir.mkdir(parents=True, exist_ok=True)
+        manifest_path = self.workdir / f"{name}.json"
+        old_manifest = self.load_segment_manifest(manifest_path)
+
+        # セグメントは入力のハッシュで名前を付け、入力が変わっていなければ再利用する
+        fingerprints = [
+            self.fingerprint_slide(img_path, script)
+            for (img_path, _), script in zip(all_pairs, scripts)
+        ]
+        segment_paths = [segment_dir / f"{fp}.mp4" for fp in fingerprints]
+        # 同じ画像と台本のスライドは同じセグメントを共有し、1 回だけ書き出す
+        self.profiler.count(
+            "slides_deduplicated", len(fingerprints) - len(set(fingerprints))
+        )
+
+        # fingerprint -> {"duration", "cues"}。前回の manifest にあるセグメントは再利用できる
+        journal = self.open_journal(name)
+        rendered = self.reusable_segments(segment_dir, old_manifest, journal)
+
+        if progress is None:
+            progress = StageProgress(None, SEGMENT_STAGES)
+        # 再利用するセグメントのぶんは最初から終わっている
+        costs = {}
+        for fp, script in zip(fingerprints, scripts):
+            costs[fp] = self.slide_cost(script)
+        total_cost = sum(costs.values())
+        done_cost = sum(costs[fp] for fp in costs if fp in rendered)
+
+        # 書き出しの終わったスライドから順にプレイリストに追加する
+        playlist = self.open_playlist()
+
+        def add_to_playlist(fp):
+            for i, (other, path) in enumerate(zip(fingerprints, segment_paths)):
+                if other == fp:
+                    self.add_to_playlist(playlist, i, path)
+
+        for fp in set(fingerprints) & set(rendered):
+            add_to_playlist(fp)
+
+        # ワーカーはデッキを 1 回だけ読んで Project を作り、タスクではスライドの index だけを受け取る
+        deck_path = self.workdir / f"{name}.{self.run_id}.deck.pickle"
+        with open(deck_path, "wb") as f:
+            pickle.dump(
+                {
+                    "config": self.config,
+                    "workdir": self.workdir,
+                    "slides": [
+                        (img_path, script, segment_path)
+                        for (img_path, _), script, segment_path in zip(
+                            all_pairs, scripts, segment_paths
+                        )
+                    ],
+                },
+                f,
+            )
+
+        retries = output.get("slide_retries", 1)
+        own_executor = executor is None
+        if own_executor:
+            executor = _create_worker_pool(output["workers"], deck_path)
+        # future -> (スライドの index, 何回目か, 投げた executor)
+        futures = {}
+
+        def submit(i: int, attempt: int):
+            future = executor.submit(_render_segment, str(deck_path), i)
+            futures[future] = (i, attempt, executor)
+
+        try:
+            submitted = set()
+            for i, ((img_path, _), fp, tts) in enumerate(
+                zip(all_pairs, fingerprints, tts_futures)
+            ):
+                if fp in rendered or fp in submitted:
+                    continue
+
+                # ワーカーがキャッシュから音声を読めるように、合成が終わったスライドから投げる
+                if self.tts_cache is not None:
+                    with self.profiler.span("tts_wait", "render", slide=img_path.name):
+                        concurrent.futures.wait(tts)
+                    if all(f.exception() is None for f in tts):
+                        journal.record(img_path.name, "tts", fingerprint=fp)
+                progress.update(
+                    "tts", self.tts_done(tts_futures), f"Synthesized {img_path.name}"
+                )
+                submit(i, 0)
+                submitted.add(fp)
+
+            print(
+                f"Rendering {len(submitted)}/{len(all_pairs)} slides (others unchanged)"
+            )
+            progress.update("tts", 1.0, "Synthesized all slides")
+            n_done = 0
+            bar = tqdm(total=len(submitted))
+            while len(futures) > 0:
+                done, _ = concurrent.futures.wait(
+                    futures, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    i, attempt, future_executor = futures.pop(future)
+                    (img_path, _), fp = all_pairs[i], fingerprints[i]
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        # 失敗したスライドだけを試し直し、ほかのスライドは続ける
+                        print(
+                            f"Failed to export {img_path.name} (attempt {attempt + 1}): {e}"
+                        )
+                        journal.record(
+                            img_path.name,
+                            "failed",
+                            fingerprint=fp,
+                            attempt=attempt,
+                            error=str(e),
+                        )
+                        if (
+                            isinstance(e, BrokenProcessPool)
+                            and own_executor
+                            and future_executor is executor
+                        ):
+                            # ワーカーが落ちると executor ごと使えなくなるので作り直す
+                            executor.shutdown(wait=False)
+                            executor = _create_worker_pool(output["workers"], deck_path)
+                        if attempt < retries:
+                            try:
+                                submit(i, attempt + 1)
+                                continue
+                            except BrokenProcessPool:
+                                pass
+                        for j, other in enumerate(fingerprints):
+                            if other == fp and playlist is not None:
+                                playlist.skip(j)
+                        bar.update(1)
+                        continue
+
+                    # ワーカーで記録した時間とカウンタを取り込む (manifest には残さない)
+                    self.profiler.merge(result.pop("trace"))
+                    rendered[fp] = result
+                    self.record_segment(journal, img_path, fp, segment_paths[i], result)
+                    add_to_playlist(fp)
+                    done_cost += costs[fp]
+                    n_done += 1
+                    bar.update(1)
+                    progress.update(
+                        "render",
+                        done_cost / total_cost,
+                        f"Exported {n_done}/{len(submitted)} slides",
+                    )
+            bar.close()
+        finally:
+            if own_executor:
+                executor.shutdown()
+            deck_path.unlink(missing_ok=True)
+        self.rendered_slides = n_done
+        self.profiler.count("slides_rendered", n_done)
+        self.profiler.count("slides_reused", len(all_pairs) - len(submitted))
+
+        indices = self.check_failed_slides(all_pairs, fingerprints, rendered, journal)
+        n_failed = len(all_pairs) - len(indices)
+        slide_names = {img_path.name for img_path, _ in all_pairs}
+        all_pairs = [all_pairs[i] for i in indices]
+        fingerprints = [fingerprints[i] for i in indices]
+        segment_paths = [segment_paths[i] for i in indices]
+
+        progress.update("render", 1.0, "Concatenating segments")
+        output_path = Path(output["path"])
+        with self.profiler.span("concat", "export", segments=len(segment_paths)):
+            concat_segments(segment_paths, output_path)
+        self.profiler.count("bytes_written", output_path.stat().st_size)
+        if playlist is not None:
+            playlist.end()
+        progress.update("concat", 1.0, "Concatenated segments")
+
+        all_cues = self.write_segment_manifest(
+            manifest_path,
+            old_manifest,
+            [
+                (img_path, fp, path)
+                for (img_path, _), fp, path in zip(
+                    all_pairs, fingerprints, segment_paths
+                )
+            ],
+            rendered,
+            slide_names,
+        )
+        if n_failed == 0:
+            # 書き出したセグメントは manifest に残したので、ジャーナルはいらない
+            journal.remove()
+        return all_cues
+
+
+# ワーカープロセスで使い回すデッキ。デッキのパス -> (Project, [(スライド画像, 台本, セグメント)])
+_worker_decks = OrderedDict()
+# batch_to_video の共有のプールでは複数のデッキのスライドが来るので、最近のものだけ残す
+WORKER_MAX_DECKS = 4
+
+
+def _create_worker_pool(max_workers: int, deck_path: Path) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(
+        max_workers=max_workers, initializer=_init_worker, initargs=(str(deck_path),)
+    )
+
+
+def _init_worker(deck_path: str):
+    """ワーカーの起動時に Project (音声合成の接続やキャッシュ) を 1 回だけ作っておく"""
+    _load_worker_deck(deck_path)
+
+
+def _load_worker_deck(deck_path: str):
+    deck = _worker_decks.get(deck_path)
+    if deck is not None:
+        _worker_decks.move_to_end(deck_path)
+        return deck
+    with open(deck_path, "rb") as f:
+        state = pickle.load(f)
+    # workdir には import 済みの画像と台本があるので、png_txt として開き直す
+    config = dict(
+        state["config"], input={"type": "png_txt", "path": str(state["workdir"])}
+    )
+    deck = _worker_decks[deck_path] = (Project(config), state["slides"])
+    while len(_worker_decks) > WORKER_MAX_DECKS:
+        _close_worker_deck(next(iter(_worker_decks)))
+    return deck
+
+
+def _close_worker_deck(deck_path: str):
+    project, _ = _worker_decks.pop(deck_path)
+    project.__exit__(None, None, None)
+
+
+def _render_segment(deck_path: str, index: int):
+    """ProcessPoolExecutor のワーカーで index 番目のスライドのセグメントを書き出す"""
+    project, slides = _load_worker_deck(deck_path)
+    img_path, script, segment_path = slides[index]
+    project.profiler.reset()
+    try:
+        with project.profiler.activate():
+            result = project.write_segment(img_path, script, segment_path)
+    except Exception:
+        # 試し直すときは Project から作り直す
+        _close_worker_deck(deck_path)
+        raise
+    result["trace"] = project.profiler.to_json()
+    return result
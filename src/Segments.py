@@ -0,0 +1,264 @@
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+from pathlib import Path
+from typing import List, Optional
+
+
+def ffmpeg_binary() -> str:
+    from moviepy.config import get_setting
+
+    return get_setting("FFMPEG_BINARY")
+
+
+def file_digest(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def probe_video(path: Path) -> dict:
+    """ffmpeg -i の出力から動画の情報を読む (ffprobe は同梱されていないことがあるので)"""
+    res = subprocess.run(
+        [ffmpeg_binary(), "-hide_banner", "-i", str(path)],
+        capture_output=True,
+    )
+    text = res.stderr.decode(errors="replace")
+    info = {
+        "duration": None,
+        "video_codec": None,
+        "profile": None,
+        "pix_fmt": None,
+        "width": None,
+        "height": None,
+        # 平均のフレームレート・推定した実際のフレームレート・タイムベース
+        "fps": None,
+        "tbr": None,
+        "tbn": None,
+        "audio_codec": None,
+        "audio_rate": None,
+        "audio_channels": None,
+    }
+    m = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", text)
+    if m is not None:
+        h, mi, sec = m.groups()
+        info["duration"] = int(h) * 3600 + int(mi) * 60 + float(sec)
+    for line in text.splitlines():
+        if "Video:" in line and info["video_codec"] is None:
+            info["video_codec"] = line.split("Video:")[1].split()[0].strip(",")
+            m = re.search(r"Video: \w+ \(([^)/]+)\)", line)
+            if m is not None:
+                info["profile"] = m.group(1)
+            m = re.search(r", (\w+)(?:\(.*?\))?, (\d+)x(\d+)", line)
+            if m is not None:
+                info["pix_fmt"] = m.group(1)
+                info["width"], info["height"] = int(m.group(2)), int(m.group(3))
+            for key in ("fps", "tbr", "tbn"):
+                m = re.search(rf"(\d+(?:\.\d+)?)(k?) {key}\b", line)
+                if m is not None:
+                    info[key] = float(m.group(1)) * (1000 if m.group(2) else 1)
+        elif "Audio:" in line and info["audio_codec"] is None:
+            info["audio_codec"] = line.split("Audio:")[1].split()[0].strip(",")
+            m = re.search(r"(\d+) Hz, (\w+)", line)
+            if m is not None:
+                info["audio_rate"] = int(m.group(1))
+                info["audio_channels"] = m.group(2)
+    if info["duration"] is None and info["video_codec"] is None:
+        raise RuntimeError(f"Failed to read video {path}: {text}")
+    return info
+
+
+def probe_h264_level(path: Path) -> Optional[int]:
+    """H.264 の SPS の level_idc (4.1 なら 41)。読めなければ None
+
+    ffmpeg -i には表示されないので、先頭のフレームのヘッダを trace_headers で読む
+    """
+    res = subprocess.run(
+        [ffmpeg_binary(), "-hide_banner", "-i", str(path)]
+        + ["-map", "0:v:0", "-c:v", "copy", "-bsf:v", "trace_headers"]
+        + ["-frames:v", "1", "-f", "null", "-"],
+        capture_output=True,
+    )
+    m = re.search(r"level_idc\s+\d+ = (\d+)", res.stderr.decode(errors="replace"))
+    return None if m is None else int(m.group(1))
+
+
+def concat_segments(segment_paths: List[Path], output_path: Path):
+    """再エンコードせずに (stream copy で) セグメントを連結する
+
+    セグメントはコーデック・解像度・fps・音声の構成が揃っている必要がある
+    """
+    output_path = Path(output_path)
+    list_path = output_path.with_name(output_path.name + ".concat.txt")
+    lines = []
+    for p in segment_paths:
+        escaped = Path(p).resolve().as_posix().replace("'", "'\\''")
+        lines.append(f"file '{escaped}'")
+    list_path.write_text("\n".join(lines) + "\n", encoding="utf8")
+
+    cmd = [
+        ffmpeg_binary(),
+        "-y",
+        "-loglevel",
+        "error",
+        "-f",
+        "concat",
+        "-safe",
+        "0",
+        "-i",
+        str(list_path),
+        "-c",
+        "copy",
+        str(output_path),
+    ]
+    try:
+        subprocess.run(cmd, check=True, capture_output=True)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(
+            f"Failed to concatenate segments: {e.stderr.decode(errors='replace')}"
+        ) from e
+    finally:
+        list_path.unlink(missing_ok=True)
+
+
+# HLS のセグメントの最初のタイムスタンプ (秒)。B フレームで dts が負にならないように余裕を持たせる
+HLS_START_TIME = 10.0
+# HLS のセグメントの長さの上限 (秒)。途中で変えるとプレイヤーが読み込みの間隔を誤るので固定する
+HLS_TARGET_DURATION = 6
+
+
+class HlsPlaylist:
+    """スライドのセグメントを HLS (MPEG-TS) のセグメントとして順に追加していく
+
+    書き出しが終わったスライドから再生できるように、プレイリストは追加するたびに
+    書き換える (EVENT 形式)。セグメントは再エンコードせずに mpegts に詰め替え、
+    target_duration より長いスライドはキーフレームで分ける。
+    """
+
+    def __init__(self, playlist_path: Path, target_duration: int = HLS_TARGET_DURATION):
+        self.playlist_path = Path(playlist_path)
+        self.target_duration = target_duration
+        self.segment_dir = self.playlist_path.with_name(
+            self.playlist_path.stem + "_hls"
+        )
+        shutil.rmtree(self.segment_dir, ignore_errors=True)
+        self.segment_dir.mkdir(parents=True)
+        self.durations = []
+        # 前のスライドが終わるのを待っているセグメント。index -> path
+        self.pending = {}
+        self.next_index = 0
+        self.ended = False
+        self._write()
+
+    def add(self, index: int, segment_path: Path) -> int:
+        """index 番目のスライドのセグメントを追加する。前のスライドがそろうまでは保留する
+
+        実際にプレイリストに追加したセグメントの数を返す
+        """
+        self.pending[index] = Path(segment_path)
+        return self._flush()
+
+    def skip(self, index: int) -> int:
+        """index 番目のスライドは書き出せなかったので、飛ばして後ろのスライドを追加する"""
+        self.pending[index] = None
+        return self._flush()
+
+    def _flush(self) -> int:
+        n_added = 0
+        while self.next_index in self.pending:
+            segment_path = self.pending.pop(self.next_index)
+            self.next_index += 1
+            if segment_path is not None:
+                self._append(segment_path)
+                n_added += 1
+        if n_added > 0:
+            self._write()
+        return n_added
+
+    def _append(self, segment_path: Path):
+        # タイムスタンプを前のスライドの続きにして、切れ目なく再生できるようにする。
+        # セグメントはフレーム単位で切り上げられていることがあるので、記録された長さではなく
+        # 書き出したパケットの実際の長さで続きを決める。短いと前のセグメントと重なる
+        offset = HLS_START_TIME + sum(self.durations)
+        list_path = self.segment_dir / "chunks.csv"
+        cmd = [
+            ffmpeg_binary(),
+            "-y",
+            "-loglevel",
+            "error",
+            "-i",
+            str(segment_path),
+            "-c",
+            "copy",
+            "-muxdelay",
+            "0",
+            "-muxpreload",
+            "0",
+            "-output_ts_offset",
+            f"{offset:.6f}",
+            "-f",
+            "segment",
+            "-segment_format",
+            "mpegts",
+            "-segment_time",
+            str(self.target_duration),
+            "-reset_timestamps",
+            "0",
+            "-segment_list",
+            str(list_path),
+            "-segment_list_type",
+            "csv",
+            str(self.segment_dir / "chunk%05d.tmp.ts"),
+        ]
+        try:
+            subprocess.run(cmd, check=True, capture_output=True)
+        except subprocess.CalledProcessError as e:
+            for tmp_path in self.segment_dir.glob("chunk*.tmp.ts"):
+                tmp_path.unlink()
+            raise RuntimeError(
+                f"Failed to write HLS segment: {e.stderr.decode(errors='replace')}"
+            ) from e
+
+        # csv は "ファイル名,開始,終了" の行。最初の行の開始は offset ではなく 0 になるので、
+        # 前の行の終了から長さを決める
+        end = offset
+        for line in list_path.read_text(encoding="utf8").splitlines():
+            name, _, chunk_end = line.rsplit(",", 2)
+            duration = float(chunk_end) - end
+            end = float(chunk_end)
+            if duration > self.target_duration + 0.5:
+                # キーフレームの間隔が長い挿入動画は分けきれない
+                print(
+                    f"Warning: HLS segment of {segment_path.name} is {duration:.1f}s"
+                    f" (> {self.target_duration}s)"
+                )
+            ts_path = self.segment_dir / f"{len(self.durations):05d}.ts"
+            os.replace(self.segment_dir / name, ts_path)
+            self.durations.append(duration)
+        list_path.unlink()
+
+    def end(self):
+        """全スライドを追加し終えたことをプレイヤーに伝える"""
+        self.ended = True
+        self._write()
+
+    def _write(self):
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            "#EXT-X-PLAYLIST-TYPE:EVENT",
+            f"#EXT-X-TARGETDURATION:{self.target_duration}",
+            "#EXT-X-MEDIA-SEQUENCE:0",
+        ]
+        for i, duration in enumerate(self.durations):
+            lines += [f"#EXTINF:{duration:.3f},", f"{self.segment_dir.name}/{i:05d}.ts"]
+        if self.ended:
+            lines.append("#EXT-X-ENDLIST")
+        # 書きかけのプレイリストを読まれないように rename で置き換える
+        tmp_path = self.playlist_path.with_suffix(".tmp.m3u8")
+        tmp_path.write_text("\n".join(lines) + "\n", encoding="utf8")
+        os.replace(tmp_path, self.playlist_path)
@@ -0,0 +1,137 @@
+import re
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+
+# 英数字の単語は途中で折り返さない。それ以外 (日本語など) は 1 文字ずつ折り返せる
+_WRAP_TOKEN = re.compile(r"[A-Za-z0-9_.,:;!?'\"()\-]+\s*|\s+|.")
+
+
+class SubtitleRenderer:
+    """字幕を ImageMagick を使わずにプロセス内で RGBA 画像 (numpy) に描画する
+
+    フォントごとの文字幅と、描画済みの字幕画像をキャッシュする。
+    字幕画像の合計が max_bytes を超えたら、最後に使われたのが古いものから手放す (LRU)
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, line_spacing: float = 0.2):
+        self.max_bytes = max_bytes
+        self.line_spacing = line_spacing
+        self._fonts = {}
+        self._advances = {}
+        self._rasters: OrderedDict[tuple, np.ndarray] = OrderedDict()
+        self.cache_bytes = 0
+
+    def clear(self):
+        """描画済みの字幕画像を手放す"""
+        self._rasters.clear()
+        self.cache_bytes = 0
+
+    def _font(self, font: str, fontsize: int):
+        key = (font, fontsize)
+        if key not in self._fonts:
+            if font is None:
+                # 英数字しかないので、日本語の字幕には使えない
+                self._fonts[key] = ImageFont.load_default(fontsize)
+            else:
+                self._fonts[key] = ImageFont.truetype(font, fontsize)
+        return self._fonts[key]
+
+    def _advance(self, token: str, font: str, fontsize: int) -> float:
+        key = (token, font, fontsize)
+        if key not in self._advances:
+            self._advances[key] = self._font(font, fontsize).getlength(token)
+        return self._advances[key]
+
+    def wrap(self, text: str, fontsize: int, font: str, max_width: int = None):
+        """max_width に収まるように text を行に分割する"""
+        if max_width is None:
+            return [text]
+
+        lines = []
+        current, width = "", 0.0
+        for token in _WRAP_TOKEN.findall(text):
+            w = self._advance(token, font, fontsize)
+            if current and width + w > max_width:
+                lines.append(current.rstrip())
+                current, width = "", 0.0
+                token = token.lstrip()
+                if not token:
+                    continue
+                w = self._advance(token, font, fontsize)
+            current += token
+            width += w
+        if current.strip() or not lines:
+            lines.append(current.rstrip())
+        return lines
+
+    def render(
+        self,
+        text: str,
+        fontsize: int,
+        color: str,
+        font: str = None,
+        max_width: int = None,
+    ) -> np.ndarray:
+        """字幕を描画した (H, W, 4) の uint8 配列を返す。背景は透明
+
+        font を指定しないと Pillow の既定のフォントで描くので、英数字だけにすること
+        """
+        key = (text, fontsize, color, font, max_width)
+        if key in self._rasters:
+            self._rasters.move_to_end(key)
+            return self._rasters[key]
+
+        if font is None and any(ord(c) > 0xFF for c in text):
+            # 既定のフォントでは豆腐 (□) になるので、黙って描かない
+            raise ValueError(
+                "No font is set for non-Latin subtitles (set MANUSCRIPTS_FONT)"
+            )
+
+        try:
+            rgb = ImageColor.getrgb(color)
+        except ValueError as e:
+            raise ValueError(f"Unknown font color: {color}") from e
+
+        pil_font = self._font(font, fontsize)
+        lines = self.wrap(text, fontsize, font, max_width)
+        ascent, descent = pil_font.getmetrics()
+        line_height = ascent + descent
+        step = int(line_height * (1 + self.line_spacing))
+        widths = [int(np.ceil(pil_font.getlength(line))) for line in lines]
+
+        width = max(max(widths), 1)
+        height = line_height + step * (len(lines) - 1)
+        image = Image.new("RGBA", (width, height), rgb + (0,))
+        draw = ImageDraw.Draw(image)
+        for i, (line, w) in enumerate(zip(lines, widths)):
+            # 中央揃え
+            draw.text(((width - w) // 2, i * step), line, font=pil_font, fill=rgb)
+
+        raster = np.asarray(image)
+        raster.flags.writeable = False
+        self._rasters[key] = raster
+        self.cache_bytes += raster.nbytes
+        # 今描いたものは残す
+        while self.cache_bytes > self.max_bytes and len(self._rasters) > 1:
+            _, old = self._rasters.popitem(last=False)
+            self.cache_bytes -= old.nbytes
+        return raster
+
+
+def overlay(frame: np.ndarray, raster: np.ndarray, x: int, y: int) -> np.ndarray:
+    """RGB の frame の (x, y) に RGBA の raster をアルファブレンドした新しい画像を返す"""
+    frame = frame.copy()
+    h, w = raster.shape[:2]
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + w, frame.shape[1]), min(y + h, frame.shape[0])
+    if x0 >= x1 or y0 >= y1:
+        return frame
+
+    src = raster[y0 - y : y1 - y, x0 - x : x1 - x]
+    alpha = src[..., 3:4].astype(np.float32) / 255
+    dst = frame[y0:y1, x0:x1].astype(np.float32)
+    frame[y0:y1, x0:x1] = (dst * (1 - alpha) + src[..., :3] * alpha).astype(np.uint8)
+    return frame
@@ -0,0 +1,65 @@
+import subprocess
+from pathlib import Path
+from typing import List, Tuple
+
+from .Segments import ffmpeg_binary
+
+# (開始秒, 終了秒, テキスト)
+Cue = Tuple[float, float, str]
+
+
+def shift_cues(cues: List[Cue], offset: float) -> List[Cue]:
+    return [(start + offset, end + offset, text) for start, end, text in cues]
+
+
+def _timestamp(t: float, sep: str) -> str:
+    ms = int(round(t * 1000))
+    h, ms = divmod(ms, 3600 * 1000)
+    m, ms = divmod(ms, 60 * 1000)
+    s, ms = divmod(ms, 1000)
+    return f"{h:02d}:{m:02d}:{s:02d}{sep}{ms:03d}"
+
+
+def write_srt(cues: List[Cue], path: Path):
+    blocks = []
+    for i, (start, end, text) in enumerate(cues):
+        blocks.append(
+            f"{i + 1}\n{_timestamp(start, ',')} --> {_timestamp(end, ',')}\n{text}\n"
+        )
+    Path(path).write_text("\n".join(blocks), encoding="utf8")
+
+
+def write_vtt(cues: List[Cue], path: Path):
+    blocks = ["WEBVTT\n"]
+    for start, end, text in cues:
+        blocks.append(f"{_timestamp(start, '.')} --> {_timestamp(end, '.')}\n{text}\n")
+    Path(path).write_text("\n".join(blocks), encoding="utf8")
+
+
+def mux_subtitles(video_path: Path, srt_path: Path, output_path: Path):
+    """動画を再エンコードせずに、字幕を mov_text のストリームとして追加する"""
+    cmd = [
+        ffmpeg_binary(),
+        "-y",
+        "-loglevel",
+        "error",
+        "-i",
+        str(video_path),
+        "-i",
+        str(srt_path),
+        "-map",
+        "0",
+        "-map",
+        "1",
+        "-c",
+        "copy",
+        "-c:s",
+        "mov_text",
+        str(output_path),
+    ]
+    try:
+        subprocess.run(cmd, check=True, capture_output=True)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(
+            f"Failed to mux subtitles: {e.stderr.decode(errors='replace')}"
+        ) from e
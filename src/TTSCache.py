@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+
+class TTSCache:
+    """VOICEVOX の合成結果 (wav) をディスクにキャッシュする
+
+    キーは (text, speaker, speedScale, エンジンのバージョン, サンプリングレート) のハッシュ。
+    合計サイズが max_bytes を超えたら、最後に使われたのが古いものから削除する (LRU)。
+    LRU の順序はファイルの mtime で永続化する。
+    wav と一緒に任意のメタデータ (audio_query の結果など) を json で保存できる。
+    """
+
+    SUFFIX = ".wav"
+    META_SUFFIX = ".json"
+
+    def __init__(self, cache_dir: Path, max_bytes: int = 1024 * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        # key -> サイズ。先頭ほど古い
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        paths = sorted(
+            self.cache_dir.glob(f"*{self.SUFFIX}"), key=lambda p: p.stat().st_mtime
+        )
+        for p in paths:
+            meta_path = p.with_suffix(self.META_SUFFIX)
+            meta_size = meta_path.stat().st_size if meta_path.exists() else 0
+            self._entries[p.stem] = p.stat().st_size + meta_size
+        self._total_bytes = sum(self._entries.values())
+
+    @staticmethod
+    def make_key(
+        text: str,
+        speaker: int,
+        speed: float,
+        engine_version: str,
+        sampling_rate: int = None,
+    ) -> str:
+        src = [text, int(speaker), float(speed), str(engine_version)]
+        if sampling_rate is not None:
+            src.append(int(sampling_rate))
+        src = json.dumps(src, ensure_ascii=False)
+        return hashlib.sha256(src.encode("utf8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}{self.SUFFIX}"
+
+    def _meta_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}{self.META_SUFFIX}"
+
+    def get(self, key: str):
+        data, _ = self.get_entry(key)
+        return data
+
+    def get_entry(self, key: str):
+        """(wav, メタデータ) を返す。なければ (None, None)"""
+        with self._lock:
+            path = self._path(key)
+            if key not in self._entries or not path.exists():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None, None
+            data = path.read_bytes()
+            meta_path = self._meta_path(key)
+            meta = None
+            if meta_path.exists():
+                meta = json.loads(meta_path.read_text(encoding="utf8"))
+            self._entries.move_to_end(key)
+            os.utime(path)
+            self.hits += 1
+            return data, meta
+
+    def _write(self, path: Path, data: bytes):
+        # 書きかけのファイルが読まれないように rename で置き換える
+        tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+    def put(self, key: str, data: bytes, meta: dict = None):
+        with self._lock:
+            size = len(data)
+            if meta is not None:
+                meta_bytes = json.dumps(meta, ensure_ascii=False).encode("utf8")
+                self._write(self._meta_path(key), meta_bytes)
+                size += len(meta_bytes)
+            else:
+                self._meta_path(key).unlink(missing_ok=True)
+            # wav を後に書く。wav があればメタデータも揃っている
+            self._write(self._path(key), data)
+
+            self._total_bytes -= self._entries.pop(key, 0)
+            self._entries[key] = size
+            self._total_bytes += size
+            self._evict()
+
+    def _remove(self, key: str):
+        self._path(key).unlink(missing_ok=True)
+        self._meta_path(key).unlink(missing_ok=True)
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._remove(key)
+            self._total_bytes -= size
+
+    def clear(self):
+        with self._lock:
+            for key in self._entries:
+                self._remove(key)
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+            }
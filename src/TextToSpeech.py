@@ -1,21 +1,289 @@
 import requests
+import requests.adapters
+import io
 import json
+import threading
+import time
+import wave
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, NamedTuple, Optional
+
+from .TTSCache import TTSCache
+from .Profiler import Profiler
+from .EnginePool import EnginePool
+
+# VOICEVOX は音素の長さを 24000 / 256 = 93.75 フレーム/秒 に丸めて合成する
+VOICEVOX_FRAME_RATE = 93.75
+
+
+class Mora(NamedTuple):
+    text: str
+    # 音声の先頭からの秒。[start, vowel_start) が子音、[vowel_start, end) が母音
+    start: float
+    vowel_start: float
+    end: float
+    vowel: str
+
+
+class TTSResult(NamedTuple):
+    wav: bytes
+    # wav の長さ (秒)
+    duration: float
+    # モーラごとのタイミング。無音 (pau) も含む
+    moras: List[Mora]
+
+    def speak_times(self):
+        """口を開けている区間 (有声の母音)"""
+        return [
+            (m.vowel_start, m.end)
+            for m in self.moras
+            if m.vowel in ("a", "i", "u", "e", "o")
+        ]
+
+
+def _wav_duration(wav: bytes) -> float:
+    with wave.open(io.BytesIO(wav), "rb") as f:
+        return f.getnframes() / f.getframerate()
+
+
+def mora_timeline(query: dict, duration: float = None) -> List[Mora]:
+    """audio_query の結果からモーラごとのタイミングを計算する
+
+    duration を渡すと、実際の wav の長さに合うように全体を伸縮する
+    """
+    speed = query.get("speedScale", 1.0)
+
+    def _length(sec):
+        if sec is None:
+            return 0.0
+        return round(sec / speed * VOICEVOX_FRAME_RATE) / VOICEVOX_FRAME_RATE
+
+    moras = []
+    t = _length(query.get("prePhonemeLength", 0.0))
+    for phrase in query.get("accent_phrases", []):
+        for mora in phrase["moras"]:
+            vowel_start = t + _length(mora.get("consonant_length"))
+            end = vowel_start + _length(mora["vowel_length"])
+            moras.append(Mora(mora["text"], t, vowel_start, end, mora["vowel"]))
+            t = end
+        pause = phrase.get("pause_mora")
+        if pause is not None:
+            length = pause["vowel_length"]
+            if query.get("pauseLength") is not None:
+                length = query["pauseLength"]
+            length *= query.get("pauseLengthScale", 1.0)
+            end = t + _length(length)
+            moras.append(Mora(pause["text"], t, t, end, "pau"))
+            t = end
+    t += _length(query.get("postPhonemeLength", 0.0))
+
+    if duration is not None and t > 0:
+        scale = duration / t
+        moras = [
+            Mora(m.text, m.start * scale, m.vowel_start * scale, m.end * scale, m.vowel)
+            for m in moras
+        ]
+    return moras
+
+
+def make_result(wav: bytes, query: dict = None) -> TTSResult:
+    duration = _wav_duration(wav)
+    moras = [] if query is None else mora_timeline(query, duration)
+    return TTSResult(wav, duration, moras)
 
 
 class TextToSpeech:
-    def __init__(self, voicevox_url="http://127.0.0.1:50021"):
-        self.voicevox_url = voicevox_url
+    """VOICEVOX で読み上げ音声を合成する
+
+    voicevox_url にリストを渡すと、複数のエンジンに振り分けて並列に合成する
+    """
+
+    def __init__(
+        self,
+        voicevox_url="http://127.0.0.1:50021",
+        cache: TTSCache = None,
+        max_workers: int = 4,
+        timeout: float = 30.0,
+        retries: int = 2,
+        sampling_rate: int = None,
+        profiler: Profiler = None,
+    ):
+        urls = [voicevox_url] if isinstance(voicevox_url, str) else list(voicevox_url)
+        self.voicevox_url = urls[0]
+        self.profiler = profiler if profiler is not None else Profiler()
+        # None ならエンジンのデフォルト (24000Hz)
+        self.sampling_rate = sampling_rate
+        self.cache = cache
+        self.timeout = timeout
+        self.retries = retries
+        self._engine_version = None
+        self._engine_version_retry_at = 0.0
+
+        # 接続を使い回す。同時リクエスト数ぶんのコネクションをプールしておく
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=len(urls), pool_maxsize=max_workers
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.engines = EnginePool(urls, self.session, timeout=min(timeout, 5.0))
+
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="tts"
+        )
+        self._pending: dict[tuple, Future] = {}
+        self._lock = threading.Lock()
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+    def engine_version(self) -> Optional[str]:
+        """エンジンのバージョン。聞けなければ None
+
+        エンジンを更新すると同じ入力でも音声が変わるので、キャッシュキーに含める。
+        聞けなかったときはしばらく (ヘルスチェックの間隔) 聞き直さない
+        """
+        if self._engine_version is not None:
+            return self._engine_version
+        if time.time() < self._engine_version_retry_at:
+            return None
+        # ロックの外で、ヘルスチェックと同じ短いタイムアウトで聞く。
+        # 振り分け先のエンジンは同じバージョンにそろえておく前提
+        try:
+            engine = self.engines.acquire()
+        except Exception:
+            self._engine_version_retry_at = time.time() + self.engines.health_interval
+            return None
+        try:
+            res = self.session.get(
+                engine.url + "/version", timeout=self.engines.timeout
+            )
+            res.raise_for_status()
+            version = str(res.json())
+        except Exception:
+            self._engine_version_retry_at = time.time() + self.engines.health_interval
+            return None
+        finally:
+            self.engines.release(engine)
+        with self._lock:
+            if self._engine_version is None:
+                self._engine_version = version
+            return self._engine_version
+
+    def engine_stats(self):
+        """エンジンごとのリクエスト数・失敗数・応答時間"""
+        return self.engines.stats()
+
+    def prefetch(self, text, speed=1.1, speaker=3) -> Future:
+        """バックグラウンドで合成を開始する。結果は同じ引数の tts() で受け取る"""
+        key = (text, speed, speaker)
+        with self._lock:
+            future = self._pending.get(key)
+            if future is not None:
+                return future
+            future = self.executor.submit(self._tts, text, speed, speaker, True)
+            self._pending[key] = future
+        if self.cache is not None:
+            # 結果はキャッシュから読めるので、終わったら手放す。tts() を呼ばない使い方
+            # (ワーカーが合成結果を読む segments など) で wav がたまり続けないようにする
+            future.add_done_callback(lambda f: self._forget(key, f))
+        return future
+
+    def _forget(self, key, future: Future):
+        with self._lock:
+            if self._pending.get(key) is future:
+                del self._pending[key]
+
+    def tts(self, text, speed=1.1, speaker=3, use_cache=True) -> TTSResult:
+        with self._lock:
+            future = self._pending.pop((text, speed, speaker), None)
+        if future is not None and use_cache:
+            return future.result()
+        return self._tts(text, speed, speaker, use_cache)
+
+    def _tts(self, text, speed, speaker, use_cache):
+        with self.profiler.span("tts", "tts", text=text, speaker=speaker):
+            return self._tts_impl(text, speed, speaker, use_cache)
+
+    def _tts_impl(self, text, speed, speaker, use_cache):
+        self.profiler.count("tts_calls")
+        key = None
+        if use_cache and self.cache is not None:
+            version = self.engine_version()
+            if version is not None:
+                key = TTSCache.make_key(
+                    text, speaker, speed, version, self.sampling_rate
+                )
+            else:
+                # 別のバージョンの音声と混ざらないように、わからなければキャッシュを使わない
+                self.profiler.count("tts_cache_skips")
+        if key is not None:
+            wav, query = self.cache.get_entry(key)
+            # タイミングのない古いキャッシュは合成し直して上書きする
+            if wav is not None and query is not None:
+                self.profiler.count("tts_cache_hits")
+                return make_result(wav, query)
+            self.profiler.count("tts_cache_misses")
+
+        # エンジンが複数あれば、少なくとも 1 回ずつは別のエンジンで試す
+        n_tries = max(self.retries + 1, len(self.engines))
+        for n_try in range(n_tries):
+            try:
+                engine = self.engines.acquire()
+            except requests.RequestException:
+                if n_try >= n_tries - 1:
+                    self.profiler.count("tts_failures")
+                    raise
+                self.profiler.count("tts_retries")
+                time.sleep(0.5 * 2**n_try)
+                continue
+
+            start = time.time()
+            try:
+                with self.profiler.span(
+                    "tts_request", "tts", attempt=n_try, engine=engine.url
+                ):
+                    wav, query = self._synthesize(engine.url, text, speed, speaker)
+                self.engines.release(engine, latency=time.time() - start)
+                self.profiler.count("tts_requests")
+                self.profiler.count("tts_bytes", len(wav))
+                break
+            except requests.RequestException as e:
+                # 4xx はリトライしても結果が変わらない
+                client_error = e.response is not None and e.response.status_code < 500
+                if client_error:
+                    self.engines.release(engine, latency=time.time() - start)
+                else:
+                    # 落ちている・詰まっているエンジンは外して別のエンジンで試す
+                    self.engines.release(engine, error=e)
+                if client_error or n_try >= n_tries - 1:
+                    self.profiler.count("tts_failures")
+                    raise
+                self.profiler.count("tts_retries")
+                if len(self.engines) <= 1:
+                    time.sleep(0.5 * 2**n_try)
+
+        if key is not None:
+            self.cache.put(key, wav, meta=query)
+        return make_result(wav, query)
 
-    def tts(self, text, speed=1.1, speaker=3):
-        res1 = requests.post(
-            self.voicevox_url + "/audio_query",
+    def _synthesize(self, url, text, speed, speaker):
+        res1 = self.session.post(
+            url + "/audio_query",
             params={"text": text, "speaker": speaker},
+            timeout=self.timeout,
         )
+        res1.raise_for_status()
         data = res1.json()
         data["speedScale"] = speed
-        res2 = requests.post(
-            self.voicevox_url + "/synthesis",
+        if self.sampling_rate is not None:
+            data["outputSamplingRate"] = self.sampling_rate
+        res2 = self.session.post(
+            url + "/synthesis",
             params={"speaker": speaker},
             data=json.dumps(data),
+            timeout=self.timeout,
         )
-        return res2.content
+        res2.raise_for_status()
+        return res2.content, data
@@ -0,0 +1,50 @@
+import io
+import unittest
+import wave
+
+import numpy as np
+
+from src.AudioBuffer import decode_wav, silence
+
+
+def make_wav(samples, rate: int = 24000, channels: int = 1) -> bytes:
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as f:
+        f.setnchannels(channels)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(np.asarray(samples, dtype="<i2").tobytes())
+    return buf.getvalue()
+
+
+class TestAudioBuffer(unittest.TestCase):
+    def test_decode_mono(self):
+        # モノラルは両チャンネルに複製する
+        samples, rate = decode_wav(make_wav([0, 16384, -32768]))
+        self.assertEqual(rate, 24000)
+        self.assertEqual(samples.dtype, np.float32)
+        self.assertEqual(samples.shape, (3, 2))
+        np.testing.assert_allclose(samples[:, 0], [0.0, 0.5, -1.0])
+        np.testing.assert_array_equal(samples[:, 0], samples[:, 1])
+
+    def test_decode_stereo_to_mono(self):
+        samples, _ = decode_wav(make_wav([16384, 0], channels=2), channels=1)
+        np.testing.assert_allclose(samples, [[0.25]])
+
+    def test_unsupported_width(self):
+        buf = io.BytesIO()
+        with wave.open(buf, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(1)
+            f.setframerate(8000)
+            f.writeframes(b"\x80\x80")
+        with self.assertRaises(ValueError):
+            decode_wav(buf.getvalue())
+
+    def test_silence(self):
+        self.assertEqual(silence(0.5, 44100).shape, (22050, 2))
+        self.assertEqual(silence(-1.0, 44100).shape, (0, 2))
+
+
+if __name__ == "__main__":
+    unittest.main()
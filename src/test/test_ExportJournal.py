@@ -0,0 +1,59 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from src.ExportJournal import ExportJournal
+
+
+class TestExportJournal(unittest.TestCase):
+    def test_resume(self):
+        with tempfile.TemporaryDirectory() as d:
+            d = Path(d)
+            segment_path = d / "a.mp4"
+            segment_path.touch()
+            journal = ExportJournal(d / "journal.jsonl")
+            journal.record("1.png", "tts", fingerprint="a")
+            journal.record(
+                "1.png",
+                "segment",
+                fingerprint="a",
+                segment=str(segment_path),
+                duration=1.5,
+                cues=[],
+            )
+            journal.record(
+                "2.png",
+                "segment",
+                fingerprint="b",
+                segment=str(d / "missing.mp4"),
+                duration=1.0,
+                cues=[],
+            )
+            journal.record("3.png", "failed", fingerprint="c", error="boom")
+            # 書きかけの行は無視する
+            with open(journal.path, "a", encoding="utf8") as f:
+                f.write('{"slide": "4.png", "sta')
+
+            resumed = ExportJournal(d / "journal.jsonl", resume=True)
+            # ファイルが残っているセグメントだけ再利用する
+            self.assertEqual(list(resumed.segments()), ["a"])
+            self.assertEqual(resumed.segments()["a"]["duration"], 1.5)
+            self.assertEqual(resumed.failures(), {"3.png": "boom"})
+
+            # 成功したら失敗の記録は消える
+            resumed.record(
+                "3.png",
+                "segment",
+                fingerprint="c",
+                segment=str(segment_path),
+                duration=1.0,
+                cues=[],
+            )
+            self.assertEqual(resumed.failures(), {})
+
+            # resume しなければ最初から
+            self.assertEqual(ExportJournal(d / "journal.jsonl").segments(), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
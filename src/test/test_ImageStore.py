@@ -0,0 +1,48 @@
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from PIL import Image
+
+from src.ImageStore import ImageStore
+
+
+class TestImageStore(unittest.TestCase):
+    def test_shared_decode(self):
+        with tempfile.TemporaryDirectory() as d:
+            d = Path(d)
+            Image.new("RGB", (40, 20), "red").save(d / "1.png")
+            # アニメーションの書き出しなどで、同じ内容の画像が別のファイルになっている
+            shutil.copyfile(d / "1.png", d / "2.png")
+            Image.new("RGB", (40, 20), "blue").save(d / "3.png")
+
+            store = ImageStore(lambda size: (size[0] // 2, size[1] // 2))
+            self.assertEqual(store.size(d / "1.png"), (20, 10))
+            a = store.get(d / "1.png")
+            b = store.get(d / "2.png")
+            c = store.get(d / "3.png")
+            self.assertIs(a, b)
+            self.assertIsNot(a, c)
+            self.assertEqual(a.shape, (10, 20, 3))
+            self.assertFalse(a.flags.writeable)
+            self.assertEqual(store.stats()["hits"], 1)
+            self.assertEqual(store.stats()["misses"], 2)
+
+    def test_evict(self):
+        with tempfile.TemporaryDirectory() as d:
+            d = Path(d)
+            for i, color in enumerate(["red", "green", "blue"]):
+                Image.new("RGB", (10, 10), color).save(d / f"{i}.png")
+
+            # 2 枚ぶんしか持たない
+            store = ImageStore(lambda size: size, max_bytes=2 * 10 * 10 * 3)
+            for i in range(3):
+                store.get(d / f"{i}.png")
+            self.assertEqual(store.stats()["images"], 2)
+            store.get(d / "0.png")
+            self.assertEqual(store.stats()["misses"], 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+from pathlib import Path
+
+from src.InsertVideoCache import InsertVideoCache
+from src.Segments import ffmpeg_binary, file_digest, probe_h264_level, probe_video
+
+
+def _make_video(path: Path, size: str, rate: int = 10, params=()):
+    subprocess.run(
+        [ffmpeg_binary(), "-y", "-loglevel", "error", "-f", "lavfi"]
+        + ["-i", f"testsrc=size={size}:rate={rate}", "-t", "1", "-pix_fmt", "yuv420p"]
+        + list(params)
+        + [str(path)],
+        check=True,
+    )
+
+
+class TestInsertVideoCache(unittest.TestCase):
+    def test_convert(self):
+        with tempfile.TemporaryDirectory() as d:
+            d = Path(d)
+            video_path = d / "in.mp4"
+            _make_video(video_path, "160x120")
+            cache = InsertVideoCache(d / "cache", preset="ultrafast")
+
+            out_path = cache.get(video_path, 320, 180, 10, 44100)
+            info = probe_video(out_path)
+            self.assertEqual((info["width"], info["height"]), (320, 180))
+            self.assertEqual(info["audio_codec"], "aac")
+            self.assertEqual(info["audio_rate"], 44100)
+
+            # 2 回目はキャッシュから
+            self.assertEqual(cache.get(video_path, 320, 180, 10, 44100), out_path)
+            self.assertEqual(cache.stats(), {"hits": 1, "misses": 1})
+
+    def test_digest_once(self):
+        # 大きな動画を何度も読まないように、ハッシュはファイルが変わるまで使い回す
+        with tempfile.TemporaryDirectory() as d:
+            d = Path(d)
+            video_path = d / "in.mp4"
+            _make_video(video_path, "160x120")
+            with mock.patch(
+                "src.InsertVideoCache.file_digest", wraps=file_digest
+            ) as digest:
+                cache = InsertVideoCache(d / "cache")
+                first = cache.digest(video_path)
+                cache.make_key(video_path, 320, 180, 10, 44100)
+                # 別のプロセスのワーカーも cache_dir に記録したハッシュを使う
+                self.assertEqual(
+                    InsertVideoCache(d / "cache").digest(video_path), first
+                )
+                self.assertEqual(digest.call_count, 1)
+
+                _make_video(video_path, "320x180")
+                self.assertNotEqual(cache.digest(video_path), first)
+                self.assertEqual(digest.call_count, 2)
+
+    def test_stream_copy(self):
+        with tempfile.TemporaryDirectory() as d:
+            d = Path(d)
+            video_path = d / "in.mp4"
+            _make_video(video_path, "320x180")
+            cache = InsertVideoCache(d / "cache")
+            cmd = cache.command(video_path, d / "out.mp4", 320, 180, 10, 44100)
+            self.assertIn("copy", cmd[cmd.index("-c:v") + 1])
+            cmd = cache.command(video_path, d / "out.mp4", 640, 360, 10, 44100)
+            self.assertIn("-vf", cmd)
+            # フレームレートが違えばエンコードし直す
+            cmd = cache.command(video_path, d / "out.mp4", 320, 180, 30, 44100)
+            self.assertIn("-vf", cmd)
+
+    def test_stream_copy_timescale(self):
+        # コピーするときはタイムベースをスライドのセグメントにそろえる
+        with tempfile.TemporaryDirectory() as d:
+            d = Path(d)
+            video_path = d / "in.mp4"
+            _make_video(
+                video_path, "320x180", params=["-video_track_timescale", "90000"]
+            )
+            self.assertEqual(probe_video(video_path)["tbn"], 90000)
+            cache = InsertVideoCache(d / "cache")
+            info = probe_video(cache.get(video_path, 320, 180, 10, 44100))
+            self.assertEqual((info["fps"], info["tbr"], info["tbn"]), (10, 10, 10240))
+
+    def test_level(self):
+        # レベルが高すぎる動画はエンコードし直す
+        with tempfile.TemporaryDirectory() as d:
+            d = Path(d)
+            video_path = d / "in.mp4"
+            _make_video(video_path, "320x180", params=["-level", "5.1"])
+            self.assertEqual(probe_h264_level(video_path), 51)
+            cache = InsertVideoCache(d / "cache")
+            cmd = cache.command(video_path, d / "out.mp4", 320, 180, 10, 44100)
+            self.assertIn("-vf", cmd)
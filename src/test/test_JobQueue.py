@@ -0,0 +1,48 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from src.JobQueue import JobQueue
+
+
+def _add(a, b, on_progress):
+    on_progress(0.5, "adding")
+    return a + b
+
+
+def _fail(on_progress):
+    raise ValueError("boom")
+
+
+class TestJobQueue(unittest.TestCase):
+    def test_result(self):
+        queue = JobQueue(max_workers=2)
+        ok = queue.submit(_add, 1, 2)
+        ng = queue.submit(_fail)
+        self.assertEqual(queue.wait(ok, timeout=5)["result"], 3)
+        job = queue.wait(ng, timeout=5)
+        self.assertEqual(job["state"], "failed")
+        self.assertIn("boom", job["error"])
+        self.assertEqual(queue.stats()["succeeded"], 1)
+        queue.shutdown()
+
+    def test_persistent(self):
+        with tempfile.TemporaryDirectory() as d:
+            queue = JobQueue(state_dir=Path(d))
+            job_id = queue.submit(_add, 1, 2)
+            queue.wait(job_id, timeout=5)
+            queue.shutdown()
+
+            # 別のプロセスから同じ job id で問い合わせられる
+            job = JobQueue(state_dir=Path(d)).get(job_id)
+            self.assertEqual(job["state"], "succeeded")
+            self.assertEqual(job["result"], 3)
+
+    def test_interrupted(self):
+        with tempfile.TemporaryDirectory() as d:
+            queue = JobQueue(state_dir=Path(d))
+            # 実行中のままプロセスが終了したジョブ
+            queue._save({"id": "x", "state": "running", "finished_at": None})
+
+            job = JobQueue(state_dir=Path(d)).get("x")
+            self.assertEqual(job["state"], "failed")
@@ -0,0 +1,36 @@
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from src.LipSyncVideo import LipSyncVideo
+
+data_dir = Path(__file__).parent.parent.parent / "data"
+
+
+class TestLipSyncVideo(unittest.TestCase):
+    def test_mouth_mask(self):
+        mask = LipSyncVideo.mouth_mask(2.0, 10, [(0.5, 1.0)], flap_rate=None)
+        self.assertEqual(len(mask), 20)
+        self.assertEqual(mask.nonzero()[0].tolist(), [5, 6, 7, 8, 9])
+
+    def test_mouth_mask_from_audio(self):
+        rate = 1000
+        samples = np.zeros(rate * 2, dtype=np.float32)
+        samples[rate // 2 : rate] = np.sin(np.arange(rate // 2) * 0.3)
+        mask = LipSyncVideo.mouth_mask_from_audio(samples, rate, 10)
+        self.assertEqual(mask.nonzero()[0].tolist(), [5, 6, 7, 8, 9])
+
+    def test_create_video(self):
+        lipsync = LipSyncVideo(data_dir / "zundamon")
+        mask = np.array([False, True, False])
+        clip = lipsync.create_video(0.3, 10, [], mask=mask, height=100)
+        closed, opened = lipsync.character_frames(100)
+        self.assertTrue((clip.get_frame(0.0) == closed[..., :3]).all())
+        self.assertTrue((clip.get_frame(0.15) == opened[..., :3]).all())
+
+        background = np.zeros((200, 300, 3), dtype=np.uint8)
+        clip = lipsync.create_video(
+            0.3, 10, [], mask=mask, height=100, backgrounds=[(0.0, background)]
+        )
+        self.assertEqual(clip.get_frame(0.15).shape, (200, 300, 3))
@@ -0,0 +1,63 @@
+import json
+import unittest
+from pathlib import Path
+
+from src.Manuscript import (
+    Manuscript,
+    SpeakerChange,
+    Utterance,
+    VideoInsert,
+    Wait,
+    compile_manuscript,
+)
+
+
+class TestManuscript(unittest.TestCase):
+    def test_compile(self):
+        script = compile_manuscript(
+            "こんにちは\n\n<wait:1.5><speaker: id=1, speed=1.2>ずんだもんです\n<wait:0.5>\nさようなら",
+            3,
+            1.0,
+        )
+        self.assertEqual(
+            script.events,
+            [
+                Utterance("こんにちは", 3, 1.0, 1),
+                Wait(1.5, 3),
+                SpeakerChange(1, 1.2, 3),
+                Utterance("ずんだもんです", 1, 1.2, 3),
+                Wait(0.5, 4),
+                Utterance("さようなら", 3, 1.0, 5),
+            ],
+        )
+        self.assertEqual(
+            [(u.text, wait) for u, wait in script.timeline()],
+            [("こんにちは", 0.0), ("ずんだもんです", 1.5), ("さようなら", 0.5)],
+        )
+        self.assertEqual(script.issues, [])
+
+    def test_issues(self):
+        script = compile_manuscript("<wait:abc>あ\n<foo:1>い\n<speaker:id=x>う", 3, 1.0)
+        # 誤ったタグも知らないタグも読み上げない
+        self.assertEqual([u.text for u, _ in script.timeline()], ["あ", "い", "う"])
+        self.assertEqual(
+            [(i.line, i.level) for i in script.issues],
+            [(1, "error"), (2, "warning"), (3, "error")],
+        )
+        self.assertEqual(len(script.errors), 2)
+        self.assertIn(":1: error:", script.report("スライド1.txt"))
+
+    def test_video(self):
+        script = compile_manuscript("<video:a.mp4>\n無視される", 3, 1.0, Path("dir"))
+        self.assertEqual(script.events, [VideoInsert(str(Path("dir/a.mp4")), 1)])
+        self.assertEqual(script.video.path, str(Path("dir/a.mp4")))
+        self.assertEqual(script.timeline(), [])
+
+        script = compile_manuscript("あ\n<video:a.mp4>", 3, 1.0)
+        self.assertIsNone(script.video)
+        self.assertEqual(len(script.errors), 1)
+
+    def test_json(self):
+        script = compile_manuscript("<wait:1>あ\n<bar:2>", 3, 1.0)
+        data = json.loads(json.dumps(script.to_json()))
+        self.assertEqual(Manuscript.from_json(data), script)
@@ -0,0 +1,68 @@
+import tempfile
+import unittest
+import zipfile
+from pathlib import Path
+
+from src.PptxImporter import PptxImporter
+
+sample_dir = Path(__file__).parent.parent.parent / "samples"
+
+IMAGE_REL = (
+    '<Relationship Id="rId9" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/image" '
+    'Target="../media/image1.png"/></Relationships>'
+)
+
+
+def make_pptx(path: Path):
+    """sample.pptx の 2 枚目を非表示にし、3 枚目に画像を埋め込んだものを作る"""
+    with zipfile.ZipFile(sample_dir / "from_pptx/sample.pptx") as src:
+        with zipfile.ZipFile(path, "w") as dst:
+            for name in src.namelist():
+                data = src.read(name)
+                if name == "ppt/slides/slide2.xml":
+                    data = data.replace(b"<p:sld ", b'<p:sld show="0" ', 1)
+                elif name == "ppt/slides/_rels/slide3.xml.rels":
+                    data = data.replace(b"</Relationships>", IMAGE_REL.encode())
+                dst.writestr(name, data)
+            dst.writestr("ppt/media/image1.png", b"png")
+
+
+class TestPptxImporter(unittest.TestCase):
+    def test_notes(self):
+        # PowerPoint で書き出したノートと同じになる
+        with tempfile.TemporaryDirectory() as d:
+            PptxImporter(sample_dir / "from_pptx/sample.pptx").import_to(Path(d))
+            for expected in (sample_dir / "from_pptx/sample").glob("*.txt"):
+                actual = Path(d) / expected.name
+                self.assertEqual(
+                    actual.read_text(encoding="utf8"),
+                    expected.read_text(encoding="utf8"),
+                )
+
+    def test_hidden_and_media(self):
+        with tempfile.TemporaryDirectory() as d:
+            d = Path(d)
+            make_pptx(d / "deck.pptx")
+            workdir = d / "out"
+            workdir.mkdir()
+            PptxImporter(d / "deck.pptx").import_to(workdir)
+
+            # 非表示のスライドは飛ばし、番号を詰める
+            expected_dir = sample_dir / "from_pptx/sample"
+            self.assertEqual(
+                sorted(p.name for p in workdir.glob("*.txt")),
+                ["スライド1.txt", "スライド2.txt"],
+            )
+            self.assertEqual(
+                (workdir / "スライド2.txt").read_text(encoding="utf8"),
+                (expected_dir / "スライド3.txt").read_text(encoding="utf8"),
+            )
+            # 埋め込みメディアは書き出し後のスライド番号で取り出す
+            self.assertEqual(
+                [p.name for p in (workdir / "media").iterdir()],
+                ["スライド2_image1.png"],
+            )
+            self.assertEqual(
+                (workdir / "media/スライド2_image1.png").read_bytes(), b"png"
+            )
@@ -0,0 +1,83 @@
+import subprocess
+import sys
+import unittest
+
+from src.Profiler import Profiler, StageProgress
+
+
+class TestProfiler(unittest.TestCase):
+    def test_span_and_count(self):
+        profiler = Profiler()
+        with profiler.span("slide", "render", slide="1.png"):
+            with profiler.span("line", "render"):
+                pass
+        profiler.count("subprocesses", 2)
+        profiler.count("subprocesses")
+
+        data = profiler.to_json()
+        self.assertEqual([s["name"] for s in data["spans"]], ["line", "slide"])
+        self.assertEqual(data["spans"][1]["args"], {"slide": "1.png"})
+        self.assertEqual(data["counters"], {"subprocesses": 3})
+        self.assertIn("self", data["peak_rss"])
+        self.assertEqual(set(profiler.totals()), {"slide", "line"})
+
+    def test_count_subprocesses(self):
+        # activate() の中で起動した子プロセスだけを数える
+        profiler = Profiler()
+        with profiler.activate():
+            subprocess.run([sys.executable, "-c", "pass"], check=True)
+            subprocess.run([sys.executable, "-c", "pass"], check=True)
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+        self.assertEqual(profiler.counters["subprocesses"], 2)
+
+    def test_span_records_on_error(self):
+        profiler = Profiler()
+        with self.assertRaises(ValueError):
+            with profiler.span("encode"):
+                raise ValueError
+        self.assertEqual(len(profiler.spans), 1)
+
+    def test_merge(self):
+        worker = Profiler()
+        with worker.span("encode"):
+            pass
+        worker.count("bytes_written", 100)
+
+        profiler = Profiler()
+        profiler.count("bytes_written", 50)
+        profiler.merge(worker.to_json())
+        self.assertEqual(profiler.counters["bytes_written"], 150)
+        self.assertEqual(len(profiler.spans), 1)
+        self.assertIsNotNone(profiler.to_json()["peak_rss"]["workers"])
+
+    def test_chrome_trace(self):
+        profiler = Profiler()
+        with profiler.span("concat", "export"):
+            pass
+        profiler.count("subprocesses")
+        events = profiler.to_chrome_trace()["traceEvents"]
+        self.assertEqual([e["ph"] for e in events], ["X", "C"])
+        self.assertGreaterEqual(events[0]["ts"], 0)
+
+
+class TestStageProgress(unittest.TestCase):
+    def test_weights(self):
+        reports = []
+        progress = StageProgress(
+            lambda p, m: reports.append(p), {"tts": 1, "render": 3}
+        )
+        progress.update("tts", 1.0, "")
+        progress.update("render", 0.5, "")
+        progress.update("render", 1.0, "")
+        self.assertEqual(reports, [0.25, 0.625, 1.0])
+
+    def test_monotonic(self):
+        reports = []
+        progress = StageProgress(lambda p, m: reports.append(p), {"a": 1, "b": 1})
+        progress.update("a", 0.8, "")
+        progress.update("a", 0.2, "")
+        self.assertEqual(reports, [0.4, 0.4])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,31 @@
+import unittest
+
+from src.Profiles import apply_profile
+
+
+class TestProfiles(unittest.TestCase):
+    def test_preview(self):
+        config = {
+            "profile": "preview",
+            "input": {"type": "png_txt", "path": "slides"},
+            "output": {"path": "out/video.mp4", "fps": 30},
+        }
+        applied = apply_profile(config)
+        self.assertEqual(applied["output"]["fps"], 5)
+        self.assertEqual(applied["output"]["path"], "out/video.preview.mp4")
+        self.assertNotIn("profile", applied)
+        # 元の config は変更しない
+        self.assertEqual(config["output"]["fps"], 30)
+        # 何度適用しても同じ
+        self.assertEqual(apply_profile(applied), applied)
+
+    def test_custom(self):
+        config = {
+            "profile": "preview",
+            "profiles": {"preview": {"fps": 2}, "draft": {"scale": 0.25}},
+            "output": {"path": "video.mp4"},
+        }
+        self.assertEqual(apply_profile(config)["output"]["fps"], 2)
+        self.assertEqual(apply_profile(config, "draft")["output"]["scale"], 0.25)
+        with self.assertRaises(ValueError):
+            apply_profile(config, "unknown")
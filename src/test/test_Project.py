@@ -1,16 +1,59 @@
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
 import unittest
 from pathlib import Path
+from unittest import mock
 import yaml
 import dotenv
 
+from benchmarks.fake_voicevox import FakeVoicevox
 from src.Project import Project
+from src.Segments import ffmpeg_binary, probe_video
 
 dotenv.load_dotenv()
 
 sample_dir = Path(__file__).parent.parent.parent / "samples"
 
 
+def ffmpeg_info(path: Path) -> str:
+    """ffmpeg -i が表示するストリームの情報"""
+    result = subprocess.run(
+        [ffmpeg_binary(), "-hide_banner", "-i", str(path)],
+        capture_output=True,
+        text=True,
+    )
+    return result.stderr
+
+
+def copy_slides(dst: Path):
+    """サンプルのスライドをコピーする。前に書き出したセグメントは持ち込まない"""
+    shutil.copytree(
+        sample_dir / "from_png_txt/slides", dst, ignore=shutil.ignore_patterns("__*")
+    )
+
+
 class TestProject(unittest.TestCase):
+    def test_lazy_imports(self):
+        # 起動を速くするため、moviepy などは書き出すときまで読み込まない
+        code = (
+            "import sys; import src.Project; "
+            "print(*sorted(m for m in sys.modules if m.split('.')[0] in "
+            "('moviepy', 'IPython', 'imageio', 'proglog', 'cv2')))"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=sample_dir.parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        self.assertEqual(result.stdout.strip(), "")
+
     def test_png_txt(self):
         with open(sample_dir / "from_png_txt/config.yml", "r", encoding="utf8") as f:
             config = yaml.safe_load(f)
@@ -22,6 +65,411 @@ class TestProject(unittest.TestCase):
             self.assertTrue(out_path.exists())
             out_path.unlink()
 
+    def test_no_font(self):
+        # フォントがなければ、字幕を焼き込まずに書き出す
+        with open(sample_dir / "from_png_txt/config.yml", "r", encoding="utf8") as f:
+            config = yaml.safe_load(f)
+        with tempfile.TemporaryDirectory() as d:
+            config["output"]["path"] = str(Path(d) / "out.mp4")
+            with mock.patch.dict(os.environ):
+                os.environ.pop("MANUSCRIPTS_FONT", None)
+                with Project(config) as project:
+                    project.subtitle_renderer.render = mock.Mock(
+                        side_effect=AssertionError("rendered subtitles")
+                    )
+                    self.assertTrue(project.export_video(), project.errors)
+            self.assertTrue((Path(d) / "out.mp4").exists())
+
+    def test_still(self):
+        # 静止画は still_fps で書き出し、出力の fps まではエンコーダでフレームを複製する
+        with open(sample_dir / "from_png_txt/config.yml", "r", encoding="utf8") as f:
+            config = yaml.safe_load(f)
+        config["output"].update(render_mode="still", fps=10, still_fps=2)
+        with tempfile.TemporaryDirectory() as d:
+            config["output"]["path"] = str(Path(d) / "out.mp4")
+            with Project(config) as project:
+                self.assertEqual(
+                    project.encode_params(True),
+                    (2, ["-r", "10", "-tune", "stillimage"]),
+                )
+                # 挿入動画は通常の fps のまま
+                self.assertEqual(project.encode_params(False), (10, None))
+                self.assertTrue(project.export_video(), project.errors)
+            self.assertIn("10 tbr", ffmpeg_info(Path(d) / "out.mp4"))
+
+    def test_soft_subtitles(self):
+        # 字幕は焼き込まず、.srt/.vtt に書き出して mp4 に字幕ストリームとして入れる
+        with open(sample_dir / "from_png_txt/config.yml", "r", encoding="utf8") as f:
+            config = yaml.safe_load(f)
+        with tempfile.TemporaryDirectory() as d:
+            out_path = Path(d) / "out.mp4"
+            config["output"].update(path=str(out_path), subtitles="soft")
+            with Project(config) as project:
+                project.subtitle_renderer.render = mock.Mock(
+                    side_effect=AssertionError("burned in subtitles")
+                )
+                self.assertTrue(project.export_video(), project.errors)
+            self.assertIn("Subtitle: mov_text", ffmpeg_info(out_path))
+            srt = out_path.with_suffix(".srt").read_text(encoding="utf8")
+            self.assertEqual(srt.count(" --> "), 6)
+            self.assertTrue(out_path.with_suffix(".vtt").exists())
+
+    def test_no_temporary_audio(self):
+        # 読み上げ音声はメモリ上でデコードするので、作業ディレクトリに wav を残さない
+        with open(sample_dir / "from_png_txt/config.yml", "r", encoding="utf8") as f:
+            config = yaml.safe_load(f)
+        with tempfile.TemporaryDirectory() as d:
+            d = Path(d)
+            copy_slides(d / "slides")
+            config["input"]["path"] = str(d / "slides")
+            config["output"]["path"] = str(d / "out.mp4")
+            with Project(config) as project:
+                self.assertTrue(project.export_video(), project.errors)
+            self.assertEqual(list((d / "slides").glob("*.wav")), [])
+            self.assertIn("Audio: aac", ffmpeg_info(d / "out.mp4"))
+
+    def test_segments(self):
+        # スライドごとにワーカーで書き出し、再エンコードせずに連結する
+        with tempfile.TemporaryDirectory() as d:
+            d = Path(d)
+            copy_slides(d / "slides")
+            config = {
+                "input": {"type": "png_txt", "path": str(d / "slides")},
+                "output": {
+                    "path": str(d / "out.mp4"),
+                    "fps": 1,
+                    "workers": 2,
+                    "segment_codec": "mpeg4",
+                    "segment_dir": str(d / "segments"),
+                },
+            }
+            with Project(config) as project:
+                self.assertTrue(project.export_video(), project.errors)
+            self.assertEqual(len(list((d / "segments").glob("*.mp4"))), 3)
+            # 連結しても segment_codec のまま
+            self.assertIn("Video: mpeg4", ffmpeg_info(d / "out.mp4"))
+
+    def test_worker_project_once(self):
+        # ワーカーは Project をデッキごとに 1 回だけ作り、タスクでは index だけを受け取る
+        from concurrent.futures import ThreadPoolExecutor
+
+        import src.Project as project_module
+
+        with tempfile.TemporaryDirectory() as d:
+            d = Path(d)
+            copy_slides(d / "slides")
+            config = {
+                "input": {"type": "png_txt", "path": str(d / "slides")},
+                "output": {"path": str(d / "out.mp4"), "fps": 1, "workers": 1},
+            }
+            with Project(config) as project, ThreadPoolExecutor(1) as executor:
+                with (
+                    mock.patch.object(project_module, "Project", wraps=Project) as cls,
+                    mock.patch.object(
+                        executor, "submit", wraps=executor.submit
+                    ) as submit,
+                ):
+                    self.assertTrue(project.export_video(executor=executor))
+                self.assertEqual(project.rendered_slides, 3)
+            self.assertEqual(cls.call_count, 1)
+            self.assertEqual(
+                [call.args[2] for call in submit.call_args_list], [0, 1, 2]
+            )
+            self.assertEqual(list((d / "slides").glob("*.deck.pickle")), [])
+            for deck_path in list(project_module._worker_decks):
+                project_module._close_worker_deck(deck_path)
+
+    def test_reuse_segments(self):
+        # 変わっていないスライドのセグメントは描き直さず、使わなくなったものは消す
+        with open(sample_dir / "from_png_txt/config.yml", "r", encoding="utf8") as f:
+            config = yaml.safe_load(f)
+        with tempfile.TemporaryDirectory() as d:
+            d = Path(d)
+            copy_slides(d / "slides")
+            config["input"]["path"] = str(d / "slides")
+            config["output"].update(
+                path=str(d / "out.mp4"), workers=1, segment_dir=str(d / "segments")
+            )
+
+            with Project(config) as project:
+                self.assertTrue(project.export_video(), project.errors)
+            before = {
+                p.name: p.stat().st_mtime_ns for p in (d / "segments").glob("*.mp4")
+            }
+
+            (d / "slides/スライド2.txt").write_text("書き換えた台本", encoding="utf8")
+            with Project(config) as project:
+                self.assertTrue(project.export_video(), project.errors)
+            after = {
+                p.name: p.stat().st_mtime_ns for p in (d / "segments").glob("*.mp4")
+            }
+
+            self.assertEqual(len(after), 3)
+            kept = set(before) & set(after)
+            self.assertEqual(len(kept), 2)
+            for name in kept:
+                self.assertEqual(after[name], before[name])
+
+    def test_single_pass(self):
+        with open(sample_dir / "from_png_txt/config.yml", "r", encoding="utf8") as f:
+            config = yaml.safe_load(f)
+        config["output"]["checkpoint"] = False
+
+        with Project(config) as project:
+            out_path = Path(project.config["output"]["path"])
+            out_path.unlink(missing_ok=True)
+            self.assertTrue(project.export_video(), project.errors)
+            self.assertTrue(out_path.exists())
+            out_path.unlink()
+
+    def test_resume(self):
+        # 既定の書き出しでも、落ちたら --resume で書き出し済みのスライドを飛ばせる
+        with open(sample_dir / "from_png_txt/config.yml", "r", encoding="utf8") as f:
+            config = yaml.safe_load(f)
+        with tempfile.TemporaryDirectory() as d:
+            d = Path(d)
+            copy_slides(d / "slides")
+            config["input"]["path"] = str(d / "slides")
+            config["output"]["path"] = str(d / "out.mp4")
+
+            with Project(config) as project:
+                write_segment = project.write_segment
+
+                def fail_last(img_path, script, segment_path):
+                    if img_path.name == "スライド3.PNG":
+                        raise RuntimeError("boom")
+                    return write_segment(img_path, script, segment_path)
+
+                project.write_segment = fail_last
+                self.assertFalse(project.export_video())
+            self.assertTrue((d / "slides/__stream__.journal.jsonl").exists())
+
+            config["output"]["resume"] = True
+            with Project(config) as project:
+                self.assertTrue(project.export_video(), project.errors)
+                self.assertEqual(project.rendered_slides, 1)
+            self.assertTrue((d / "out.mp4").exists())
+            self.assertFalse((d / "slides/__stream__.journal.jsonl").exists())
+
+    def test_streaming(self):
+        with open(sample_dir / "from_png_txt/config.yml", "r", encoding="utf8") as f:
+            config = yaml.safe_load(f)
+        config["output"]["streaming"] = True
+
+        with Project(config) as project:
+            out_path = Path(project.config["output"]["path"])
+            out_path.unlink(missing_ok=True)
+            self.assertTrue(project.export_video(), project.errors)
+            self.assertTrue(out_path.exists())
+            # セグメントは次の書き出しで使えるように残す
+            self.assertEqual(
+                len(list((project.workdir / "__stream__").glob("*.mp4"))), 3
+            )
+            self.assertTrue((project.workdir / "__stream__.json").exists())
+            # 最後まで書き出せたらジャーナルは残さない
+            self.assertFalse((project.workdir / "__stream__.journal.jsonl").exists())
+            # 字幕の画像はスライドごとに手放す
+            self.assertEqual(project.subtitle_renderer.cache_bytes, 0)
+            out_path.unlink()
+
+    def test_unknown_engine_version(self):
+        # エンジンのバージョンがわからなければ、セグメントは次の書き出しで使わない
+        with open(sample_dir / "from_png_txt/config.yml", "r", encoding="utf8") as f:
+            config = yaml.safe_load(f)
+
+        fingerprints = []
+        for _ in range(2):
+            with Project(config) as project:
+                all_pairs = project.list_slides()
+                scripts = project.compile_manuscripts(all_pairs)
+                with mock.patch.object(
+                    project.tts, "engine_version", return_value=None
+                ):
+                    fingerprints.append(
+                        [
+                            project.fingerprint_slide(img_path, script)
+                            for (img_path, _), script in zip(all_pairs, scripts)
+                        ]
+                    )
+                    self.assertEqual(
+                        fingerprints[-1][0],
+                        project.fingerprint_slide(all_pairs[0][0], scripts[0]),
+                    )
+        self.assertNotEqual(fingerprints[0][0], fingerprints[1][0])
+
+    def test_cache_budget(self):
+        with open(sample_dir / "from_png_txt/config.yml", "r", encoding="utf8") as f:
+            config = yaml.safe_load(f)
+        config["output"]["image_cache_mb"] = 48
+        config["output"]["subtitle_cache_mb"] = 16
+
+        with Project(config) as project:
+            # キャッシュの上限は予算から差し引く
+            self.assertEqual(project.reserve_cache_memory(256 * 2**20), 192 * 2**20)
+            # 予算の半分を超えるぶんは縮める
+            self.assertEqual(project.reserve_cache_memory(64 * 2**20), 32 * 2**20)
+            self.assertEqual(project.image_store.max_bytes, 24 * 2**20)
+            self.assertEqual(project.subtitle_renderer.max_bytes, 8 * 2**20)
+
+    def test_segment_cues(self):
+        # セグメントはフレーム単位で切り上げられるので、字幕は実際の長さでずらす
+        with open(sample_dir / "from_png_txt/config.yml", "r", encoding="utf8") as f:
+            config = yaml.safe_load(f)
+        with tempfile.TemporaryDirectory() as d:
+            d = Path(d)
+            copy_slides(d / "slides")
+            config["input"]["path"] = str(d / "slides")
+            config["output"].update(
+                path=str(d / "out.mp4"), workers=1, subtitles="sidecar"
+            )
+
+            with Project(config) as project:
+                self.assertTrue(project.export_video(), project.errors)
+
+            manifest = json.loads((d / "slides/__segments__.json").read_text())
+            offset = 0.0
+            offsets = []
+            for slide in manifest["slides"]:
+                duration = probe_video(slide["segment"])["duration"]
+                self.assertAlmostEqual(slide["duration"], duration, delta=0.02)
+                offsets.append(offset)
+                offset += duration
+            self.assertAlmostEqual(
+                probe_video(d / "out.mp4")["duration"], offset, delta=0.05
+            )
+
+            # 各スライドの最初の字幕が、連結した動画でのスライドの開始位置から始まる
+            srt = (d / "out.srt").read_text(encoding="utf8")
+            starts = [
+                int(h) * 3600 + int(m) * 60 + int(s) + int(ms) / 1000
+                for h, m, s, ms in re.findall(r"(\d+):(\d+):(\d+),(\d+) -->", srt)
+            ]
+            i = 0
+            for slide, slide_offset in zip(manifest["slides"], offsets):
+                self.assertAlmostEqual(
+                    starts[i], slide_offset + slide["cues"][0][0], delta=0.05
+                )
+                i += len(slide["cues"])
+
+    def test_slide_range_keeps_segments(self):
+        # 一部のスライドだけ書き出しても、ほかのスライドのセグメントは次に使えるように残す
+        with open(sample_dir / "from_png_txt/config.yml", "r", encoding="utf8") as f:
+            config = yaml.safe_load(f)
+        with tempfile.TemporaryDirectory() as d:
+            d = Path(d)
+            copy_slides(d / "slides")
+            config["input"]["path"] = str(d / "slides")
+            config["output"].update(path=str(d / "out.mp4"), workers=1)
+
+            with Project(config) as project:
+                self.assertTrue(project.export_video(), project.errors)
+                self.assertEqual(project.rendered_slides, 3)
+
+            config["output"]["slide_range"] = [2, 2]
+            with Project(config) as project:
+                self.assertTrue(project.export_video(), project.errors)
+                self.assertEqual(project.rendered_slides, 0)
+            self.assertEqual(len(list((d / "slides/__segments__").glob("*.mp4"))), 3)
+
+            del config["output"]["slide_range"]
+            with Project(config) as project:
+                self.assertTrue(project.export_video(), project.errors)
+                self.assertEqual(project.rendered_slides, 0)
+
+    def test_incremental(self):
+        # 変わっていないスライドのセグメントは再利用し、使わなくなったものは消す
+        with open(sample_dir / "from_png_txt/config.yml", "r", encoding="utf8") as f:
+            config = yaml.safe_load(f)
+        with tempfile.TemporaryDirectory() as d:
+            d = Path(d)
+            copy_slides(d / "slides")
+            config["input"]["path"] = str(d / "slides")
+            config["output"].update(
+                path=str(d / "out.mp4"), workers=1, segment_dir=str(d / "seg1")
+            )
+
+            with Project(config) as project:
+                self.assertTrue(project.export_video(), project.errors)
+                self.assertEqual(project.rendered_slides, 3)
+
+            (d / "slides/スライド2.txt").write_text("書き換えた台本", encoding="utf8")
+            with Project(config) as project:
+                self.assertTrue(project.export_video(), project.errors)
+                self.assertEqual(project.rendered_slides, 1)
+            self.assertEqual(len(list((d / "seg1").glob("*.mp4"))), 3)
+
+            # セグメントの置き場所を変えても、前のセグメントを使う
+            config["output"]["segment_dir"] = str(d / "seg2")
+            with Project(config) as project:
+                self.assertTrue(project.export_video(), project.errors)
+                self.assertEqual(project.rendered_slides, 0)
+            self.assertEqual(len(list((d / "seg2").glob("*.mp4"))), 3)
+            self.assertEqual(len(list((d / "seg1").glob("*.mp4"))), 0)
+
+    def test_incremental_streaming(self):
+        # 既定の書き出しでも、変わっていないスライドのセグメントは再利用する
+        with open(sample_dir / "from_png_txt/config.yml", "r", encoding="utf8") as f:
+            config = yaml.safe_load(f)
+        with tempfile.TemporaryDirectory() as d:
+            d = Path(d)
+            copy_slides(d / "slides")
+            config["input"]["path"] = str(d / "slides")
+            config["output"]["path"] = str(d / "out.mp4")
+
+            with Project(config) as project:
+                self.assertTrue(project.export_video(), project.errors)
+                self.assertEqual(project.rendered_slides, 3)
+
+            (d / "slides/スライド2.txt").write_text("書き換えた台本", encoding="utf8")
+            with Project(config) as project:
+                self.assertTrue(project.export_video(), project.errors)
+                self.assertEqual(project.rendered_slides, 1)
+                # moviepy の音声と映像・長さを調べるので 3 回、連結で 1 回
+                self.assertEqual(project.profiler.counters["subprocesses"], 4)
+            # 使わなくなったセグメントは消す
+            self.assertEqual(len(list((d / "slides/__stream__").glob("*.mp4"))), 3)
+
+            config["output"]["incremental"] = False
+            with Project(config) as project:
+                self.assertTrue(project.export_video(), project.errors)
+                self.assertEqual(project.rendered_slides, 3)
+
+    def test_still_segment_length(self):
+        # still_fps が低くても、セグメントは出力の fps の 1 フレーム以内の長さにする
+        with open(sample_dir / "from_png_txt/config.yml", "r", encoding="utf8") as f:
+            config = yaml.safe_load(f)
+        config["output"].update(render_mode="still", fps=5, still_fps=1)
+        with tempfile.TemporaryDirectory() as d:
+            segment_path = Path(d) / "segment.mp4"
+            with Project(config) as project:
+                all_pairs = project.list_slides()
+                scripts = project.compile_manuscripts(all_pairs)
+                clip = project.make_slide_clip(all_pairs[0][0], scripts[0])
+                clip_duration = clip.duration
+                project.encode_segment(clip, segment_path)
+            duration = probe_video(segment_path)["duration"]
+            self.assertGreaterEqual(duration, clip_duration - 0.02)
+            self.assertLessEqual(duration, clip_duration + 1 / 5 + 0.02)
+
+    def test_segments_without_tts_cache(self):
+        # キャッシュがなければワーカーが合成するので、親プロセスでは合成しない
+        with open(sample_dir / "from_png_txt/config.yml", "r", encoding="utf8") as f:
+            config = yaml.safe_load(f)
+        with tempfile.TemporaryDirectory() as d, FakeVoicevox() as fake:
+            d = Path(d)
+            copy_slides(d / "slides")
+            config["input"]["path"] = str(d / "slides")
+            config["output"].update(
+                path=str(d / "out.mp4"),
+                workers=1,
+                tts_cache=False,
+                voicevox_url=fake.url,
+            )
+            with Project(config) as project:
+                self.assertTrue(project.export_video(), project.errors)
+            # 6 行ぶんの audio_query と synthesis
+            self.assertEqual(fake.requests, 12)
+
     def test_pptx(self):
         with open(sample_dir / "from_pptx/config.yml", "r", encoding="utf8") as f:
             config = yaml.safe_load(f)
@@ -0,0 +1,70 @@
+import subprocess
+import tempfile
+import unittest
+from pathlib import Path
+
+from src.Segments import HlsPlaylist, ffmpeg_binary
+
+
+def _make_video(path: Path, seconds: float = 1.0, gop: int = 250):
+    subprocess.run(
+        [ffmpeg_binary(), "-y", "-loglevel", "error", "-f", "lavfi"]
+        + ["-i", "testsrc=size=160x120:rate=10", "-t", str(seconds)]
+        + ["-pix_fmt", "yuv420p", "-g", str(gop)]
+        + [str(path)],
+        check=True,
+    )
+
+
+class TestHlsPlaylist(unittest.TestCase):
+    def test_in_order(self):
+        with tempfile.TemporaryDirectory() as d:
+            d = Path(d)
+            video_path = d / "in.mp4"
+            _make_video(video_path)
+            playlist = HlsPlaylist(d / "out.m3u8")
+
+            # 前のスライドが終わるまでは追加しない
+            self.assertEqual(playlist.add(1, video_path), 0)
+            self.assertNotIn("#EXTINF", playlist.playlist_path.read_text())
+            self.assertEqual(playlist.add(0, video_path), 2)
+            text = playlist.playlist_path.read_text()
+            self.assertEqual(text.count("#EXTINF:1.000,"), 2)
+            self.assertIn("out_hls/00001.ts", text)
+            self.assertTrue((d / "out_hls" / "00001.ts").exists())
+            self.assertNotIn("#EXT-X-ENDLIST", text)
+
+            playlist.end()
+            self.assertIn("#EXT-X-ENDLIST", playlist.playlist_path.read_text())
+
+    def test_real_duration(self):
+        # タイムスタンプと #EXTINF はセグメントの実際の長さから決める
+        with tempfile.TemporaryDirectory() as d:
+            d = Path(d)
+            _make_video(d / "a.mp4", 1.5)
+            _make_video(d / "b.mp4")
+            playlist = HlsPlaylist(d / "out.m3u8")
+            playlist.add(0, d / "a.mp4")
+            playlist.add(1, d / "b.mp4")
+            self.assertEqual(playlist.durations, [1.5, 1.0])
+            self.assertIn("#EXTINF:1.500,", playlist.playlist_path.read_text())
+
+    def test_target_duration(self):
+        # 長いセグメントはキーフレームで分け、TARGETDURATION は変えない
+        with tempfile.TemporaryDirectory() as d:
+            d = Path(d)
+            _make_video(d / "long.mp4", 7.0, gop=20)
+            playlist = HlsPlaylist(d / "out.m3u8", target_duration=2)
+            self.assertIn("#EXT-X-TARGETDURATION:2", playlist.playlist_path.read_text())
+            self.assertEqual(playlist.add(0, d / "long.mp4"), 1)
+            self.assertEqual(len(playlist.durations), 4)
+            self.assertAlmostEqual(sum(playlist.durations), 7.0)
+            self.assertLessEqual(max(playlist.durations), 2)
+            text = playlist.playlist_path.read_text()
+            self.assertIn("#EXT-X-TARGETDURATION:2", text)
+            self.assertIn("out_hls/00003.ts", text)
+            self.assertEqual(len(list((d / "out_hls").glob("*.ts"))), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+
+import numpy as np
+
+from src.SubtitleRenderer import SubtitleRenderer, overlay
+
+
+class TestSubtitleRenderer(unittest.TestCase):
+    def test_render(self):
+        renderer = SubtitleRenderer()
+        img = renderer.render("Hello", 20, "green")
+        self.assertEqual(img.ndim, 3)
+        self.assertEqual(img.shape[2], 4)
+        self.assertGreater(img[..., 3].max(), 0)
+        self.assertIs(renderer.render("Hello", 20, "green"), img)
+
+    def test_wrap(self):
+        renderer = SubtitleRenderer()
+        text = "hello world " * 10
+        lines = renderer.wrap(text, 20, None, max_width=100)
+        self.assertGreater(len(lines), 1)
+        self.assertEqual(" ".join(lines), text.strip())
+
+        single = renderer.render("hello", 20, "green", max_width=1000)
+        wrapped = renderer.render(text, 20, "green", max_width=100)
+        self.assertGreater(wrapped.shape[0], single.shape[0])
+
+    def test_cache_bytes(self):
+        renderer = SubtitleRenderer()
+        first = renderer.render("a", 20, "green")
+        renderer.max_bytes = first.nbytes
+        renderer.render("b", 20, "green")
+        # 上限を超えたら古いものから手放し、今描いたものは残す
+        self.assertEqual(len(renderer._rasters), 1)
+        self.assertIsNot(renderer.render("a", 20, "green"), first)
+        renderer.clear()
+        self.assertEqual(renderer.cache_bytes, 0)
+        self.assertEqual(len(renderer._rasters), 0)
+
+    def test_default_font(self):
+        # 既定のフォントには日本語がないので、豆腐 (□) を描かずにエラーにする
+        with self.assertRaises(ValueError):
+            SubtitleRenderer().render("こんにちは", 20, "green")
+
+    def test_unknown_color(self):
+        with self.assertRaises(ValueError):
+            SubtitleRenderer().render("a", 20, "no-such-color")
+
+    def test_overlay(self):
+        frame = np.zeros((4, 4, 3), dtype=np.uint8)
+        raster = np.zeros((2, 2, 4), dtype=np.uint8)
+        raster[..., 0] = 200
+        raster[0, :, 3] = 255
+        out = overlay(frame, raster, 3, 2)
+        # 不透明な画素だけが乗り、はみ出した部分は切り捨てる
+        self.assertEqual(out[2, 3, 0], 200)
+        self.assertEqual(out[3, 3, 0], 0)
+        self.assertEqual(out[:2].max(), 0)
+        self.assertEqual(frame.max(), 0)
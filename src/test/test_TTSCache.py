@@ -0,0 +1,45 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from src.TTSCache import TTSCache
+
+
+class TestTTSCache(unittest.TestCase):
+    def test_hit_miss(self):
+        with tempfile.TemporaryDirectory() as d:
+            cache = TTSCache(Path(d))
+            key = TTSCache.make_key("こんにちは", 3, 1.1, "0.14.0")
+            self.assertIsNone(cache.get(key))
+            cache.put(key, b"wav")
+            self.assertEqual(cache.get(key), b"wav")
+            self.assertEqual(cache.stats()["hits"], 1)
+            self.assertEqual(cache.stats()["misses"], 1)
+
+            # 別プロセスから開いても残っている
+            self.assertEqual(TTSCache(Path(d)).get(key), b"wav")
+
+    def test_key(self):
+        key = TTSCache.make_key("a", 3, 1.1, "0.14.0")
+        self.assertNotEqual(key, TTSCache.make_key("a", 3, 1.2, "0.14.0"))
+        self.assertNotEqual(key, TTSCache.make_key("a", 2, 1.1, "0.14.0"))
+        self.assertNotEqual(key, TTSCache.make_key("a", 3, 1.1, "0.15.0"))
+
+    def test_lru_eviction(self):
+        with tempfile.TemporaryDirectory() as d:
+            cache = TTSCache(Path(d), max_bytes=10)
+            cache.put("a", b"1234")
+            cache.put("b", b"1234")
+            cache.get("a")
+            cache.put("c", b"1234")
+            self.assertIsNotNone(cache.get("a"))
+            self.assertIsNone(cache.get("b"))
+            self.assertIsNotNone(cache.get("c"))
+
+    def test_meta(self):
+        with tempfile.TemporaryDirectory() as d:
+            cache = TTSCache(Path(d))
+            cache.put("a", b"wav", meta={"speedScale": 1.1})
+            self.assertEqual(cache.get_entry("a"), (b"wav", {"speedScale": 1.1}))
+            cache.put("a", b"wav")
+            self.assertEqual(cache.get_entry("a"), (b"wav", None))
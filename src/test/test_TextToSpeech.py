@@ -0,0 +1,160 @@
+import io
+import unittest
+import wave
+
+from src.TextToSpeech import make_result, mora_timeline
+
+
+def _mora(text, consonant, vowel):
+    return {
+        "text": text,
+        "consonant_length": consonant,
+        "vowel_length": 0.1,
+        "vowel": vowel,
+    }
+
+
+QUERY = {
+    "accent_phrases": [
+        {
+            "moras": [_mora("コ", 0.05, "o"), _mora("ン", None, "N")],
+            "pause_mora": {"text": "、", "vowel_length": 0.2, "vowel": "pau"},
+        },
+        {"moras": [_mora("ニ", 0.05, "i")], "pause_mora": None},
+    ],
+    "speedScale": 1.0,
+    "prePhonemeLength": 0.1,
+    "postPhonemeLength": 0.1,
+}
+
+
+class TestTextToSpeech(unittest.TestCase):
+    def test_mora_timeline(self):
+        moras = mora_timeline(QUERY)
+        self.assertEqual([m.text for m in moras], ["コ", "ン", "、", "ニ"])
+        # 長さは VOICEVOX と同じく 1/93.75 秒単位に丸める
+        frame = 1 / 93.75
+        self.assertAlmostEqual(moras[0].start, 0.1, delta=frame)
+        self.assertAlmostEqual(moras[0].vowel_start, 0.15, delta=frame)
+        self.assertAlmostEqual(moras[-1].end, 0.7, delta=frame)
+
+        # 速くすると短くなる
+        fast = mora_timeline(dict(QUERY, speedScale=2.0))
+        self.assertAlmostEqual(fast[-1].end, 0.35, delta=frame)
+
+    def test_result(self):
+        buf = io.BytesIO()
+        with wave.open(buf, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(24000)
+            f.writeframes(b"\0\0" * 12000)
+        result = make_result(buf.getvalue(), QUERY)
+        self.assertAlmostEqual(result.duration, 0.5)
+        # wav の長さに合わせて伸縮する
+        moras = mora_timeline(QUERY)
+        scale = result.moras[0].start / moras[0].start
+        self.assertLess(scale, 1.0)
+        self.assertAlmostEqual(result.moras[-1].end, moras[-1].end * scale)
+        self.assertEqual(
+            [
+                m.vowel
+                for m in result.moras
+                if (m.vowel_start, m.end) in result.speak_times()
+            ],
+            ["o", "i"],
+        )
+        self.assertEqual(make_result(buf.getvalue()).moras, [])
+
+
+class TestFakeVoicevox(unittest.TestCase):
+    def test_tts(self):
+        from benchmarks.fake_voicevox import FakeVoicevox
+        from src.TextToSpeech import TextToSpeech
+
+        with FakeVoicevox() as fake:
+            tts = TextToSpeech(fake.url, sampling_rate=44100)
+            result = tts.tts("こんにちは、ずんだもんです。", speed=1.2, speaker=3)
+            # 同じ入力なら同じ wav になる
+            self.assertEqual(
+                result.wav, tts.tts("こんにちは、ずんだもんです。", 1.2, 3).wav
+            )
+            self.assertEqual(len(result.speak_times()), 12)
+            self.assertLess(result.moras[-1].end, result.duration)
+            tts.close()
+
+    def test_prefetch_releases_results(self):
+        import tempfile
+        from pathlib import Path
+
+        from benchmarks.fake_voicevox import FakeVoicevox
+        from src.TextToSpeech import TextToSpeech
+        from src.TTSCache import TTSCache
+
+        with tempfile.TemporaryDirectory() as d, FakeVoicevox() as fake:
+            tts = TextToSpeech(fake.url, cache=TTSCache(Path(d)), sampling_rate=44100)
+            futures = [tts.prefetch(f"テキスト{i}", 1.0, 3) for i in range(4)]
+            # コールバックまで終わるのを待つ
+            tts.executor.shutdown(wait=True)
+            # キャッシュにあるので、tts() で受け取らなくても結果を持ち続けない
+            self.assertEqual(len(tts._pending), 0)
+            self.assertEqual(tts.tts("テキスト0", 1.0, 3).wav, futures[0].result().wav)
+            self.assertEqual(fake.requests, 8)
+            tts.close()
+
+    def test_unknown_engine_version(self):
+        import tempfile
+        from pathlib import Path
+        from unittest import mock
+
+        import requests
+
+        from benchmarks.fake_voicevox import FakeVoicevox
+        from src.TextToSpeech import TextToSpeech
+        from src.TTSCache import TTSCache
+
+        with tempfile.TemporaryDirectory() as d, FakeVoicevox() as fake:
+            tts = TextToSpeech(fake.url, cache=TTSCache(Path(d)), sampling_rate=44100)
+            with mock.patch.object(
+                tts.session, "get", side_effect=requests.Timeout
+            ) as get:
+                self.assertIsNone(tts.engine_version())
+                # 聞けなかったことを覚えて、すぐには聞き直さない
+                self.assertIsNone(tts.engine_version())
+                self.assertEqual(get.call_count, 1)
+                # バージョンがわからなければ、キャッシュには入れない
+                tts.tts("テキスト", 1.0, 3)
+            self.assertEqual(tts.cache.stats()["entries"], 0)
+            self.assertEqual(tts.profiler.counters["tts_cache_skips"], 1)
+
+            tts._engine_version_retry_at = 0.0
+            self.assertEqual(tts.engine_version(), "0.0.0-fake")
+            tts.tts("テキスト", 1.0, 3)
+            self.assertEqual(tts.cache.stats()["entries"], 1)
+            tts.close()
+
+    def test_engines(self):
+        import socket
+
+        from benchmarks.fake_voicevox import FakeVoicevox
+        from src.TextToSpeech import TextToSpeech
+
+        # 使われていないポートを落ちているエンジンとして混ぜる
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            dead_url = f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+        with FakeVoicevox(latency=0.05) as a, FakeVoicevox(latency=0.05) as b:
+            tts = TextToSpeech([dead_url, a.url, b.url], max_workers=4, retries=0)
+            futures = [tts.prefetch(f"テキスト{i}", 1.0, 3) for i in range(8)]
+            for future in futures:
+                future.result()
+            stats = {s["url"]: s for s in tts.engine_stats()}
+            self.assertFalse(stats[dead_url]["healthy"])
+            self.assertEqual(stats[dead_url]["requests"], 0)
+            # 残りの 2 つに振り分けられる
+            self.assertEqual(stats[a.url]["requests"] + stats[b.url]["requests"], 8)
+            self.assertGreater(stats[a.url]["requests"], 0)
+            self.assertGreater(stats[b.url]["requests"], 0)
+            self.assertIsNotNone(stats[a.url]["mean_latency"])
+            tts.close()
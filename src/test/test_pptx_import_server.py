@@ -0,0 +1,131 @@
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+
+import requests
+from PIL import Image
+
+from pptx_import_server import MAX_WAIT, make_handler, run_import
+from src.JobQueue import JobQueue
+from src.PptxImporter import RASTERIZERS, SlideRasterizer
+from src.Profiler import Profiler
+from src.Project import Project
+
+sample_dir = Path(__file__).parent.parent.parent / "samples"
+
+
+class FakeRasterizer(SlideRasterizer):
+    """LibreOffice の代わりに、単色の画像を 3 枚書き出す"""
+
+    def __init__(self, width: int = 1280):
+        self.width = width
+
+    def rasterize(self, pptx_path, out_dir):
+        out_paths = []
+        for i in range(3):
+            out_path = Path(out_dir) / f"スライド{i + 1}.png"
+            Image.new("RGB", (self.width, self.width * 9 // 16)).save(out_path)
+            out_paths.append(out_path)
+        return out_paths
+
+
+class TestPptxImportServer(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.pptx_path = Path(self.tmp.name) / "sample.pptx"
+        shutil.copyfile(sample_dir / "from_pptx/sample.pptx", self.pptx_path)
+
+        self.job_queue = JobQueue(max_workers=2)
+        self.profiler = Profiler()
+        self.server = ThreadingHTTPServer(
+            ("127.0.0.1", 0), make_handler(self.job_queue, self.profiler)
+        )
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        patcher = mock.patch.dict(RASTERIZERS, {"fake": FakeRasterizer})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.job_queue.shutdown()
+        self.tmp.cleanup()
+
+    def config(self, importer="python"):
+        return {
+            "input": {
+                "type": "pptx",
+                "path": str(self.pptx_path),
+                "importer": importer,
+                "rasterizer": "fake",
+                "slide_width": 64,
+                "import_server_url": self.url,
+                "import_timeout": 30,
+            },
+            "output": {"tts_cache": False},
+        }
+
+    def test_import(self):
+        project = Project(self.config(), user_import_server=True)
+        project.tts.close()
+        self.assertEqual(project.errors, "")
+
+        workdir = self.pptx_path.with_suffix("")
+        self.assertTrue((workdir / "__pptx_imported__").exists())
+        for i in range(3):
+            self.assertTrue((workdir / f"スライド{i + 1}.png").exists())
+            self.assertEqual(
+                (workdir / f"スライド{i + 1}.txt").read_text(encoding="utf8"),
+                (sample_dir / f"from_pptx/sample/スライド{i + 1}.txt").read_text(
+                    encoding="utf8"
+                ),
+            )
+        stats = requests.get(self.url + "/stats", timeout=5).json()
+        self.assertEqual(stats["succeeded"], 1)
+        self.assertEqual(self.profiler.counters["import_jobs"], 1)
+
+    def test_failure(self):
+        project = Project(self.config(importer="keynote"), user_import_server=True)
+        project.tts.close()
+        self.assertIn("PPTX import failed", project.errors)
+        self.assertIn("Unknown importer: keynote", project.errors)
+        stats = requests.get(self.url + "/stats", timeout=5).json()
+        self.assertEqual(stats["failed"], 1)
+        self.assertEqual(self.profiler.counters["import_failures"], 1)
+
+    def test_wait(self):
+        res = requests.get(self.url + "/jobs/x", params={"wait": "soon"}, timeout=5)
+        self.assertEqual(res.status_code, 400)
+        res = requests.get(self.url + "/jobs/x", params={"wait": "nan"}, timeout=5)
+        self.assertEqual(res.status_code, 400)
+        # 長すぎる wait は MAX_WAIT 秒までにする
+        with mock.patch.object(self.job_queue, "wait", return_value=None) as wait:
+            res = requests.get(self.url + "/jobs/x", params={"wait": 1e9}, timeout=5)
+        self.assertEqual(res.status_code, 404)
+        wait.assert_called_once_with("x", timeout=MAX_WAIT)
+
+    def test_progress(self):
+        # ノートの取り出しと画像の書き出しの段階ごとに進捗を伝える
+        reports = []
+        run_import(
+            self.config(),
+            Profiler(),
+            on_progress=lambda p, m: reports.append((p, m)),
+        )
+        messages = [m for _, m in reports]
+        self.assertIn("Notes 1/3", messages)
+        self.assertIn("Rasterizing slides", messages)
+        progress = [p for p, _ in reports]
+        self.assertEqual(progress, sorted(progress))
+        self.assertEqual(progress[-1], 1.0)
+        self.assertGreater(len(set(progress)), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,28 +1,43 @@
 import yaml
 import streamlit as st
+import streamlit.components.v1 as components
 from pathlib import Path
+from urllib.parse import quote, unquote
+import os
 import sys
 import shutil
 import datetime
+import time
+import uuid
 import dotenv
 
 dotenv.load_dotenv(".env")
-import moviepy.editor
+from PIL import ImageColor
 
 sys.path.append(str(Path(__file__).parent.parent))
 from src.Project import Project
+from src.JobQueue import JobQueue
+
+# 同時に変換するジョブの数。全ユーザーで共有する
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", 1))
+# 完成した動画は static serving (.streamlit/config.toml) でディスクからそのまま配信する
+VIDEOS_DIR = Path(__file__).parent / "static" / "videos"
+VIDEOS_URL = "app/static/videos"
+# 書き出し中の動画は、終わったスライドから HLS で再生できるようにする
+PREVIEW_PLAYLIST = "preview.m3u8"
 
 
 @st.cache_resource
 def get_manuscript_colors():
-    colors = moviepy.editor.TextClip.list("color")[3:]
-    colors = [c.decode() for c in colors]
-    print(f"{len(colors)} font color options were found.")
-    return colors
+    # 字幕は PIL で描くので、PIL が名前で解釈できる色 (CSS の色名) から選ばせる。
+    # ImageMagick を起動して一覧を取ると、ページの表示が遅くなる
+    return sorted(ImageColor.colormap)
 
 
-def on_progress(progress_bar, percentage: float, status: str):
-    progress_bar.progress(percentage, status)
+@st.cache_resource
+def get_job_queue():
+    # ジョブの状態は保存しておき、ページを再読み込みしても job id で続きを表示できるようにする
+    return JobQueue(max_workers=RENDER_WORKERS, state_dir=Path("tmp/jobs"))
 
 
 def remove_old_tmp_dirs():
@@ -31,13 +46,97 @@ def remove_old_tmp_dirs():
             continue
 
         try:
-            dt = datetime.datetime.strptime(d.name, "%Y%m%d-%H%M%S")
+            dt = datetime.datetime.strptime(d.name[:15], "%Y%m%d-%H%M%S")
             if (datetime.datetime.now() - dt).days > 1:
                 shutil.rmtree(d)
                 print(f"Removed {d}")
         except ValueError:
             continue
 
+    if VIDEOS_DIR.exists():
+        for d in VIDEOS_DIR.iterdir():
+            if time.time() - d.stat().st_mtime > 2 * 24 * 60 * 60:
+                shutil.rmtree(d)
+                print(f"Removed {d}")
+
+
+def render_video(config, input_path: Path, video_dir: Path, on_progress):
+    """バックグラウンドのジョブとして動画を書き出し、配信用の URL を返す"""
+    output_path = Path(config["output"]["path"])
+    error_logs = ""
+    video_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        with Project(config, user_import_server=True) as project:
+            project.export_video(on_progress)
+            error_logs = project.errors
+    finally:
+        input_path.unlink(missing_ok=True)
+
+    if not output_path.exists():
+        raise RuntimeError(error_logs)
+
+    shutil.move(str(output_path), video_dir / output_path.name)
+    return f"{VIDEOS_URL}/{video_dir.name}/{quote(output_path.name)}"
+
+
+def show_hls_player(url: str):
+    # Safari 以外は HLS を再生できないので hls.js を使う
+    components.html(
+        f"""
+        <video id="player" controls style="width: 100%"></video>
+        <script src="https://cdn.jsdelivr.net/npm/hls.js@1"></script>
+        <script>
+        const player = document.getElementById("player");
+        if (player.canPlayType("application/vnd.apple.mpegurl")) {{
+            player.src = "{url}";
+        }} else if (Hls.isSupported()) {{
+            // 書き出し中の EVENT プレイリストはライブ扱いで末尾から再生されるので、先頭から再生する
+            const hls = new Hls({{startPosition: 0}});
+            hls.loadSource("{url}");
+            hls.attachMedia(player);
+        }}
+        </script>
+        """,
+        height=400,
+    )
+
+
+def show_job(job_queue: JobQueue, job_id: str, video_name: str = None):
+    job = job_queue.get(job_id)
+    if job is None:
+        st.warning(f"ジョブ {job_id} が見つかりません")
+        return
+
+    if job["state"] in ("queued", "running"):
+        if job["state"] == "queued":
+            n_waiting = job_queue.stats()["queued"]
+            st.progress(0, f"Waiting for other jobs... ({n_waiting} queued)")
+        else:
+            st.progress(job["progress"], job["message"] or "Exporting a video...")
+            # 書き出しの終わったスライドから見られる
+            if (
+                video_name is not None
+                and (VIDEOS_DIR / video_name / PREVIEW_PLAYLIST).exists()
+            ):
+                show_hls_player(f"{VIDEOS_URL}/{video_name}/{PREVIEW_PLAYLIST}")
+        # ジョブの状態をポーリングして進捗を更新する
+        time.sleep(1.0)
+        st.rerun()
+    elif job["state"] == "succeeded":
+        st.progress(100, "Successfully exported a video!")
+        url = job["result"]
+        name = unquote(Path(url).name)
+        if not (VIDEOS_DIR / Path(url).parent.name / name).exists():
+            st.warning("動画の保存期間が過ぎました。もう一度変換してください")
+            return
+        st.markdown(
+            f'<a href="{url}" download="{name}">Download {name}</a>',
+            unsafe_allow_html=True,
+        )
+    else:
+        st.progress(100, "Failed to export a video...")
+        st.error(job["error"])
+
 
 def save_uploaded_file(file, save_dir):
     if file is None:
@@ -89,7 +188,9 @@ def main():
         color_options = get_manuscript_colors()
         fontcolor = st.selectbox("字幕の色", color_options, color_options.index("green"))
 
-        voicevox_url = st.text_input("読み上げAPIのURL", value="http://127.0.0.1:50021")
+        voicevox_url = st.text_input(
+            "読み上げAPIのURL (複数ならカンマ区切り)", value="http://127.0.0.1:50021"
+        )
         speaker_id = st.number_input("話者ID", min_value=0, max_value=100, value=3)
         speaker_speed = st.number_input("読み上げ速度", min_value=0.01, max_value=100.0, value=1.0)
 
@@ -161,18 +262,18 @@ def main():
                  
 """)        
 
+    job_queue = get_job_queue()
+
     if st.button("変換"):
         remove_old_tmp_dirs()
 
-        st.session_state["output_path"] = None
-
         if pptx_file is not None:
-            with st.spinner("Converting to video..."):
+            with st.spinner("Uploading..."):
                 # ベースの設定
                 with open("samples/from_pptx/config.yml", "r", encoding="utf8") as f:
                     config = yaml.safe_load(f)
 
-                tmp_dir = Path(f'tmp/{datetime.datetime.now().strftime("%Y%m%d-%H%M%S")}')
+                tmp_dir = Path(f'tmp/{datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")}')
                 input_path = save_uploaded_file(pptx_file, tmp_dir)
                 config["input"]["path"] = str(input_path)
 
@@ -181,7 +282,9 @@ def main():
                         save_uploaded_file(f, tmp_dir)
 
                 output_path = input_path.parent / f"{pptx_file.name}.mp4"
-                config["output"]["voicevox_url"] = voicevox_url
+                config["output"]["voicevox_url"] = [
+                    url.strip() for url in voicevox_url.split(",") if url.strip() != ""
+                ]
                 config["output"]["speaker_id"] = speaker_id
                 config["output"]["speaker_speed"] = speaker_speed
                 config["output"]["fontsize_ratio"] = fontsize_percentage / 100
@@ -190,31 +293,17 @@ def main():
                 config["output"]["manuscript_line_interval"] = manuscript_line_interval
                 config["output"]["path"] = str(output_path)
 
-                progress_bar = st.progress(0, "Exporting a video...")
+                # 変換はバックグラウンドで行い、job id を URL に入れておく
+                video_dir = VIDEOS_DIR / uuid.uuid4().hex
+                config["output"]["progressive"] = "hls"
+                config["output"]["progressive_path"] = str(video_dir / PREVIEW_PLAYLIST)
+                job_id = job_queue.submit(render_video, config, input_path, video_dir)
+                st.query_params["job"] = job_id
+                st.query_params["video"] = video_dir.name
 
-                error_logs = ""
-                with Project(config, user_import_server=True) as project:
-                    project.export_video(lambda v, t: on_progress(progress_bar, v, t))
-                    error_logs = project.errors
-
-                input_path.unlink()
-    
-                if output_path.exists():
-                    progress_bar.progress(100, "Successfully exported a video!")
-                    st.session_state["output_path"] = output_path
-                else:
-                    progress_bar.progress(100, "Failed to export a video...")
-                    st.error(error_logs)
-
-    if "output_path" in st.session_state and st.session_state["output_path"] is not None:
-        output_path = st.session_state["output_path"]
-        if output_path.exists():
-            st.download_button(
-                label=f"Download {output_path.name}",
-                data=output_path.read_bytes(),
-                file_name=output_path.name,
-                mime="video/mp4",
-            )
+    job_id = st.query_params.get("job")
+    if job_id is not None:
+        show_job(job_queue, job_id, st.query_params.get("video"))
 
 
 if __name__ == "__main__":